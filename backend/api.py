@@ -1,25 +1,240 @@
+import asyncio
+import base64
+import binascii
+import json
 import os
+import socket
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from typing import Optional
 
-import requests
+import queries
 import uvicorn
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from fastapi import FastAPI, HTTPException
+from database import Connection, Database, DatabaseConfig, DatabaseError
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from mysql.connector import Error, connect
-from parcel_tw import Platform, track
+from fastapi.responses import JSONResponse, StreamingResponse
+from mailer import Mailer, SMTPConfig
+from outbox import DISCORD, EMAIL, OutboxDispatcher, RetryPolicy
+from parcel_tw import (
+    CarrierUnavailableError,
+    Platform,
+    TrackingError,
+    TrackingInfo,
+    async_lookup,
+    async_track_many,
+)
+from parcel_tw.captcha import create_recognizer, set_recognizer
+from parcel_tw.cache import MemoryCacheBackend, SQLiteCacheBackend, TrackingCache
+from parcel_tw.circuit_breaker import CircuitBreakerConfig
+from parcel_tw.client import ClientConfig
+from parcel_tw.core import (
+    DEFAULT_CONCURRENCY,
+    TrackerRegistry,
+    get_registry,
+    set_cache,
+    set_registry,
+)
+from parcel_tw.metrics import metrics
+from parcel_tw.rate_limit import DEFAULT_RATE_LIMITS, RateLimit
+from polling import (
+    PollPolicy,
+    PollState,
+    deferred_poll_state,
+    next_poll_state,
+    utcnow,
+)
 from pydantic import BaseModel
+from stream import UNAVAILABLE, StreamHub
 
 MYSQL_URL = os.getenv("MYSQL_URL")
 MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
 
+# MySQL connection pool, MYSQL_DRIVER=aiomysql uses the non-blocking driver
+# instead of running mysql-connector in worker threads
+MYSQL_CONFIG = DatabaseConfig(
+    host=MYSQL_URL,
+    user=MYSQL_USER,
+    password=MYSQL_PASSWORD,
+    database=MYSQL_DATABASE,
+    driver=os.getenv("MYSQL_DRIVER", "mysql-connector"),
+    pool_size=int(os.getenv("MYSQL_POOL_SIZE", 5)),
+    checkout_timeout=float(os.getenv("MYSQL_CHECKOUT_TIMEOUT", 5)),
+    health_check_interval=float(os.getenv("MYSQL_HEALTH_CHECK_INTERVAL", 30)),
+)
+
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 
+# Status change notifications are written to an outbox table and delivered to
+# the bot webhook in batches of OUTBOX_BATCH_SIZE, with retries, as arrays of
+# up to OUTBOX_POST_SIZE notifications per request
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_POST_SIZE = int(os.getenv("OUTBOX_POST_SIZE", 50))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", 8))
+OUTBOX_LEASE_TTL = float(os.getenv("OUTBOX_LEASE_TTL", 120))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 5))
+OUTBOX_TIMEOUT = float(os.getenv("OUTBOX_TIMEOUT", 10))
+OUTBOX_RETRY_POLICY = RetryPolicy(
+    base_delay=float(os.getenv("OUTBOX_RETRY_DELAY", 5)),
+    max_delay=float(os.getenv("OUTBOX_MAX_RETRY_DELAY", 3600)),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10)),
+)
+
+# Email notifications, disabled without an SMTP_HOST. The changes of an email
+# subscriber leased in the same outbox batch are merged into one digest, and
+# the digests of a batch are sent over a single SMTP connection.
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_CONFIG = SMTPConfig(
+    host=SMTP_HOST,
+    port=int(os.getenv("SMTP_PORT", 587)),
+    username=os.getenv("SMTP_USERNAME"),
+    password=os.getenv("SMTP_PASSWORD"),
+    starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+    sender=os.getenv("SMTP_SENDER", "parcel-tracker@localhost"),
+    timeout=float(os.getenv("SMTP_TIMEOUT", 10)),
+)
+
+# Tracking result cache, use CACHE_BACKEND=sqlite with a CACHE_PATH on a
+# shared volume to share the cache between replicas on the same host
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_PATH = os.getenv("CACHE_PATH", "/tmp/parcel_tw_cache.sqlite3")
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", 10000))
+CACHE_NOT_FOUND_TTL = float(os.getenv("CACHE_NOT_FOUND_TTL", 30))
+
+# 7-11 captcha recognizer: auto, tesseract, tesserocr or classifier. The
+# classifier is off unless chosen, it needs a model trained on recorded
+# captchas with `python -m benchmarks.captcha --save-model`
+CAPTCHA_RECOGNIZER = os.getenv("CAPTCHA_RECOGNIZER", "auto")
+CAPTCHA_MODEL_PATH = os.getenv("CAPTCHA_MODEL_PATH")
+
+# Keep-alive connection pools to the carriers
+HTTP_CLIENT_CONFIG = ClientConfig(
+    pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", 16)),
+    keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30)),
+    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", 20)),
+    # Pre-warmed 7-11/OKMart lookup tokens, 0 disables the token pools
+    token_pool_size=int(os.getenv("TOKEN_POOL_SIZE", 0)),
+    token_lifetime=float(os.getenv("TOKEN_LIFETIME", 120)),
+)
+
+# Lookups per second to each carrier, e.g. RATE_LIMIT_SEVEN_ELEVEN=1 and
+# RATE_BURST_SEVEN_ELEVEN=2, a rate of 0 disables the limit. A lookup waiting
+# longer than RATE_LIMIT_MAX_WAIT for its turn fails with a 503.
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 10))
+RATE_LIMITS = {
+    platform: RateLimit(
+        rate=float(os.getenv(f"RATE_LIMIT_{platform.value.upper()}", limit.rate)),
+        burst=int(os.getenv(f"RATE_BURST_{platform.value.upper()}", limit.burst)),
+        max_wait=RATE_LIMIT_MAX_WAIT,
+    )
+    for platform, limit in DEFAULT_RATE_LIMITS.items()
+}
+
+# Lookups to a carrier fail fast for CIRCUIT_RECOVERY_TIMEOUT seconds after
+# CIRCUIT_FAILURE_THRESHOLD consecutive failures
+CIRCUIT_BREAKER_CONFIG = CircuitBreakerConfig(
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+    recovery_timeout=float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", 30)),
+)
+
 PLATFORM_TO_ID = {"seven_eleven": 1, "family_mart": 2, "ok_mart": 3, "shopee": 4}
+ID_TO_PLATFORM = {id: Platform(platform) for platform, id in PLATFORM_TO_ID.items()}
+
+# Max concurrent carrier lookups per platform in a poll cycle,
+# e.g. POLL_CONCURRENCY_SEVEN_ELEVEN=2
+POLL_CONCURRENCY = {
+    platform: int(os.getenv(f"POLL_CONCURRENCY_{platform.value.upper()}", limit))
+    for platform, limit in DEFAULT_CONCURRENCY.items()
+}
+
+# Number of parcels the poller reads, tracks and writes back at a time
+POLL_CHUNK_SIZE = int(os.getenv("POLL_CHUNK_SIZE", 500))
+
+# Seconds between two looks for due parcels, and how often each parcel is
+# checked depending on its status (see `polling.PollPolicy`)
+POLL_TICK = float(os.getenv("POLL_TICK", 30))
+
+# Replicas share the polling by leasing chunks of due parcels. A lease must
+# outlast the tracking of a chunk, after it expires the chunk is polled by
+# another replica.
+POLL_NODE_ID = os.getenv("POLL_NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+POLL_LEASE_TTL = float(os.getenv("POLL_LEASE_TTL", 900))
+POLL_POLICY = PollPolicy(
+    base_interval=float(os.getenv("POLL_BASE_INTERVAL", 600)),
+    backoff=float(os.getenv("POLL_BACKOFF", 1.5)),
+    max_interval=float(os.getenv("POLL_MAX_INTERVAL", 6 * 3600)),
+    delivered_interval=float(os.getenv("POLL_DELIVERED_INTERVAL", 3 * 3600)),
+    not_found_interval=float(os.getenv("POLL_NOT_FOUND_INTERVAL", 1800)),
+    failed_interval=float(os.getenv("POLL_FAILED_INTERVAL", 300)),
+    max_idle=float(os.getenv("POLL_MAX_IDLE", 14 * 86400)),
+)
+NEW_PARCEL = PollState(None, None, None, 0, False, None)
+
+POLL_CHECKED = metrics.counter("poller.checked")
+POLL_CHANGED = metrics.counter("poller.changed")
+POLL_STOPPED = metrics.counter("poller.stopped")
+# Seconds the most overdue parcel of the last chunk waited past its check time
+POLL_LAG = metrics.gauge("poller.lag_seconds")
+
+# Max concurrent carrier lookups per platform in a batch tracking request,
+# e.g. BATCH_CONCURRENCY_SEVEN_ELEVEN=2
+BATCH_CONCURRENCY = {
+    platform: int(os.getenv(f"BATCH_CONCURRENCY_{platform.value.upper()}", limit))
+    for platform, limit in DEFAULT_CONCURRENCY.items()
+}
+BATCH_MAX_PARCELS = int(os.getenv("BATCH_MAX_PARCELS", 100))
+
+# Server-sent event streams of parcel statuses, shared by all the watchers of
+# a parcel. The watched parcels are reloaded from the database every
+# STREAM_REFRESH_INTERVAL seconds, and a heartbeat comment is sent every
+# STREAM_HEARTBEAT seconds so idle streams aren't closed by the proxies.
+STREAM_REFRESH_INTERVAL = float(os.getenv("STREAM_REFRESH_INTERVAL", 2))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 15))
+STREAM_MAX_WATCHERS = int(os.getenv("STREAM_MAX_WATCHERS", 10000))
+# Seconds the browser waits before reconnecting a dropped stream
+STREAM_RETRY = float(os.getenv("STREAM_RETRY", 5))
+
+# Parcels per page of GET /api/subscriptions
+SUBSCRIPTIONS_PAGE_SIZE = int(os.getenv("SUBSCRIPTIONS_PAGE_SIZE", 50))
+SUBSCRIPTIONS_MAX_PAGE_SIZE = int(os.getenv("SUBSCRIPTIONS_MAX_PAGE_SIZE", 200))
+
+
+def create_cache() -> TrackingCache:
+    """
+    Create the tracking result cache from the environment variables
+    """
+
+    if CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend(CACHE_PATH, max_size=CACHE_SIZE)
+    else:
+        backend = MemoryCacheBackend(max_size=CACHE_SIZE)
+    return TrackingCache(backend, not_found_ttl=CACHE_NOT_FOUND_TTL)
+
+
+set_cache(create_cache())
+set_registry(TrackerRegistry(HTTP_CLIENT_CONFIG, RATE_LIMITS, CIRCUIT_BREAKER_CONFIG))
+set_recognizer(create_recognizer(CAPTCHA_RECOGNIZER, CAPTCHA_MODEL_PATH))
+db = Database(MYSQL_CONFIG)
+mailer = Mailer(SMTP_CONFIG) if SMTP_HOST else None
+dispatcher = OutboxDispatcher(
+    db,
+    DISCORD_WEBHOOK_URL,
+    POLL_NODE_ID,
+    mailer=mailer,
+    batch_size=OUTBOX_BATCH_SIZE,
+    post_size=OUTBOX_POST_SIZE,
+    concurrency=OUTBOX_CONCURRENCY,
+    lease_ttl=OUTBOX_LEASE_TTL,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    timeout=OUTBOX_TIMEOUT,
+    policy=OUTBOX_RETRY_POLICY,
+)
 
 
 class Subscription(BaseModel):
@@ -29,15 +244,32 @@ class Subscription(BaseModel):
     platform: str
 
 
+class ParcelQuery(BaseModel):
+    platform: str
+    order_id: str
+
+
+class BatchTrackRequest(BaseModel):
+    parcels: list[ParcelQuery]
+
+
 # Schedule the background task
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    trigger = IntervalTrigger(minutes=10)
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(check_subscriptions, trigger)
+    # Only the parcels which are due are checked on every tick
+    trigger = IntervalTrigger(seconds=POLL_TICK)
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(check_subscriptions, trigger, max_instances=1, coalesce=True)
     scheduler.start()
+    if DISCORD_WEBHOOK_URL or mailer is not None:
+        dispatcher.start()
+    hub.start()
     yield
     scheduler.shutdown()
+    await hub.stop()
+    await dispatcher.stop()
+    await get_registry().aclose()
+    await db.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -51,26 +283,275 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(CarrierUnavailableError)
+async def carrier_unavailable(request: Request, e: CarrierUnavailableError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(int(e.retry_after + 1))},
+    )
+
+
+@app.exception_handler(TrackingError)
+async def tracking_failed(request: Request, e: TrackingError):
+    # The carrier couldn't be asked, which doesn't mean the parcel is missing
+    return JSONResponse(status_code=502, content={"detail": "Tracking failed"})
+
+
 # Define the API endpoints
 @app.get("/")
 async def root():
     return {"message": "It works!"}
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
 @app.get("/api/track/{platform}/{order_id}")
 async def track_parcel(platform: str, order_id: str):
-    result = track(Platform(platform), order_id)
+    result = await async_lookup(Platform(platform), order_id)
 
     if result is None:
         raise HTTPException(status_code=404, detail="Parcel not found")
     else:
-        response = {
-            "platform": result.platform,
-            "order_id": result.order_id,
-            "status": result.status,
-            "time": result.time,
-        }
-        return response
+        return tracking_response(result)
+
+
+@app.post("/api/track/batch")
+async def track_parcels(batch: BatchTrackRequest, request: Request):
+    """
+    Track many parcels at once and stream every result as soon as it resolves
+
+    The results are sent as NDJSON, or as server-sent events if the client
+    accepts `text/event-stream`, in the order they resolve. A parcel which
+    is not found, or failed to be tracked, is sent with an `error`. A parcel
+    which failed to be tracked is also `unavailable`, with the `retry_after`
+    seconds if its carrier is rate limited or circuit broken.
+    """
+
+    if len(batch.parcels) > BATCH_MAX_PARCELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BATCH_MAX_PARCELS} parcels can be tracked at once",
+        )
+
+    parcels = []
+    for parcel in batch.parcels:
+        if parcel.platform not in PLATFORM_TO_ID:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid platform: {parcel.platform}"
+            )
+        parcels.append((Platform(parcel.platform), parcel.order_id))
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def stream():
+        async for platform, order_id, result, error in async_track_many(
+            parcels, BATCH_CONCURRENCY
+        ):
+            if isinstance(error, CarrierUnavailableError):
+                # Not to be taken as not found, the parcel may be tracked later
+                item = {
+                    "platform": platform.value,
+                    "order_id": order_id,
+                    "error": "Carrier unavailable",
+                    "unavailable": True,
+                    "retry_after": error.retry_after,
+                }
+            elif error is not None:
+                item = {
+                    "platform": platform.value,
+                    "order_id": order_id,
+                    "error": "Tracking failed",
+                    "unavailable": True,
+                }
+            elif result is None:
+                item = {
+                    "platform": platform.value,
+                    "order_id": order_id,
+                    "error": "Parcel not found",
+                }
+            else:
+                # Keep the queried order_id so the client can match the results
+                item = {**tracking_response(result), "order_id": order_id}
+
+            line = json.dumps(item, ensure_ascii=False)
+            yield f"data: {line}\n\n" if sse else line + "\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def tracking_response(result: TrackingInfo) -> dict:
+    return {
+        "platform": result.platform,
+        "order_id": result.order_id,
+        "status": result.status,
+        "time": result.time,
+    }
+
+
+@app.get("/api/stream/{platform}/{order_id}")
+async def stream_parcel(platform: str, order_id: str):
+    """
+    Stream the status of a parcel as server-sent events
+
+    A `status` event is sent with the current status, then on every change
+    found by the poller, so only subscribed parcels get updates. A parcel
+    which doesn't exist gets a `not_found` event and the stream ends. If the
+    status couldn't be loaded, an `unavailable` event ends the stream, and
+    the browser reconnects after the `retry` delay. The watchers of a
+    parcel share its upstream in the `hub`, see `StreamHub`.
+    """
+
+    if platform not in PLATFORM_TO_ID:
+        raise HTTPException(status_code=400, detail=f"Invalid platform: {platform}")
+    if hub.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many streams",
+            headers={"Retry-After": str(int(STREAM_RETRY))},
+        )
+
+    async def events():
+        async with hub.watch((PLATFORM_TO_ID[platform], order_id)) as updates:
+            yield f"retry: {int(STREAM_RETRY * 1000)}\n\n"
+            while True:
+                try:
+                    status = await asyncio.wait_for(updates.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if status is UNAVAILABLE:
+                    yield "event: unavailable\ndata: {}\n\n"
+                    return
+                if not status:
+                    yield "event: not_found\ndata: {}\n\n"
+                    return
+                data = json.dumps({**status, "platform": platform}, ensure_ascii=False)
+                yield f"event: status\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def track_snapshot(key: tuple[int, str]) -> dict | None:
+    """
+    Track a watched parcel which isn't polled, once for all of its watchers
+
+    The result usually comes from the tracking cache, filled by the /track
+    request which preceded the stream. A failed lookup raises, so the
+    watchers are told the parcel is unavailable rather than missing.
+    """
+
+    platform_id, order_id = key
+    result = await async_lookup(ID_TO_PLATFORM[platform_id], order_id)
+    return tracking_response(result) if result is not None else None
+
+
+hub = StreamHub(
+    db,
+    track_snapshot,
+    refresh_interval=STREAM_REFRESH_INTERVAL,
+    max_watchers=STREAM_MAX_WATCHERS,
+)
+
+
+@app.get("/api/subscriptions")
+async def list_subscriptions(
+    discord_id: Optional[str] = None,
+    email: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = SUBSCRIPTIONS_PAGE_SIZE,
+):
+    """
+    List the parcels a discord user or an email is subscribed to, with their
+    latest status
+
+    The parcels are paginated by keyset: pass the `next_cursor` of a page as
+    the `cursor` of the next one, it is `None` on the last page.
+    """
+
+    if (email is None) == (discord_id is None):
+        raise HTTPException(
+            status_code=400, detail="Exactly one of 'email' or 'discord_id' is needed."
+        )
+    if not 1 <= limit <= SUBSCRIPTIONS_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The limit must be between 1 and {SUBSCRIPTIONS_MAX_PAGE_SIZE}",
+        )
+
+    try:
+        platform_id, order_id = decode_cursor(cursor) if cursor else (0, "")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if email is not None:
+        sql, subscriber = queries.LIST_SUBSCRIPTIONS_BY_EMAIL, email
+    else:
+        sql, subscriber = queries.LIST_SUBSCRIPTIONS_BY_DISCORD_ID, discord_id
+
+    # One more row than the page tells if there is a next page
+    try:
+        rows = await db.fetchall(
+            sql, (subscriber, platform_id, platform_id, order_id, limit + 1)
+        )
+    except DatabaseError as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to list subscriptions: {str(e)}"
+        )
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(page[-1][0], page[-1][1])
+
+    return {
+        "subscriptions": [
+            {
+                "platform": ID_TO_PLATFORM[platform_id].value,
+                "order_id": order_id,
+                "status": status,
+                "time": str(update_time) if update_time is not None else None,
+            }
+            for platform_id, order_id, status, update_time in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+def encode_cursor(platform_id: int, order_id: str) -> str:
+    data = json.dumps([platform_id, order_id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, str]:
+    """
+    Read the (platform_id, order_id) of an `encode_cursor` cursor
+
+    Raises
+    ------
+    ValueError
+        If the cursor is malformed
+    """
+
+    try:
+        platform_id, order_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (TypeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(platform_id, int) or not isinstance(order_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return platform_id, order_id
 
 
 @app.post("/api/subscriptions")
@@ -91,58 +572,47 @@ async def subscription(sub: Subscription):
     if not platform_id:
         raise HTTPException(status_code=400, detail=f"Invalid platform: {platform}")
 
-    conn = None
     try:
-        conn = connect_to_mysql()
-        cursor = conn.cursor()
-
         # Check if the subscription already exists
-        cursor.execute(
-            "SELECT * FROM Subscriptions WHERE order_id = %s AND platform_id = %s AND (email = %s OR discord_id = %s)",
-            (order_id, platform_id, email, discord_id),
-        )
-        if cursor.fetchone():
+        async with db.transaction() as conn:
+            exists = await find_subscription(
+                conn, platform_id, order_id, email, discord_id
+            )
+        if exists:
             raise HTTPException(status_code=409, detail="Subscription already exists")
 
-        # Track the parcel status
-        result = track(Platform(platform), order_id)
+        # Track the parcel status, without holding a database connection
+        result = await async_lookup(Platform(platform), order_id)
         if result is None:
             raise HTTPException(status_code=404, detail="Parcel not found")
 
-        # Check if the parcel status is already existed in the database
-        cursor.execute(
-            "SELECT * FROM Parcels WHERE platform_id = %s AND order_id = %s",
-            (platform_id, order_id),
+        state = next_poll_state(
+            Platform(platform), NEW_PARCEL, result, utcnow(), POLL_POLICY
         )
-        if not cursor.fetchone():
-            # Insert the result into the database
-            cursor.execute(
-                """
-            INSERT INTO Parcels (platform_id, order_id, status, update_time) VALUES (%s, %s, %s, %s)
-            """,
-                (platform_id, order_id, result.status, result.time),
+        async with db.transaction() as conn:
+            # Insert the result into the database, if the parcel is new
+            await conn.execute(
+                queries.INSERT_PARCEL,
+                (
+                    platform_id,
+                    order_id,
+                    result.status,
+                    result.time,
+                    state.next_check_at,
+                    result.is_delivered,
+                ),
             )
 
-        # Insert the subscription into the database
-        cursor.execute(
-            """
-        INSERT INTO Subscriptions (order_id, email, discord_id, platform_id)
-        VALUES (%s, %s, %s, %s)
-        """,
-            (order_id, email, discord_id, platform_id),
-        )
-        conn.commit()
+            # Insert the subscription into the database
+            await conn.execute(
+                queries.INSERT_SUBSCRIPTION, (order_id, email, discord_id, platform_id)
+            )
 
         return {"message": "success"}
-    except Error as e:
-        if conn:
-            conn.rollback()
+    except DatabaseError as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to create subscription: {str(e)}"
         )
-    finally:
-        if conn:
-            conn.close()
 
 
 @app.delete("/api/subscriptions")
@@ -157,101 +627,304 @@ async def unsubscription(sub: Subscription):
     if not platform_id:
         raise HTTPException(status_code=400, detail=f"Invalid platform: {platform}")
 
-    conn = None
+    # Delete by email and by discord_id separately, so each uses its index
     try:
-        conn = connect_to_mysql()
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM Subscriptions where order_id = %s AND platform_id = %s AND (email = %s OR discord_id = %s) ",
-            (order_id, platform_id, email, discord_id),
-        )
-        conn.commit()
-
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Subscription not found")
-
-        return {"message": "success"}
-    except Error as e:
+        rowcount = 0
+        async with db.transaction() as conn:
+            if email is not None:
+                rowcount += await conn.execute(
+                    queries.DELETE_SUBSCRIPTION_BY_EMAIL,
+                    (platform_id, order_id, email),
+                )
+            if discord_id is not None:
+                rowcount += await conn.execute(
+                    queries.DELETE_SUBSCRIPTION_BY_DISCORD_ID,
+                    (platform_id, order_id, discord_id),
+                )
+            await conn.execute(
+                queries.STOP_UNSUBSCRIBED_PARCEL,
+                (platform_id, order_id, platform_id, order_id),
+            )
+    except DatabaseError as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to delete subscription: {str(e)}"
         )
-    finally:
-        if conn:
-            conn.close()
 
+    if rowcount == 0:
+        raise HTTPException(status_code=404, detail="Subscription not found")
 
-def check_subscriptions():
-    # Connect to the database
-    try:
-        conn = connect_to_mysql()
-        cursor = conn.cursor()
-
-        # Get all subscriptions
-        cursor.execute(
-            """
-        SELECT S.order_id, S.email, S.discord_id, PL.name, P.status, P.update_time
-        FROM Subscriptions S
-        JOIN Parcels P ON S.order_id = P.order_id AND S.platform_id = P.platform_id
-        JOIN Platforms PL ON S.platform_id = PL.platform_id
-        """
-        )
-        subscriptions = cursor.fetchall()
+    return {"message": "success"}
 
-        for subscription in subscriptions:
-            order_id, email, discord_id, platform, status, update_time = subscription
-            result = track(Platform(platform), order_id)
 
-            if result is None or result.status == status:
-                continue
+async def find_subscription(
+    conn: Connection,
+    platform_id: int,
+    order_id: str,
+    email: str | None,
+    discord_id: str | None,
+) -> bool:
+    """
+    Check if the email or the discord user is subscribed to the parcel
 
-            # Update the parcel status in the database
-            cursor.execute(
-                "UPDATE Parcels SET status = %s, update_time = %s WHERE order_id = %s AND platform_id = %s",
-                (result.status, result.time, order_id, PLATFORM_TO_ID[platform]),
+    The two lookups are separate queries, since `email = %s OR discord_id = %s`
+    can't use a single index.
+    """
+
+    if email is not None and await conn.fetchone(
+        queries.FIND_SUBSCRIPTION_BY_EMAIL, (platform_id, order_id, email)
+    ):
+        return True
+    if discord_id is not None and await conn.fetchone(
+        queries.FIND_SUBSCRIPTION_BY_DISCORD_ID, (platform_id, order_id, discord_id)
+    ):
+        return True
+    return False
+
+
+async def check_subscriptions():
+    """
+    Check the subscribed parcels which are due and notify their subscribers
+    on change
+
+    Due parcels are leased, tracked and written back in chunks of
+    `POLL_CHUNK_SIZE`, the earliest due first, so memory stays flat and no
+    transaction is held open while the carriers are scraped. Replicas lease
+    disjoint chunks, see `lease_due_parcels`. Every check moves the parcel's
+    `next_check_at` forward, see `next_poll_state`. Only the parcels due when
+    the run started are checked, so the ones deferred by this run aren't
+    checked again before the next one.
+    """
+
+    start_time = time.perf_counter()
+    run_start = utcnow()
+    parcel_count = subscription_count = change_count = 0
+    while True:
+        now = utcnow()
+        try:
+            parcels, oldest = await lease_due_parcels(run_start, now, POLL_CHUNK_SIZE)
+        except DatabaseError as e:
+            print(f"Failed to check subscriptions: {str(e)}")
+            return
+        if not parcels:
+            break
+        POLL_LAG.set((now - oldest).total_seconds())
+
+        # Fetch each unique parcel once and fan the result out to its subscribers
+        checked = []
+        changes = []
+        async for platform, order_id, result, error in async_track_many(
+            parcels.keys(), POLL_CONCURRENCY
+        ):
+            parcel = parcels[(platform, order_id)]
+            if isinstance(error, CarrierUnavailableError):
+                # The carrier is rate limited or circuit broken, try again
+                # once it may be available, as if this check never happened
+                state = deferred_poll_state(
+                    parcel["state"], error.retry_after, utcnow(), POLL_POLICY
+                )
+                checked.append((platform, order_id, state))
+                continue
+            state = next_poll_state(
+                platform,
+                parcel["state"],
+                result,
+                utcnow(),
+                POLL_POLICY,
+                failed=error is not None,
             )
+            checked.append((platform, order_id, state))
+            if result is not None and result.status != parcel["state"].status:
+                changes.append((platform, order_id, result, parcel["subscribers"]))
+
+        saved = await update_subscriptions(checked, changes)
+        if saved is None:
+            return
+
+        parcel_count += len(saved)
+        subscription_count += sum(len(parcels[key]["subscribers"]) for key in saved)
+        change_count += sum(
+            (platform, order_id) in saved for platform, order_id, *_ in changes
+        )
 
-            # Send a notification to the user
-            if email:
-                # TODO: Send an email
-                pass
-            if discord_id:
-                # send to discord webhook
-                payload = {
-                    "user_id": discord_id,
-                    "platform": platform,
-                    "order_id": order_id,
-                    "status": result.status,
-                    "time": result.time,
-                }
-                requests.post(DISCORD_WEBHOOK_URL, json=payload)
+    if parcel_count:
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"Checked {parcel_count} parcels ({subscription_count} subscriptions) "
+            f"in {elapsed:.2f}s, {change_count} changed"
+        )
 
-        conn.commit()
-    except Error as e:
-        if conn:
-            conn.rollback()
-        print(f"Failed to check subscriptions: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
+async def lease_due_parcels(
+    due_by: datetime, now: datetime, limit: int
+) -> tuple[dict, datetime]:
+    """
+    Lease the subscribed parcels due for a check by `due_by`, with all of
+    their subscribers
+
+    The parcels are locked with `SKIP LOCKED`, so concurrent replicas lease
+    disjoint chunks, and their next check is moved to the end of the lease.
+    If this replica dies before storing the results, the parcels become due
+    again when the lease expires and another replica picks them up.
+
+    Parameters
+    ----------
+    due_by : datetime
+        The latest check time of the parcels to lease, naive UTC
+    now : datetime
+        The current time, naive UTC, from which the lease runs
+    limit : int
+        The max number of parcels to lease
+
+    Returns
+    -------
+    tuple[dict, datetime]
+        A mapping from (platform, order_id) to the `PollState` of the parcel
+        and the (email, discord_id) pairs of its subscribers, and when the
+        earliest of them was due
+    """
+
+    async with db.transaction() as conn:
+        due = await conn.fetchall(queries.LOCK_DUE_PARCELS, (due_by, limit))
+        if not due:
+            return {}, now
+
+        ids = [id for id, _ in due]
+        placeholders = ", ".join(["%s"] * len(ids))
+        await conn.execute(
+            queries.LEASE_PARCELS.format(ids=placeholders),
+            (now + timedelta(seconds=POLL_LEASE_TTL), POLL_NODE_ID, *ids),
+        )
+
+    rows = await db.fetchall(queries.LOAD_LEASED_PARCELS.format(ids=placeholders), ids)
 
-def connect_to_mysql():
+    parcels = {}
+    for platform_id, order_id, *state, email, discord_id in rows:
+        parcel = parcels.setdefault(
+            (ID_TO_PLATFORM[platform_id], order_id),
+            {"state": PollState(*state), "subscribers": []},
+        )
+        parcel["subscribers"].append((email, discord_id))
+
+    return parcels, min(next_check_at for _, next_check_at in due)
+
+
+async def update_subscriptions(checked: list, changes: list) -> Optional[set]:
     """
-    Establish a connection to the MySQL server.
+    Store the new status and schedule of the checked parcels, with the
+    notifications of their changes to the subscribers
+
+    Only the parcels still leased by this replica are stored. The others were
+    leased by another replica once the lease expired, and their results would
+    overwrite newer ones. The notifications are written to the outbox in the
+    same transaction, and delivered by the `dispatcher` once committed.
+
+    Parameters
+    ----------
+    checked : list
+        (platform, order_id, state) of every checked parcel
+    changes : list
+        (platform, order_id, result, subscribers) of every changed parcel
+
+    Returns
+    -------
+    Optional[set]
+        The (platform, order_id) of the stored parcels, or None if the
+        parcels couldn't be stored
     """
 
+    if not checked:
+        return set()
+
+    keys = [(PLATFORM_TO_ID[p.value], order_id) for p, order_id, _ in checked]
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+
+    # All the parcels and notifications are written in batched statements
     try:
-        conn = connect(
-            host=MYSQL_URL,
-            user=MYSQL_USER,
-            password=MYSQL_PASSWORD,
-            database=MYSQL_DATABASE,
+        async with db.transaction() as conn:
+            rows = await conn.fetchall(
+                queries.LOCK_LEASED_PARCELS.format(keys=placeholders),
+                [POLL_NODE_ID, *(value for key in keys for value in key)],
+            )
+            leased = {(ID_TO_PLATFORM[p], order_id) for p, order_id in rows}
+            checked = [c for c in checked if (c[0], c[1]) in leased]
+            changes = [c for c in changes if (c[0], c[1]) in leased]
+            notifications = change_notifications(changes)
+
+            if checked:
+                await conn.executemany(
+                    queries.SAVE_POLL_RESULTS,
+                    [
+                        (
+                            PLATFORM_TO_ID[platform.value],
+                            order_id,
+                            state.status,
+                            state.update_time,
+                            state.next_check_at,
+                            state.last_changed_at,
+                            state.unchanged_checks,
+                            state.is_delivered,
+                        )
+                        for platform, order_id, state in checked
+                    ],
+                )
+            if notifications:
+                await conn.executemany(queries.INSERT_NOTIFICATION, notifications)
+    except DatabaseError as e:
+        print(f"Failed to check subscriptions: {str(e)}")
+        return None
+
+    if len(leased) < len(keys):
+        print(
+            f"Dropped the results of {len(keys) - len(leased)} parcels "
+            "leased by another replica"
         )
-        return conn
-    except Error as e:
-        raise HTTPException(
-            status_code=500, detail=f"Database connection failed: {str(e)}"
+    POLL_CHECKED.inc(len(checked))
+    POLL_CHANGED.inc(len(changes))
+    POLL_STOPPED.inc(sum(state.next_check_at is None for _, _, state in checked))
+
+    if notifications:
+        dispatcher.wake()
+    for platform, order_id, result, _ in changes:
+        status = {**tracking_response(result), "order_id": order_id}
+        hub.publish((PLATFORM_TO_ID[platform.value], order_id), status)
+    return leased
+
+
+def change_notifications(changes: list) -> list:
+    """
+    The outbox rows notifying the subscribers of the changed parcels
+
+    Parameters
+    ----------
+    changes : list
+        (platform, order_id, result, subscribers) of every changed parcel
+
+    Returns
+    -------
+    list
+        (channel, recipient, payload) of every notification
+    """
+
+    notifications = []
+    for platform, order_id, result, subscribers in changes:
+        payload = json.dumps(
+            {
+                "platform": platform.value,
+                "order_id": order_id,
+                "status": result.status,
+                "time": result.time,
+            },
+            ensure_ascii=False,
         )
+        for email, discord_id in subscribers:
+            # One notification per channel of the subscriber. Only the
+            # configured channels get notifications, nothing would deliver
+            # the others.
+            if discord_id and DISCORD_WEBHOOK_URL:
+                notifications.append((DISCORD, discord_id, payload))
+            if email and mailer is not None:
+                notifications.append((EMAIL, email, payload))
+    return notifications
 
 
 if __name__ == "__main__":
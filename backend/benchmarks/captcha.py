@@ -0,0 +1,132 @@
+"""
+Benchmark the 7-11 captcha recognizers on a stored corpus of captcha images
+
+The corpus is a directory of captcha images named after their code, e.g.
+`4821.png` or `4821_2.png` for duplicated codes. It defaults to
+`fixtures/captchas`, 120 synthetic captchas in the 7-11 style written by
+`benchmarks.captcha_corpus`, use a directory of recorded captchas for the
+real-world accuracy. Run from `backend/`:
+
+    python -m benchmarks.captcha
+    python -m benchmarks.captcha path/to/corpus --recognizers classifier \
+        --train-split 0.5 --save-model captcha_model.npz
+"""
+
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from benchmarks.captcha_corpus import CORPUS_DIR
+from parcel_tw.captcha import (
+    CaptchaRecognizer,
+    DigitClassifierRecognizer,
+    create_recognizer,
+)
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
+
+
+def load_corpus(path: Path) -> list[tuple[Image.Image, str]]:
+    samples = []
+    for file in sorted(path.iterdir()):
+        if file.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        image = Image.open(file)
+        image.load()
+        samples.append((image, file.stem.split("_")[0]))
+    return samples
+
+
+def benchmark(
+    recognizer: CaptchaRecognizer, samples: list[tuple[Image.Image, str]]
+) -> dict:
+    latencies = []
+    correct = 0
+    correct_digits = 0
+    total_digits = 0
+
+    for image, code in samples:
+        start = time.perf_counter()
+        result = recognizer.recognize(image)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        correct += result == code
+        correct_digits += sum(a == b for a, b in zip(result, code))
+        total_digits += len(code)
+
+    latencies_sorted = sorted(latencies)
+    return {
+        "samples": len(samples),
+        "accuracy": correct / len(samples),
+        "digit_accuracy": correct_digits / total_digits,
+        "first_ms": latencies[0],
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies_sorted[len(latencies) // 2],
+        "p95_ms": latencies_sorted[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "corpus",
+        type=Path,
+        nargs="?",
+        default=CORPUS_DIR,
+        help="directory of labelled captchas",
+    )
+    parser.add_argument(
+        "--recognizers",
+        default="tesseract,tesserocr,classifier",
+        help="comma separated recognizers to benchmark",
+    )
+    parser.add_argument("--model", help="trained classifier model to load")
+    parser.add_argument(
+        "--train-split",
+        type=float,
+        default=0.5,
+        help="fraction of the corpus used to train the classifier",
+    )
+    parser.add_argument("--save-model", help="where to save the trained classifier")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    if not samples:
+        parser.error(f"No captcha images found in {args.corpus}")
+
+    random.Random(args.seed).shuffle(samples)
+    split = int(len(samples) * args.train_split)
+    train_samples, test_samples = samples[:split], samples[split:]
+
+    print(
+        f"{'recognizer':<12}{'samples':>8}{'accuracy':>10}{'digits':>8}"
+        f"{'first ms':>10}{'mean ms':>9}{'p50 ms':>8}{'p95 ms':>8}"
+    )
+    for name in args.recognizers.split(","):
+        try:
+            if name == "classifier" and args.model is None:
+                recognizer = DigitClassifierRecognizer.train(train_samples)
+                if args.save_model:
+                    recognizer.save(args.save_model)
+            else:
+                recognizer = create_recognizer(name, args.model)
+            result = benchmark(recognizer, test_samples)
+        except (ImportError, OSError, RuntimeError) as e:
+            # The OCR engine of the recognizer is not installed
+            print(f"{name:<12} skipped: {e}")
+            continue
+
+        print(
+            f"{name:<12}{result['samples']:>8}{result['accuracy']:>10.1%}"
+            f"{result['digit_accuracy']:>8.1%}{result['first_ms']:>10.2f}"
+            f"{result['mean_ms']:>9.2f}{result['p50_ms']:>8.2f}{result['p95_ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Generate the labelled captcha corpus of `benchmarks.captcha`
+
+The 7-11 captcha is 4 digits of one font, drawn with a small random offset
+over speckles and a few thin lines. The images are written to the given
+directory, named after their code, and are the same for the same seed. Run
+from `backend/`:
+
+    python -m benchmarks.captcha_corpus
+    python -m benchmarks.captcha_corpus path/to/corpus --count 500 --seed 1
+"""
+
+import argparse
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+CORPUS_DIR = Path(__file__).parent / "fixtures" / "captchas"
+
+FONT = "DejaVuSans-Bold.ttf"
+SIZE = (80, 28)
+
+
+def draw_captcha(code: str, rng: random.Random, font) -> Image.Image:
+    image = Image.new("L", SIZE, rng.randint(225, 255))
+    draw = ImageDraw.Draw(image)
+
+    for _ in range(rng.randint(2, 4)):
+        start = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        end = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        draw.line([start, end], fill=rng.randint(120, 200), width=1)
+
+    x = rng.randint(4, 10)
+    for digit in code:
+        draw.text((x, rng.randint(2, 6)), digit, fill=rng.randint(0, 70), font=font)
+        x += rng.randint(15, 18)
+
+    for _ in range(rng.randint(40, 80)):
+        point = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        draw.point(point, fill=rng.randint(0, 160))
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("corpus", type=Path, nargs="?", default=CORPUS_DIR)
+    parser.add_argument("--count", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    font = ImageFont.truetype(FONT, 18)
+    args.corpus.mkdir(parents=True, exist_ok=True)
+
+    seen = {}
+    for _ in range(args.count):
+        code = f"{rng.randrange(10000):04d}"
+        seen[code] = seen.get(code, 0) + 1
+        name = code if seen[code] == 1 else f"{code}_{seen[code]}"
+        draw_captcha(code, rng, font).save(args.corpus / f"{name}.png", optimize=True)
+    print(f"Wrote {args.count} captchas to {args.corpus}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Check the query plans of the backend's SQL statements on a seeded database
+
+A scratch database is created with the schema of `db/init.sql` and seeded
+with a million parcels and subscriptions, then `EXPLAIN` is run on every
+lookup and delete of `queries.py`. The check fails if a statement scans a
+whole table, uses an unexpected index, or stops being covered by its index. Run
+from `backend/` with the `MYSQL_*` environment variables of the API, as a
+user allowed to create databases:
+
+    python -m benchmarks.explain_queries
+    python -m benchmarks.explain_queries --rows 100000 --drop
+
+With `--migrate`, the schema is built by applying `db/migrations` to the
+schema of the `init.sql` they started from, kept in
+`fixtures/baseline_init.sql`, and the check also fails if the migrated tables
+differ from the ones of `db/init.sql`:
+
+    python -m benchmarks.explain_queries --migrate --database parcel_tracker_migrated
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+from mysql.connector import connect
+
+import queries
+from database import SESSION_TIME_ZONE
+
+DB_DIR = Path(__file__).parents[2] / "db"
+SCHEMA_FILES = [DB_DIR / "init.sql", DB_DIR / "platform_info.sql"]
+
+# The init.sql of the first migration, and the migrations applied on it
+MIGRATED_SCHEMA_FILES = [
+    Path(__file__).parent / "fixtures" / "baseline_init.sql",
+    DB_DIR / "platform_info.sql",
+    *sorted((DB_DIR / "migrations").glob("*.sql")),
+]
+
+SEED_CHUNK = 100_000
+
+# Any subscriber has a subscription in every SUBSCRIBERS-th parcel
+SUBSCRIBERS = 50_000
+
+
+@dataclass
+class Expectation:
+    keys: set[str]  # Indexes the table may be read from
+    covering: bool = True  # Whether the rows must come from the index alone
+
+
+@dataclass
+class Check:
+    name: str
+    sql: str
+    params: tuple
+    # Expected plan of every table, by its name (or alias) in the statement
+    tables: dict[str, Expectation] = field(default_factory=dict)
+
+
+def build_checks() -> list[Check]:
+    subscription_keys = {"uq_subscriptions_subscriber"}
+    parcel_keys = {"uq_parcels_parcel", "idx_parcels_status"}
+    order_id = order_id_of(4242)
+
+    return [
+        Check(
+            "find subscription by email",
+            queries.FIND_SUBSCRIPTION_BY_EMAIL,
+            (platform_id_of(4242), order_id, email_of(4242)),
+            {
+                "Subscriptions": Expectation(
+                    subscription_keys | {"idx_subscriptions_email"}
+                )
+            },
+        ),
+        Check(
+            "find subscription by discord_id",
+            queries.FIND_SUBSCRIPTION_BY_DISCORD_ID,
+            (platform_id_of(4243), order_id_of(4243), discord_id_of(4243)),
+            {
+                "Subscriptions": Expectation(
+                    subscription_keys | {"idx_subscriptions_discord_id"}
+                )
+            },
+        ),
+        Check(
+            "delete subscription by email",
+            queries.DELETE_SUBSCRIPTION_BY_EMAIL,
+            (platform_id_of(4242), order_id, email_of(4242)),
+            {
+                "Subscriptions": Expectation(
+                    subscription_keys | {"idx_subscriptions_email"}, covering=False
+                )
+            },
+        ),
+        Check(
+            "delete subscription by discord_id",
+            queries.DELETE_SUBSCRIPTION_BY_DISCORD_ID,
+            (platform_id_of(4243), order_id_of(4243), discord_id_of(4243)),
+            {
+                "Subscriptions": Expectation(
+                    subscription_keys | {"idx_subscriptions_discord_id"},
+                    covering=False,
+                )
+            },
+        ),
+        Check(
+            "list subscriptions by email",
+            queries.LIST_SUBSCRIPTIONS_BY_EMAIL,
+            (email_of(4242), 2, 2, order_id_of(4242), 51),
+            {
+                "S": Expectation({"idx_subscriptions_email"}),
+                "P": Expectation(parcel_keys, covering=False),
+            },
+        ),
+        Check(
+            "list subscriptions by discord_id",
+            queries.LIST_SUBSCRIPTIONS_BY_DISCORD_ID,
+            (discord_id_of(4243), 0, 0, "", 51),
+            {
+                "S": Expectation({"idx_subscriptions_discord_id"}),
+                "P": Expectation(parcel_keys, covering=False),
+            },
+        ),
+        Check(
+            "stop polling an unsubscribed parcel",
+            queries.STOP_UNSUBSCRIBED_PARCEL,
+            (platform_id_of(4242), order_id, platform_id_of(4242), order_id),
+            {
+                "Parcels": Expectation({"uq_parcels_parcel"}, covering=False),
+                "S": Expectation(subscription_keys),
+            },
+        ),
+        Check(
+            "lock due parcels",
+            queries.LOCK_DUE_PARCELS,
+            (datetime.now(timezone.utc).replace(tzinfo=None), 500),
+            {
+                "Parcels": Expectation({"idx_parcels_next_check"}),
+                "E": Expectation(subscription_keys),
+            },
+        ),
+        Check(
+            "lease parcels",
+            queries.LEASE_PARCELS.format(ids="%s, %s, %s"),
+            (datetime.now(timezone.utc).replace(tzinfo=None), "explain", 1, 2, 3),
+            {"Parcels": Expectation({"PRIMARY"}, covering=False)},
+        ),
+        Check(
+            "load leased parcels",
+            queries.LOAD_LEASED_PARCELS.format(ids="%s, %s, %s"),
+            (1, 2, 3),
+            {
+                "P": Expectation({"PRIMARY"}, covering=False),
+                "S": Expectation(subscription_keys),
+            },
+        ),
+        Check(
+            "lock leased parcels",
+            queries.LOCK_LEASED_PARCELS.format(keys="(%s, %s), (%s, %s)"),
+            (
+                "explain",
+                platform_id_of(4242),
+                order_id,
+                platform_id_of(4243),
+                order_id_of(4243),
+            ),
+            {"Parcels": Expectation(parcel_keys, covering=False)},
+        ),
+        Check(
+            "load parcel statuses",
+            queries.LOAD_PARCEL_STATUSES.format(keys="(%s, %s), (%s, %s)"),
+            (platform_id_of(4242), order_id, platform_id_of(4243), order_id_of(4243)),
+            {"Parcels": Expectation(parcel_keys)},
+        ),
+        Check(
+            "lock due notifications",
+            queries.LOCK_DUE_NOTIFICATIONS,
+            (datetime.now(timezone.utc).replace(tzinfo=None), 100),
+            {
+                "NotificationOutbox": Expectation(
+                    {"idx_outbox_next_attempt"}, covering=False
+                )
+            },
+        ),
+    ]
+
+
+def platform_id_of(n: int) -> int:
+    return n % 4 + 1
+
+
+def order_id_of(n: int) -> str:
+    return f"ORDER{n:010d}"
+
+
+def email_of(n: int) -> str:
+    return f"user{n % SUBSCRIBERS}@example.com"
+
+
+def discord_id_of(n: int) -> str:
+    return str(100000000000000000 + n % SUBSCRIBERS)
+
+
+def create_schema(cursor, files: list[Path] = SCHEMA_FILES):
+    for path in files:
+        print(f"Running {path.name}")
+        lines = path.read_text(encoding="utf-8").splitlines()
+        script = "\n".join(line for line in lines if not line.lstrip().startswith("--"))
+        for statement in script.split(";"):
+            statement = statement.strip()
+            if statement and not statement.upper().startswith("USE "):
+                cursor.execute(statement)
+
+
+def table_definitions(cursor) -> dict[str, set[str]]:
+    """
+    Get the columns, keys and constraints of every table, in any order
+    """
+
+    cursor.execute("SHOW TABLES")
+    tables = [table for (table,) in cursor.fetchall()]
+    definitions = {}
+    for table in tables:
+        cursor.execute(f"SHOW CREATE TABLE `{table}`")
+        (_, create) = cursor.fetchone()
+        # Only the lines between the CREATE TABLE and the table options
+        lines = create.splitlines()[1:-1]
+        definitions[table] = {line.strip().rstrip(",") for line in lines}
+    return definitions
+
+
+def check_migrated_schema(cursor, database: str) -> list[str]:
+    """
+    Compare the tables of the migrated `database` with the ones of init.sql,
+    created in a scratch database next to it
+    """
+
+    expected_database = f"{database}_expected"
+    cursor.execute(f"DROP DATABASE IF EXISTS `{expected_database}`")
+    cursor.execute(f"CREATE DATABASE `{expected_database}`")
+    try:
+        cursor.execute(f"USE `{expected_database}`")
+        create_schema(cursor)
+        expected = table_definitions(cursor)
+    finally:
+        cursor.execute(f"DROP DATABASE `{expected_database}`")
+        cursor.execute(f"USE `{database}`")
+    actual = table_definitions(cursor)
+
+    problems = []
+    for table in sorted(expected.keys() | actual.keys()):
+        for line in sorted(expected.get(table, set()) - actual.get(table, set())):
+            problems.append(f"{table} is missing {line}")
+        for line in sorted(actual.get(table, set()) - expected.get(table, set())):
+            problems.append(f"{table} has an extra {line}")
+    return problems
+
+
+def seed(conn, rows: int):
+    """
+    Insert `rows` parcels with one subscription each, half of them by email
+    and half by discord_id, and a pending notification for 1% of them, unless
+    the tables are already seeded
+    """
+
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("SELECT COUNT(*) FROM Parcels")
+    (count,) = cursor.fetchone()
+    if count >= rows:
+        return
+
+    start = time.perf_counter()
+    cursor.execute(f"SET SESSION cte_max_recursion_depth = {SEED_CHUNK}")
+    for offset in range(count, rows, SEED_CHUNK):
+        size = min(SEED_CHUNK, rows - offset)
+        cursor.execute(
+            f"""
+            INSERT INTO Parcels (platform_id, order_id, status, next_check_at)
+            WITH RECURSIVE seq (n) AS (
+                SELECT {offset} UNION ALL SELECT n + 1 FROM seq WHERE n < {offset + size - 1}
+            )
+            SELECT
+                n % 4 + 1,
+                CONCAT('ORDER', LPAD(n, 10, '0')),
+                '包裹配達取件門市',
+                UTC_TIMESTAMP() + INTERVAL ((n * 7919 % 86400) - 600) SECOND
+            FROM seq
+            """
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO Subscriptions (platform_id, order_id, email, discord_id)
+            WITH RECURSIVE seq (n) AS (
+                SELECT {offset} UNION ALL SELECT n + 1 FROM seq WHERE n < {offset + size - 1}
+            )
+            SELECT
+                n % 4 + 1,
+                CONCAT('ORDER', LPAD(n, 10, '0')),
+                IF(n % 2 = 0, CONCAT('user', n % {SUBSCRIBERS}, '@example.com'), NULL),
+                IF(n % 2 = 1, CAST(100000000000000000 + n % {SUBSCRIBERS} AS CHAR), NULL)
+            FROM seq
+            """
+        )
+        # A notification waiting in the outbox for every 100th parcel
+        cursor.execute(
+            f"""
+            INSERT INTO NotificationOutbox (channel, recipient, payload, next_attempt_at)
+            WITH RECURSIVE seq (n) AS (
+                SELECT {offset} UNION ALL SELECT n + 1 FROM seq WHERE n < {offset + size - 1}
+            )
+            SELECT
+                'discord',
+                CAST(100000000000000000 + n % {SUBSCRIBERS} AS CHAR),
+                JSON_OBJECT('order_id', CONCAT('ORDER', LPAD(n, 10, '0'))),
+                UTC_TIMESTAMP() + INTERVAL ((n * 7919 % 86400) - 600) SECOND
+            FROM seq
+            WHERE n % 100 = 0
+            """
+        )
+        conn.commit()
+        print(f"Seeded {offset + size}/{rows} rows")
+
+    cursor.execute(
+        "ANALYZE TABLE Parcels, Subscriptions, Platforms, NotificationOutbox"
+    )
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+
+def table_plans(plan) -> list[dict]:
+    """
+    Find the access plan of every table in an `EXPLAIN FORMAT=JSON` plan
+    """
+
+    found = []
+    if isinstance(plan, dict):
+        if "table_name" in plan and "access_type" in plan:
+            found.append(plan)
+        for value in plan.values():
+            found.extend(table_plans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(table_plans(value))
+    return found
+
+
+def run_check(cursor, check: Check) -> list[str]:
+    cursor.execute("EXPLAIN FORMAT=JSON " + check.sql, check.params)
+    (plan,) = cursor.fetchone()
+    plans = {p["table_name"]: p for p in table_plans(json.loads(plan))}
+
+    problems = []
+    for table, plan in plans.items():
+        print(
+            f"    {table:<14}{plan['access_type']:<8}{str(plan.get('key')):<30}"
+            f"rows={plan.get('rows_examined_per_scan', '?')}"
+            f"{' covering' if plan.get('using_index') else ''}"
+        )
+
+    for table, expectation in check.tables.items():
+        plan = plans.get(table)
+        if plan is None:
+            problems.append(f"{table} is not in the plan")
+        elif plan["access_type"] == "ALL":
+            problems.append(f"{table} is read with a full table scan")
+        elif plan.get("key") not in expectation.keys:
+            problems.append(f"{table} is read from {plan.get('key')}")
+        elif expectation.covering and not plan.get("using_index"):
+            problems.append(f"{table} is not covered by {plan.get('key')}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="parcel_tracker_explain")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--drop", action="store_true", help="drop the scratch database at the end"
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="build the schema with the migrations instead of init.sql",
+    )
+    args = parser.parse_args()
+
+    conn = connect(
+        host=os.getenv("MYSQL_URL"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        time_zone=SESSION_TIME_ZONE,
+    )
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+    cursor.execute(f"USE `{args.database}`")
+
+    failed = False
+    try:
+        cursor.execute("SHOW TABLES LIKE 'Parcels'")
+        if cursor.fetchone() is None:
+            create_schema(
+                cursor, MIGRATED_SCHEMA_FILES if args.migrate else SCHEMA_FILES
+            )
+            conn.commit()
+        if args.migrate:
+            print("migrated schema")
+            problems = check_migrated_schema(cursor, args.database)
+            for problem in problems:
+                print(f"  FAIL: {problem}")
+            failed |= bool(problems)
+        seed(conn, args.rows)
+
+        for check in build_checks():
+            print(check.name)
+            problems = run_check(cursor, check)
+            for problem in problems:
+                print(f"  FAIL: {problem}")
+            failed |= bool(problems)
+    finally:
+        if args.drop:
+            cursor.execute(f"DROP DATABASE `{args.database}`")
+        conn.close()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
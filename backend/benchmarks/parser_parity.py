@@ -0,0 +1,64 @@
+"""
+Check the fast response parsers give the same result as the BeautifulSoup ones
+
+Every `seven_eleven_*.html` and `okmart_*.html` file of the fixture directory
+is parsed in both modes, and any difference is reported. Recorded carrier
+responses can be dropped in the directory to extend the check. Run from
+`backend/`:
+
+    python -m benchmarks.parser_parity
+    python -m benchmarks.parser_parity --fixtures path/to/responses
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from parcel_tw.okmart import OKMartResponseParser
+from parcel_tw.seven_eleven import SevenElevenResponseParser
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+PARSERS = {
+    "seven_eleven": SevenElevenResponseParser,
+    "okmart": OKMartResponseParser,
+}
+
+
+def check(path: Path) -> bool:
+    parser = next(
+        (parser for prefix, parser in PARSERS.items() if path.name.startswith(prefix)),
+        None,
+    )
+    if parser is None:
+        return True
+
+    html = path.read_text(encoding="utf-8")
+    expected = parser(html, fast=False).parse()
+    result = parser(html, fast=True).parse()
+
+    if result == expected and list(result) == list(expected):
+        print(f"ok        {path.name}")
+        return True
+
+    print(f"MISMATCH  {path.name}")
+    print(f"  soup: {expected}")
+    print(f"  fast: {result}")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    paths = sorted(args.fixtures.glob("*.html"))
+    if not paths:
+        parser.error(f"No html fixtures found in {args.fixtures}")
+
+    results = [check(path) for path in paths]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark the parse and convert stage of every tracker on recorded fixtures
+
+Every response parser and tracking info adapter is timed on its own, without
+any network access, and reported with its throughput and allocations per
+call. Results can be saved and compared between commits. Run from
+`backend/`:
+
+    python -m benchmarks.parsers
+    python -m benchmarks.parsers --save before.json
+    python -m benchmarks.parsers --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import timeit
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from parcel_tw.family_mart import FamilyMartTracker
+from parcel_tw.okmart import OKMartResponseParser, OKMartTrackingInfoAdapter
+from parcel_tw.seven_eleven import (
+    SevenElevenResponseParser,
+    SevenElevenTrackingInfoAdapter,
+)
+from parcel_tw.shopee import ShopeeTrackingInfoAdapter
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+def load_cases(fixtures: Path) -> dict[str, Callable[[], object]]:
+    """
+    Build the benchmark cases, by name, from the fixture directory
+    """
+
+    seven_eleven_html = (fixtures / "seven_eleven_delivered.html").read_text("utf-8")
+    okmart_html = (fixtures / "okmart_picked_up.html").read_text("utf-8")
+    family_mart_text = (fixtures / "family_mart_get_order_detail.json").read_text(
+        "utf-8"
+    )
+    shopee_text = (fixtures / "shopee_ready_collection.json").read_text("utf-8")
+
+    family_mart = FamilyMartTracker()
+    seven_eleven_data = SevenElevenResponseParser(seven_eleven_html).parse()
+    okmart_data = OKMartResponseParser(okmart_html).parse()
+    family_mart_data = family_mart._parse_response(family_mart_text)
+    shopee_data = json.loads(shopee_text)
+
+    return {
+        "seven_eleven.parse": lambda: SevenElevenResponseParser(
+            seven_eleven_html
+        ).parse(),
+        "seven_eleven.parse[soup]": lambda: SevenElevenResponseParser(
+            seven_eleven_html, fast=False
+        ).parse(),
+        "seven_eleven.convert": lambda: SevenElevenTrackingInfoAdapter.convert(
+            seven_eleven_data
+        ),
+        "okmart.parse": lambda: OKMartResponseParser(okmart_html).parse(),
+        "okmart.parse[soup]": lambda: OKMartResponseParser(
+            okmart_html, fast=False
+        ).parse(),
+        "okmart.convert": lambda: OKMartTrackingInfoAdapter.convert(okmart_data),
+        "family_mart.parse": lambda: family_mart._parse_response(family_mart_text),
+        "family_mart.convert": lambda: family_mart._convert_to_tracking_info(
+            family_mart_data
+        ),
+        "shopee.parse": lambda: json.loads(shopee_text),
+        "shopee.convert": lambda: ShopeeTrackingInfoAdapter.convert(shopee_data),
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """
+    Time a case and count the memory it allocates per call
+
+    The number of calls per round is picked so a round takes at least
+    `min_time` seconds, the best round of `repeat` is reported.
+    """
+
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    rounds = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    best = min(rounds)
+
+    fn()  # Warm up caches so only the per-call allocations are counted
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        "calls": number * repeat,
+        "best_us": best * 1e6,
+        "median_us": statistics.median(rounds) * 1e6,
+        "ops_per_sec": 1 / best,
+        "peak_kib": (peak - before) / 1024,
+        "retained_kib": (after - before) / 1024,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict[str, dict], baseline: dict[str, dict] | None):
+    header = (
+        f"{'case':<28}{'best us':>10}{'median us':>11}{'ops/s':>11}"
+        f"{'peak KiB':>10}{'kept KiB':>10}"
+    )
+    print(header + (f"{'vs base':>10}" if baseline else ""))
+
+    for name, result in results.items():
+        line = (
+            f"{name:<28}{result['best_us']:>10.1f}{result['median_us']:>11.1f}"
+            f"{result['ops_per_sec']:>11.0f}{result['peak_kib']:>10.1f}"
+            f"{result['retained_kib']:>10.1f}"
+        )
+        if baseline and name in baseline:
+            change = result["best_us"] / baseline[name]["best_us"] - 1
+            line += f"{change:>+10.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--filter", default="", help="only run the matching cases")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="minimum seconds per round"
+    )
+    parser.add_argument("--save", type=Path, help="save the results as json")
+    parser.add_argument("--compare", type=Path, help="results to compare against")
+    args = parser.parse_args()
+
+    cases = {
+        name: fn
+        for name, fn in load_cases(args.fixtures).items()
+        if args.filter in name
+    }
+    if not cases:
+        parser.error(f"No benchmark case matches {args.filter!r}")
+
+    results = {
+        name: measure(fn, args.repeat, args.min_time) for name, fn in cases.items()
+    }
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        args.save.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
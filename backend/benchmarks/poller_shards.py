@@ -0,0 +1,246 @@
+"""
+Run the subscription poller in several local processes against one MySQL
+
+Every process is a replica polling a scratch database seeded like
+`benchmarks.explain_queries`, with the carriers replaced by a fixed latency.
+The run shows how the parcels are split between the replicas, that no parcel
+is polled twice, and the throughput for each number of replicas, timed from
+the moment every replica is started and ready to poll. With `--kill-after`,
+the first replica is killed mid-run and its leased parcels must be picked up
+by the others once the lease expires, the run reports how long that took.
+Run from `backend/` with the `MYSQL_*` environment variables of the API:
+
+    python -m benchmarks.poller_shards --nodes 1,2,4 --rows 20000
+    python -m benchmarks.poller_shards --nodes 3 --kill-after 2 --lease-ttl 5
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from collections import Counter
+
+from mysql.connector import connect
+
+from benchmarks.explain_queries import create_schema, seed
+from database import SESSION_TIME_ZONE
+
+SEEDED_STATUS = "包裹配達取件門市"
+
+
+def run_node(node_id: str, args, results, ready, stop):
+    """
+    Poll the scratch database until `stop` is set, reporting every checked
+    parcel to `results`, once `ready` is told the node is started
+    """
+
+    os.environ.update(
+        MYSQL_DATABASE=args.database,
+        POLL_NODE_ID=node_id,
+        POLL_LEASE_TTL=str(args.lease_ttl),
+        POLL_CHUNK_SIZE=str(args.chunk_size),
+    )
+    import api
+    from parcel_tw import TrackingInfo
+
+    async def simulated_track_many(parcels, concurrency):
+        semaphore = asyncio.Semaphore(sum(concurrency.values()))
+
+        async def track(platform, order_id):
+            async with semaphore:
+                await asyncio.sleep(args.latency)
+            return (
+                platform,
+                order_id,
+                TrackingInfo(
+                    order_id=order_id,
+                    platform=platform.value,
+                    time=None,
+                    status=SEEDED_STATUS,
+                    is_delivered=False,
+                    raw_data={},
+                ),
+                None,
+            )
+
+        parcels = list(parcels)
+        for future in asyncio.as_completed([track(*parcel) for parcel in parcels]):
+            yield await future
+        results.put((node_id, [order_id for _, order_id in parcels]))
+
+    api.async_track_many = simulated_track_many
+    ready.put(node_id)
+
+    async def poll():
+        while not stop.is_set():
+            await api.check_subscriptions()
+            await asyncio.sleep(0.5)
+        await api.db.close()
+
+    asyncio.run(poll())
+
+
+def pending(conn) -> int:
+    """
+    The number of parcels not polled yet, a polled one is due in 10+ minutes
+    and a leased one is still being polled
+    """
+
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(
+        "SELECT COUNT(*) FROM Parcels "
+        "WHERE next_check_at < UTC_TIMESTAMP() + INTERVAL 5 MINUTE "
+        "OR leased_by IS NOT NULL"
+    )
+    (count,) = cursor.fetchone()
+    conn.commit()
+    return count
+
+
+def leased_by(conn, node_id: str) -> int:
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("SELECT COUNT(*) FROM Parcels WHERE leased_by = %s", (node_id,))
+    (count,) = cursor.fetchone()
+    conn.commit()
+    return count
+
+
+def run(args, conn, nodes: int) -> float:
+    """
+    Poll every parcel once with `nodes` replicas, returning the parcels
+    polled per second
+    """
+
+    # Nothing is due until every replica is ready
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE Parcels SET status = %s, leased_by = NULL, unchanged_checks = 0, "
+        "next_check_at = UTC_TIMESTAMP() + INTERVAL 1 DAY",
+        (SEEDED_STATUS,),
+    )
+    conn.commit()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    ready = context.Queue()
+    stop = context.Event()
+    processes = [
+        context.Process(
+            target=run_node,
+            args=(f"node-{i}", args, results, ready, stop),
+            daemon=True,
+        )
+        for i in range(nodes)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=args.timeout)
+
+    cursor.execute(
+        "UPDATE Parcels SET next_check_at = UTC_TIMESTAMP() - INTERVAL 1 SECOND"
+    )
+    conn.commit()
+    start = time.perf_counter()
+
+    killed_at = None
+    takeover = None
+    while pending(conn) > 0:
+        now = time.perf_counter()
+        if now - start > args.timeout:
+            print(f"  gave up after {args.timeout}s")
+            break
+        if args.kill_after and killed_at is None and now - start > args.kill_after:
+            processes[0].kill()
+            killed_at = now
+            print(
+                f"  killed node-0 after {args.kill_after}s, "
+                f"holding {leased_by(conn, 'node-0')} leases"
+            )
+        if killed_at is not None and takeover is None:
+            if leased_by(conn, "node-0") == 0:
+                takeover = now - killed_at
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - start
+    if killed_at is not None and takeover is None and leased_by(conn, "node-0") == 0:
+        takeover = time.perf_counter() - killed_at
+
+    stop.set()
+    for process in processes:
+        process.join(timeout=10)
+
+    checks = Counter()
+    per_node = Counter()
+    while True:
+        try:
+            node_id, order_ids = results.get(timeout=1)
+        except queue.Empty:
+            break
+        per_node[node_id] += len(order_ids)
+        checks.update(order_ids)
+
+    duplicates = sum(count - 1 for count in checks.values())
+    throughput = len(checks) / elapsed
+    print(
+        f"{nodes} node(s): {len(checks)} parcels in {elapsed:.1f}s, "
+        f"{throughput:.0f} parcels/s, {duplicates} polled twice"
+    )
+    for node_id, count in sorted(per_node.items()):
+        print(f"  {node_id}: {count}")
+    if takeover is not None:
+        print(f"  the leases of node-0 were taken over after {takeover:.1f}s")
+    elif killed_at is not None:
+        print("  the leases of node-0 were never taken over")
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="parcel_tracker_shards")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument(
+        "--nodes", default="1,2,4", help="comma separated numbers of replicas"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per carrier lookup"
+    )
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--lease-ttl", type=float, default=60)
+    parser.add_argument("--kill-after", type=float, help="kill node-0 after seconds")
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="seconds before giving up a run"
+    )
+    args = parser.parse_args()
+
+    conn = connect(
+        host=os.getenv("MYSQL_URL"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        time_zone=SESSION_TIME_ZONE,
+    )
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+    cursor.execute(f"USE `{args.database}`")
+    cursor.execute("SHOW TABLES LIKE 'Parcels'")
+    if cursor.fetchone() is None:
+        create_schema(cursor)
+        conn.commit()
+    seed(conn, args.rows)
+
+    throughputs = {}
+    try:
+        for nodes in map(int, args.nodes.split(",")):
+            throughputs[nodes] = run(args, conn, nodes)
+    finally:
+        conn.close()
+
+    print(f"{'nodes':<8}{'parcels/s':>12}{'speedup':>10}")
+    baseline = next(iter(throughputs.values()))
+    for nodes, throughput in throughputs.items():
+        print(f"{nodes:<8}{throughput:>12.0f}{throughput / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark the email notifications against a local SMTP server
+
+An aiosmtpd server (from `requirements-dev.txt`) stands in for the SMTP
+relay. The status changes are split into outbox batches and merged into one
+digest per recipient and batch, like `OutboxDispatcher` does, then sent
+either over one connection per batch or over one connection per email. The server checks
+that every digest arrived with all of its changes. `--handshake-latency`
+delays the EHLO reply, to account for the TLS and login round trips of a
+real relay. Run from `backend/`:
+
+    python -m benchmarks.smtp --changes 2000 --recipients 500
+    python -m benchmarks.smtp --changes 2000 --handshake-latency 0.05
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from email import message_from_bytes, policy
+
+from aiosmtpd.controller import Controller
+
+from mailer import Mailer, SMTPConfig
+
+PLATFORMS = ["seven_eleven", "family_mart", "ok_mart", "shopee"]
+
+
+class CountingHandler:
+    def __init__(self, handshake_latency: float):
+        self.handshake_latency = handshake_latency
+        self.received = Counter()  # Recipient -> number of emails
+        self.changes = Counter()  # Recipient -> number of changes
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.handshake_latency)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        message = message_from_bytes(envelope.content, policy=policy.default)
+        lines = message.get_content().splitlines()
+        for recipient in envelope.rcpt_tos:
+            self.received[recipient] += 1
+            self.changes[recipient] += len(lines)
+        return "250 Message accepted for delivery"
+
+
+def create_changes(count: int, recipients: int) -> list[tuple[str, dict]]:
+    changes = []
+    for i in range(count):
+        recipient = f"user{random.randrange(recipients)}@example.com"
+        change = {
+            "platform": random.choice(PLATFORMS),
+            "order_id": f"{i:08d}",
+            "status": "包裹配達取件門市",
+            "time": "2024-01-01 12:00:00",
+        }
+        changes.append((recipient, change))
+    return changes
+
+
+def create_digests(mailer: Mailer, changes: list, batch_size: int) -> list[list]:
+    """
+    Merge the changes of every outbox batch into one digest per recipient
+    """
+
+    batches = []
+    for i in range(0, len(changes), batch_size):
+        digests: dict[str, list[dict]] = {}
+        for recipient, change in changes[i : i + batch_size]:
+            digests.setdefault(recipient, []).append(change)
+        batches.append(
+            [mailer.build_digest(recipient, c) for recipient, c in digests.items()]
+        )
+    return batches
+
+
+def run(mode: str, mailer: Mailer, batches: list[list]) -> tuple[float, int]:
+    failed = 0
+    start = time.perf_counter()
+    for batch in batches:
+        if mode == "pooled":
+            errors = mailer.send(batch)
+        else:
+            errors = [error for message in batch for error in mailer.send([message])]
+        failed += sum(error is not None for error in errors)
+    return time.perf_counter() - start, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--changes", type=int, default=2000)
+    parser.add_argument(
+        "--recipients", type=int, default=500, help="distinct email subscribers"
+    )
+    parser.add_argument("--batch-size", type=int, default=100, help="outbox batch")
+    parser.add_argument(
+        "--handshake-latency", type=float, default=0, help="seconds per EHLO"
+    )
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    handler = CountingHandler(args.handshake_latency)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        mailer = Mailer(SMTPConfig(host="127.0.0.1", port=args.port, starttls=False))
+        changes = create_changes(args.changes, args.recipients)
+        batches = create_digests(mailer, changes, args.batch_size)
+        emails = sum(map(len, batches))
+        print(
+            f"{args.changes} changes to {args.recipients} recipients, "
+            f"{emails} digests in {len(batches)} batches"
+        )
+
+        expected_emails = Counter()
+        expected_changes = Counter(recipient for recipient, _ in changes)
+        for batch in batches:
+            expected_emails.update(message["To"] for message in batch)
+
+        print(f"{'mode':<12}{'seconds':>10}{'emails/s':>12}{'changes/s':>12}")
+        for mode in ["pooled", "per-email"]:
+            handler.received.clear()
+            handler.changes.clear()
+            elapsed, failed = run(mode, mailer, batches)
+            if failed:
+                print(f"{mode}: {failed} emails failed")
+            if handler.received != expected_emails:
+                print(f"{mode}: the server didn't receive every digest")
+            if handler.changes != expected_changes:
+                print(f"{mode}: the digests are missing changes")
+            print(
+                f"{mode:<12}{elapsed:>10.2f}{emails / elapsed:>12.0f}"
+                f"{args.changes / elapsed:>12.0f}"
+            )
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
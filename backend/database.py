@@ -0,0 +1,423 @@
+import asyncio
+import logging
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Iterable, Sequence
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+
+from parcel_tw.metrics import metrics
+
+# Timestamps are read and written as naive UTC datetimes
+SESSION_TIME_ZONE = "+00:00"
+
+POOL_WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+
+
+@dataclass
+class DatabaseConfig:
+    host: str | None = None
+    user: str | None = None
+    password: str | None = None
+    database: str | None = None
+    driver: str = "mysql-connector"  # mysql-connector (threaded) or aiomysql
+    pool_size: int = 5  # Max connections open at once
+    checkout_timeout: float = 5  # Seconds to wait for a free connection
+    health_check_interval: float = 30  # Ping connections idle for longer
+    connect_timeout: float = 10
+
+
+class DatabaseError(Exception):
+    """
+    Raised when a query fails or no connection can be made, whatever the driver
+    """
+
+    pass
+
+
+class PoolTimeout(DatabaseError):
+    """
+    Raised when no connection was freed within the checkout timeout
+    """
+
+    pass
+
+
+class Connection(ABC):
+    """
+    A driver connection with an async API
+
+    Every method raises `DatabaseError` on failure.
+    """
+
+    last_used: float = 0
+
+    @abstractmethod
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """
+        Run a statement and return the number of affected rows
+        """
+        pass
+
+    @abstractmethod
+    async def executemany(self, sql: str, seq_params: Iterable[Sequence]) -> int:
+        pass
+
+    @abstractmethod
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list[tuple]:
+        pass
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> tuple | None:
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    @abstractmethod
+    async def commit(self):
+        pass
+
+    @abstractmethod
+    async def rollback(self):
+        pass
+
+    @abstractmethod
+    async def ping(self) -> bool:
+        """
+        Check the connection is still usable
+        """
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class MySQLConnectorConnection(Connection):
+    def __init__(self, conn):
+        """
+        `mysql.connector` connection, every call runs in a worker thread so the
+        event loop is never blocked
+        """
+
+        self.conn = conn
+
+    @classmethod
+    async def connect(cls, config: DatabaseConfig) -> "MySQLConnectorConnection":
+        from mysql.connector import Error, connect
+
+        try:
+            conn = await asyncio.to_thread(
+                connect,
+                host=config.host,
+                user=config.user,
+                password=config.password,
+                database=config.database,
+                connection_timeout=config.connect_timeout,
+                time_zone=SESSION_TIME_ZONE,
+            )
+        except Error as e:
+            raise DatabaseError(f"Database connection failed: {e}") from e
+        return cls(conn)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        return await self._run(self._execute, sql, params)
+
+    async def executemany(self, sql: str, seq_params: Iterable[Sequence]) -> int:
+        return await self._run(self._executemany, sql, list(seq_params))
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list[tuple]:
+        return await self._run(self._fetchall, sql, params)
+
+    async def commit(self):
+        await self._run(self.conn.commit)
+
+    async def rollback(self):
+        await self._run(self.conn.rollback)
+
+    async def ping(self) -> bool:
+        try:
+            await self._run(self.conn.ping, reconnect=False)
+            return True
+        except DatabaseError:
+            return False
+
+    async def close(self):
+        try:
+            await self._run(self.conn.close)
+        except DatabaseError:
+            pass
+
+    async def _run(self, fn, *args, **kwargs):
+        from mysql.connector import Error
+
+        try:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        except Error as e:
+            raise DatabaseError(str(e)) from e
+
+    def _execute(self, sql: str, params: Sequence) -> int:
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def _executemany(self, sql: str, seq_params: list[Sequence]) -> int:
+        with self.conn.cursor() as cursor:
+            cursor.executemany(sql, seq_params)
+            return cursor.rowcount
+
+    def _fetchall(self, sql: str, params: Sequence) -> list[tuple]:
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class AiomysqlConnection(Connection):
+    def __init__(self, conn):
+        """
+        Non-blocking `aiomysql` connection, requires the optional `aiomysql`
+        package
+        """
+
+        self.conn = conn
+
+    @classmethod
+    async def connect(cls, config: DatabaseConfig) -> "AiomysqlConnection":
+        import aiomysql
+        from pymysql.err import MySQLError
+
+        try:
+            conn = await aiomysql.connect(
+                host=config.host,
+                user=config.user,
+                password=config.password or "",
+                db=config.database,
+                connect_timeout=config.connect_timeout,
+                init_command=f"SET time_zone = '{SESSION_TIME_ZONE}'",
+            )
+        except (MySQLError, OSError) as e:
+            raise DatabaseError(f"Database connection failed: {e}") from e
+        return cls(conn)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        async with self._cursor() as cursor:
+            await cursor.execute(sql, params)
+            return cursor.rowcount
+
+    async def executemany(self, sql: str, seq_params: Iterable[Sequence]) -> int:
+        async with self._cursor() as cursor:
+            await cursor.executemany(sql, list(seq_params))
+            return cursor.rowcount
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list[tuple]:
+        async with self._cursor() as cursor:
+            await cursor.execute(sql, params)
+            return list(await cursor.fetchall())
+
+    async def commit(self):
+        async with self._errors():
+            await self.conn.commit()
+
+    async def rollback(self):
+        async with self._errors():
+            await self.conn.rollback()
+
+    async def ping(self) -> bool:
+        try:
+            async with self._errors():
+                await self.conn.ping(reconnect=False)
+            return True
+        except DatabaseError:
+            return False
+
+    async def close(self):
+        try:
+            self.conn.close()
+        except RuntimeError:
+            # The connection belongs to an event loop which is closed, so its
+            # transport can't close itself, hang up the socket directly
+            with suppress(OSError):
+                sock = self.conn._writer.get_extra_info("socket")
+                sock.shutdown(socket.SHUT_RDWR)
+
+    @asynccontextmanager
+    async def _cursor(self):
+        async with self._errors():
+            async with self.conn.cursor() as cursor:
+                yield cursor
+
+    @asynccontextmanager
+    async def _errors(self):
+        from pymysql.err import MySQLError
+
+        try:
+            yield
+        except (MySQLError, OSError) as e:
+            raise DatabaseError(str(e)) from e
+
+
+DRIVERS = {
+    "mysql-connector": MySQLConnectorConnection,
+    "aiomysql": AiomysqlConnection,
+}
+
+
+class Database:
+    def __init__(self, config: DatabaseConfig):
+        """
+        MySQL connection pool with an async API
+
+        Connections are opened on demand up to `pool_size`, kept open between
+        requests, and pinged before reuse if they have been idle for longer
+        than `health_check_interval`.
+
+        Parameters
+        ----------
+        config : DatabaseConfig
+            The connection settings, pool size and timeouts
+
+        Raises
+        ------
+        ValueError
+            If the driver is unknown
+        """
+
+        if config.driver not in DRIVERS:
+            raise ValueError(f"Invalid database driver: {config.driver}")
+
+        self.config = config
+        self.driver = DRIVERS[config.driver]
+        self._idle: list[Connection] = []
+        self._slots: asyncio.Semaphore | None = None
+        self._slots_loop: asyncio.AbstractEventLoop | None = None
+
+        self.size = metrics.gauge("db.pool.size")
+        self.size.set(config.pool_size)
+        self.open = metrics.gauge("db.pool.open")
+        self.in_use = metrics.gauge("db.pool.in_use")
+        self.utilization = metrics.gauge("db.pool.utilization")
+        self.wait = metrics.histogram("db.pool.wait_seconds", POOL_WAIT_BUCKETS)
+        self.timeouts = metrics.counter("db.pool.timeouts")
+        self.health_check_failures = metrics.counter("db.pool.health_check_failures")
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Connection]:
+        """
+        Check out a connection for a transaction
+
+        The transaction is committed when the block exits, or rolled back if
+        it raises.
+
+        Raises
+        ------
+        PoolTimeout
+            If no connection was freed within the checkout timeout
+        DatabaseError
+            If a connection cannot be made
+        """
+
+        conn, slots = await self._acquire()
+        broken = False
+        try:
+            yield conn
+            await conn.commit()
+        except BaseException:
+            try:
+                await conn.rollback()
+            except DatabaseError:
+                broken = True
+            raise
+        finally:
+            await self._release(conn, slots, broken)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        async with self.transaction() as conn:
+            return await conn.execute(sql, params)
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list[tuple]:
+        async with self.transaction() as conn:
+            return await conn.fetchall(sql, params)
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> tuple | None:
+        async with self.transaction() as conn:
+            return await conn.fetchone(sql, params)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+        self.open.dec(len(idle))
+
+    async def _acquire(self) -> tuple[Connection, asyncio.Semaphore]:
+        """
+        Check out a connection, with the semaphore of the slot it took
+        """
+
+        slots = await self._get_slots()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.config.checkout_timeout)
+        except TimeoutError:
+            self.timeouts.inc()
+            raise PoolTimeout(
+                f"No database connection was freed in {self.config.checkout_timeout}s"
+            )
+        self.wait.observe(time.perf_counter() - start)
+
+        try:
+            conn = await self._checkout()
+        except BaseException:
+            slots.release()
+            raise
+
+        self.in_use.inc()
+        self.utilization.set(self.in_use.value / self.config.pool_size)
+        return conn, slots
+
+    async def _checkout(self) -> Connection:
+        while self._idle:
+            conn = self._idle.pop()
+            if time.monotonic() - conn.last_used < self.config.health_check_interval:
+                return conn
+            if await conn.ping():
+                return conn
+
+            logging.warning("[Database] Dropping a broken idle connection")
+            self.health_check_failures.inc()
+            self.open.dec()
+            await conn.close()
+
+        conn = await self.driver.connect(self.config)
+        self.open.inc()
+        return conn
+
+    async def _release(self, conn: Connection, slots: asyncio.Semaphore, broken: bool):
+        """
+        Return a connection to the pool, freeing the slot it was checked out
+        with
+        """
+
+        self.in_use.dec()
+        self.utilization.set(self.in_use.value / self.config.pool_size)
+        if slots is not self._slots:
+            # The pool moved to another event loop meanwhile, the connection
+            # belongs to the old one and was already left out of `open`
+            await conn.close()
+        elif broken:
+            self.open.dec()
+            await conn.close()
+        else:
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+        slots.release()
+
+    async def _get_slots(self) -> asyncio.Semaphore:
+        # The semaphore (and the connections) belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.config.pool_size)
+            self._slots_loop = loop
+            stale, self._idle = self._idle, []
+            self.open.set(0)
+            for conn in stale:
+                await conn.close()
+        return self._slots
@@ -0,0 +1,135 @@
+import smtplib
+import ssl
+from dataclasses import dataclass
+from email.message import EmailMessage
+
+PLATFORM_NAMES = {
+    "seven_eleven": "7-11",
+    "family_mart": "全家",
+    "ok_mart": "OK",
+    "shopee": "蝦皮",
+}
+
+
+@dataclass
+class SMTPConfig:
+    host: str
+    port: int = 587
+    username: str | None = None
+    password: str | None = None
+    starttls: bool = True
+    sender: str = "parcel-tracker@localhost"
+    timeout: float = 10
+
+
+class Mailer:
+    def __init__(self, config: SMTPConfig):
+        """
+        Send batches of emails over a single SMTP connection
+
+        Parameters
+        ----------
+        config : SMTPConfig
+            The SMTP server, credentials and sender address
+        """
+
+        self.config = config
+
+    def send(self, messages: list[EmailMessage]) -> list[Exception | None]:
+        """
+        Send the messages over one connection, which is closed afterwards
+
+        Blocks on the network, run it in a thread from async code.
+
+        Parameters
+        ----------
+        messages : list[EmailMessage]
+            The messages to send
+
+        Returns
+        -------
+        list[Exception | None]
+            The error of every message, `None` if it was sent. If the
+            connection fails, the messages left get its error.
+        """
+
+        errors: list[Exception | None] = []
+        if not messages:
+            return errors
+
+        try:
+            smtp = self._connect()
+        except (smtplib.SMTPException, OSError) as e:
+            return [e] * len(messages)
+
+        try:
+            for message in messages:
+                try:
+                    smtp.send_message(message)
+                    errors.append(None)
+                except (
+                    smtplib.SMTPSenderRefused,
+                    smtplib.SMTPRecipientsRefused,
+                    smtplib.SMTPDataError,
+                ) as e:
+                    # The connection is still usable
+                    errors.append(e)
+                    smtp.rset()
+        except (smtplib.SMTPException, OSError) as e:
+            errors += [e] * (len(messages) - len(errors))
+        finally:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+        return errors
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(
+            self.config.host, self.config.port, timeout=self.config.timeout
+        )
+        try:
+            if self.config.starttls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.config.username:
+                smtp.login(self.config.username, self.config.password or "")
+        except BaseException:
+            smtp.close()
+            raise
+        return smtp
+
+    def build_digest(self, recipient: str, changes: list[dict]) -> EmailMessage:
+        """
+        Merge the status changes of a recipient's parcels into one email
+
+        Parameters
+        ----------
+        recipient : str
+            The email address of the subscriber
+        changes : list[dict]
+            The notification payloads, with a `platform`, an `order_id`, a
+            `status` and a `time`
+
+        Returns
+        -------
+        EmailMessage
+            The digest email
+        """
+
+        lines = []
+        for change in changes:
+            platform = PLATFORM_NAMES.get(change["platform"], change["platform"])
+            line = f"[{platform}] {change['order_id']}: {change['status']}"
+            if change.get("time") is not None:
+                line += f" ({change['time']})"
+            lines.append(line)
+
+        message = EmailMessage()
+        message["From"] = self.config.sender
+        message["To"] = recipient
+        if len(changes) == 1:
+            message["Subject"] = "包裹狀態更新"
+        else:
+            message["Subject"] = f"{len(changes)} 個包裹狀態更新"
+        message.set_content("\n".join(lines) + "\n")
+        return message
@@ -0,0 +1,411 @@
+import asyncio
+import json
+import random
+import smtplib
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Final
+
+import aiohttp
+import queries
+from database import Database
+from mailer import Mailer
+from parcel_tw.metrics import metrics
+from polling import utcnow
+
+DISCORD: Final = "discord"
+EMAIL: Final = "email"
+
+DELIVERY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+@dataclass
+class RetryPolicy:
+    base_delay: float = 5  # Seconds before the first retry
+    backoff: float = 2  # Delay growth per failed attempt
+    max_delay: float = 3600
+    max_attempts: int = 10  # Give the delivery up after this many attempts
+    jitter: float = 0.1  # Random fraction added to spread the retries out
+
+
+@dataclass
+class Notification:
+    id: int
+    channel: str
+    recipient: str
+    payload: dict
+    attempts: int
+    created_at: datetime
+
+
+class DeliveryError(Exception):
+    def __init__(
+        self,
+        message: str,
+        retry_after: float | None = None,
+        permanent: bool = False,
+        attempted: bool = True,
+    ):
+        """
+        Raised when a notification couldn't be delivered
+
+        Parameters
+        ----------
+        message : str
+            The error message, stored in `last_error`
+        retry_after : float | None
+            Seconds the receiver asked to wait before the next attempt
+        permanent : bool
+            Whether retrying is pointless, e.g. the payload was rejected
+        attempted : bool
+            Whether the notification was sent, which counts as an attempt
+        """
+
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+        self.attempted = attempted
+
+
+class PayloadTooLargeError(DeliveryError):
+    """
+    Raised when the webhook refused a request for holding too many
+    notifications
+    """
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        db: Database,
+        webhook_url: str | None,
+        node_id: str,
+        mailer: Mailer | None = None,
+        batch_size: int = 100,
+        post_size: int = 50,
+        concurrency: int = 8,
+        lease_ttl: float = 120,
+        poll_interval: float = 5,
+        timeout: float = 10,
+        policy: RetryPolicy | None = None,
+    ):
+        """
+        Deliver the notifications of the `NotificationOutbox` table
+
+        Due notifications are leased in batches, like the parcels of the
+        poller, and posted to the bot webhook as arrays of up to `post_size`
+        notifications, concurrently over keep-alive connections. A delivered
+        notification is deleted, a failed one is retried with an exponential
+        backoff until `policy.max_attempts`, or after the `Retry-After` of a
+        429 response, which also holds back the rest of the batch. A
+        notification is only deleted after the webhook accepted it, so it is
+        delivered at least once, even if the replica dies while sending it.
+
+        The email notifications of a batch are merged into one digest per
+        recipient, and the digests are sent over a single SMTP connection in
+        a worker thread, alongside the webhook requests.
+
+        Parameters
+        ----------
+        db : Database
+            The database holding the outbox
+        webhook_url : str | None
+            The URL of the bot webhook
+        node_id : str
+            The name of the replica in the leases
+        mailer : Mailer | None
+            The sender of the email notifications
+        batch_size : int
+            The max number of notifications leased at a time
+        post_size : int
+            The max number of notifications posted in one webhook request
+        concurrency : int
+            The max number of webhook requests in flight
+        lease_ttl : float
+            Seconds a leased notification is kept from the other replicas
+        poll_interval : float
+            Seconds between two looks at an empty outbox, unless woken up
+        timeout : float
+            Seconds a webhook request may take
+        policy : RetryPolicy | None
+            The retry delays
+        """
+
+        self.db = db
+        self.webhook_url = webhook_url
+        self.node_id = node_id
+        self.mailer = mailer
+        self.batch_size = batch_size
+        self.post_size = post_size
+        self.concurrency = concurrency
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.policy = policy or RetryPolicy()
+
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._slots: asyncio.Semaphore | None = None
+        # The webhook asked to slow down until then (monotonic time)
+        self._blocked_until = 0.0
+        self._session: aiohttp.ClientSession | None = None
+
+        self.sent = metrics.counter("outbox.sent")
+        self.retried = metrics.counter("outbox.retried")
+        self.dead = metrics.counter("outbox.dead")
+        # Seconds between a status change and the delivery of its notification
+        self.delay = metrics.histogram("outbox.delivery_seconds", DELIVERY_BUCKETS)
+
+    def start(self):
+        """
+        Start delivering the notifications in the background
+        """
+
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def wake(self):
+        """
+        Look at the outbox now, e.g. after new notifications were committed
+        """
+
+        self._wake.set()
+
+    async def _run(self):
+        failures = 0
+        while True:
+            self._wake.clear()
+            try:
+                count = await self.dispatch()
+                failures = 0
+            except Exception as e:
+                # Keep the loop alive, backing off while the error persists
+                print(f"Failed to dispatch notifications: {e!r}")
+                failures += 1
+                delay = self.poll_interval * 2 ** (failures - 1)
+                await asyncio.sleep(min(delay, self.policy.max_delay))
+                continue
+
+            # Keep draining full batches, otherwise wait for new notifications
+            if count < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch(self) -> int:
+        """
+        Lease a batch of due notifications and deliver them
+
+        Returns
+        -------
+        int
+            The number of notifications leased
+        """
+
+        now = utcnow()
+        async with self.db.transaction() as conn:
+            rows = await conn.fetchall(
+                queries.LOCK_DUE_NOTIFICATIONS, (now, self.batch_size)
+            )
+            if not rows:
+                return 0
+
+            ids = [row[0] for row in rows]
+            placeholders = ", ".join(["%s"] * len(ids))
+            await conn.execute(
+                queries.LEASE_NOTIFICATIONS.format(ids=placeholders),
+                (now + timedelta(seconds=self.lease_ttl), self.node_id, *ids),
+            )
+
+        notifications = []
+        rejected = []
+        for id, channel, recipient, payload, attempts, at in rows:
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                payload = None
+            notification = Notification(id, channel, recipient, payload, attempts, at)
+            if not isinstance(payload, dict):
+                error = DeliveryError("Malformed payload", permanent=True)
+                rejected.append((notification, error))
+            elif channel not in (DISCORD, EMAIL):
+                error = DeliveryError(f"Unknown channel: {channel}", permanent=True)
+                rejected.append((notification, error))
+            else:
+                notifications.append(notification)
+
+        discord = [n for n in notifications if n.channel == DISCORD]
+        chunks = [
+            discord[i : i + self.post_size]
+            for i in range(0, len(discord), self.post_size)
+        ]
+        digests: dict[str, list[Notification]] = {}
+        for notification in notifications:
+            if notification.channel == EMAIL:
+                digests.setdefault(notification.recipient, []).append(notification)
+
+        chunk_results, digest_errors = await asyncio.gather(
+            asyncio.gather(*map(self._deliver, chunks)),
+            self._mail(list(digests.values())),
+        )
+        # A chunk may have been split up, with an outcome for every part
+        results = [result for parts in chunk_results for result in parts]
+        results += zip(digests.values(), digest_errors)
+
+        delivered = []
+        retries = []
+        now = utcnow()
+        for group, error in results:
+            for notification in group:
+                if error is None:
+                    delivered.append(notification.id)
+                    delay = (now - notification.created_at).total_seconds()
+                    self.delay.observe(delay)
+                else:
+                    retries.append(self._retry(notification, error, now))
+        for notification, error in rejected:
+            retries.append(self._retry(notification, error, now))
+
+        async with self.db.transaction() as conn:
+            if delivered:
+                placeholders = ", ".join(["%s"] * len(delivered))
+                await conn.execute(
+                    queries.DELETE_NOTIFICATIONS.format(ids=placeholders), delivered
+                )
+            if retries:
+                await conn.executemany(queries.RETRY_NOTIFICATION, retries)
+
+        self.sent.inc(len(delivered))
+        return len(rows)
+
+    async def _deliver(
+        self, chunk: list[Notification]
+    ) -> list[tuple[list[Notification], DeliveryError | None]]:
+        """
+        Post a chunk of notifications to the webhook
+
+        A chunk refused for its size is split in halves which are posted
+        again, and the later chunks are made as small.
+
+        Returns
+        -------
+        list[tuple[list[Notification], DeliveryError | None]]
+            The parts of the chunk which were posted, with their error
+        """
+
+        if self.webhook_url is None:
+            return [(chunk, DeliveryError("Discord webhook is not configured"))]
+        try:
+            async with self._slots:
+                blocked = self._blocked_until - time.monotonic()
+                if blocked > 0:
+                    raise DeliveryError(
+                        "Webhook rate limited", retry_after=blocked, attempted=False
+                    )
+                await self._post(chunk)
+        except PayloadTooLargeError as e:
+            if len(chunk) == 1:
+                e.permanent = True
+                return [(chunk, e)]
+            half = (len(chunk) + 1) // 2
+            if half < self.post_size:
+                print(f"Webhook refused {len(chunk)} notifications, posting {half}")
+                self.post_size = half
+            parts = await asyncio.gather(
+                self._deliver(chunk[:half]), self._deliver(chunk[half:])
+            )
+            return parts[0] + parts[1]
+        except DeliveryError as e:
+            return [(chunk, e)]
+        return [(chunk, None)]
+
+    async def _post(self, chunk: list[Notification]):
+        payload = [{**n.payload, "id": n.id, "user_id": n.recipient} for n in chunk]
+        try:
+            async with self._session.post(self.webhook_url, json=payload) as response:
+                if response.status < 300:
+                    return
+                error = f"Webhook responded {response.status}: {await response.text()}"
+                if response.status == 429:
+                    retry_after = _parse_retry_after(response.headers)
+                    if retry_after is not None:
+                        self._blocked_until = time.monotonic() + retry_after
+                    raise DeliveryError(error, retry_after=retry_after)
+                if response.status == 413:
+                    raise PayloadTooLargeError(error)
+                if response.status < 500:
+                    raise DeliveryError(error, permanent=True)
+                raise DeliveryError(error)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DeliveryError(f"Webhook request failed: {e!r}") from e
+
+    async def _mail(
+        self, digests: list[list[Notification]]
+    ) -> list[DeliveryError | None]:
+        if not digests:
+            return []
+        if self.mailer is None:
+            return [DeliveryError("Email is not configured")] * len(digests)
+
+        messages = [
+            self.mailer.build_digest(digest[0].recipient, [n.payload for n in digest])
+            for digest in digests
+        ]
+        errors = await asyncio.to_thread(self.mailer.send, messages)
+        return [None if e is None else _smtp_error(e) for e in errors]
+
+    def _retry(
+        self, notification: Notification, error: DeliveryError, now: datetime
+    ) -> tuple:
+        attempts = notification.attempts + error.attempted
+        if error.permanent or attempts >= self.policy.max_attempts:
+            print(f"Gave up notification {notification.id}: {str(error)}")
+            self.dead.inc()
+            next_attempt_at = None
+        else:
+            self.retried.inc()
+            delay = error.retry_after
+            if delay is None:
+                delay = min(
+                    self.policy.base_delay * self.policy.backoff ** (attempts - 1),
+                    self.policy.max_delay,
+                )
+                delay *= 1 + random.uniform(0, self.policy.jitter)
+            next_attempt_at = now + timedelta(seconds=delay)
+        return attempts, next_attempt_at, str(error)[:255], notification.id
+
+
+def _parse_retry_after(headers) -> float | None:
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _smtp_error(error: Exception) -> DeliveryError:
+    message = f"SMTP delivery failed: {error!r}"
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return DeliveryError(message, permanent=True)
+    # 5xx replies to a message are permanent, unlike the login ones which
+    # are fixed in the configuration
+    if isinstance(error, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)):
+        return DeliveryError(message, permanent=500 <= error.smtp_code < 600)
+    return DeliveryError(message)
@@ -1,5 +1,14 @@
-from .base import TrackingInfo
-from .core import track
+from .base import CarrierUnavailableError, TrackingError, TrackingInfo
+from .core import async_lookup, async_track, async_track_many, track
 from .enums import Platform
 
-__all__ = ["TrackingInfo", "track", "Platform"]
+__all__ = [
+    "TrackingInfo",
+    "TrackingError",
+    "CarrierUnavailableError",
+    "track",
+    "async_track",
+    "async_lookup",
+    "async_track_many",
+    "Platform",
+]
@@ -1,6 +1,33 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 
+from .client import CarrierClient
+from .token_pool import TokenPool
+
+
+class TrackingError(Exception):
+    """
+    Raised when the carrier can't be reached or its response can't be read
+    """
+
+
+class CarrierUnavailableError(TrackingError):
+    def __init__(self, message: str, retry_after: float):
+        """
+        Raised without reaching the carrier, when it is rate limited or its
+        circuit breaker is open
+
+        Parameters
+        ----------
+        message : str
+            The error message
+        retry_after : float
+            Seconds after which the carrier may be available again
+        """
+
+        super().__init__(message)
+        self.retry_after = retry_after
+
 
 @dataclass
 class TrackingInfo:
@@ -13,6 +40,9 @@ class TrackingInfo:
 
 
 class Tracker(ABC):
+    client: CarrierClient
+    token_pool: TokenPool | None = None
+
     @abstractmethod
     def track_status(self, order_id: str) -> TrackingInfo | None:
         """
@@ -28,5 +58,42 @@ class Tracker(ABC):
         TrackingInfo | None
             A `TrackingInfo` object with the status details of the parcel,
             or `None` if no information is available.
+
+        Raises
+        ------
+        TrackingError
+            If the lookup failed
+        """
+        pass
+
+    @abstractmethod
+    async def async_track_status(self, order_id: str) -> TrackingInfo | None:
+        """
+        Track the parcel status by order_id without blocking the event loop
+
+        Parameters
+        ----------
+        order_id : str
+            The order_id of the parcel
+
+        Returns
+        -------
+        TrackingInfo | None
+            A `TrackingInfo` object with the status details of the parcel,
+            or `None` if no information is available.
+
+        Raises
+        ------
+        TrackingError
+            If the lookup failed
         """
         pass
+
+    async def aclose(self):
+        """
+        Stop the token pool and close the connection pools of the tracker
+        """
+
+        if self.token_pool is not None:
+            self.token_pool.stop()
+        await self.client.aclose()
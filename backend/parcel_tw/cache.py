@@ -0,0 +1,287 @@
+import dataclasses
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .base import TrackingInfo
+from .enums import Platform
+from .metrics import metrics
+
+# How long a found parcel is cached, in seconds. A 7-11 lookup costs a
+# captcha + OCR cycle, so it is kept the longest.
+DEFAULT_TTL: dict[Platform, float] = {
+    Platform.SevenEleven: 300,
+    Platform.FamilyMart: 120,
+    Platform.OKMart: 300,
+    Platform.Shopee: 60,
+}
+DEFAULT_NOT_FOUND_TTL: float = 30
+
+
+@dataclass
+class CacheEntry:
+    value: TrackingInfo | None
+    expires_at: float
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> CacheEntry | None:
+        """
+        Get the entry stored under key
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+
+        Returns
+        -------
+        CacheEntry | None
+            The stored entry (which may already be expired), or `None` if absent
+        """
+        pass
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry) -> int:
+        """
+        Store the entry under key
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+        entry : CacheEntry
+            The entry to store
+
+        Returns
+        -------
+        int
+            The number of entries evicted to make room for the new entry
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_size: int = 10000):
+        """
+        In-process LRU cache backend
+
+        Parameters
+        ----------
+        max_size : int
+            The maximum number of entries kept in the cache
+        """
+
+        self.max_size = max_size
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> int:
+        evicted = 0
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    def __init__(self, path: str, max_size: int = 10000):
+        """
+        LRU cache backend stored in a SQLite file
+
+        Every backend process pointing at the same file shares the cache, so
+        it can stand in for a key-value store between replicas on one host.
+
+        Parameters
+        ----------
+        path : str
+            The path of the SQLite database file
+        max_size : int
+            The maximum number of entries kept in the cache
+        """
+
+        self.max_size = max_size
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tracking_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_accessed_at ON tracking_cache (accessed_at)"
+            )
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM tracking_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE tracking_cache SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+
+        value, expires_at = row
+        data = json.loads(value)
+        return CacheEntry(
+            value=TrackingInfo(**data) if data is not None else None,
+            expires_at=expires_at,
+        )
+
+    def set(self, key: str, entry: CacheEntry) -> int:
+        value = json.dumps(
+            dataclasses.asdict(entry.value) if entry.value is not None else None,
+            ensure_ascii=False,
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "REPLACE INTO tracking_cache VALUES (?, ?, ?, ?)",
+                (key, value, entry.expires_at, time.time()),
+            )
+            cursor = self._conn.execute(
+                """
+                DELETE FROM tracking_cache WHERE key IN (
+                    SELECT key FROM tracking_cache ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_size,),
+            )
+        return cursor.rowcount
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tracking_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tracking_cache")
+
+
+class TrackingCache:
+    def __init__(
+        self,
+        backend: CacheBackend | None = None,
+        ttl: dict[Platform, float] | None = None,
+        not_found_ttl: float = DEFAULT_NOT_FOUND_TTL,
+    ):
+        """
+        TTL cache of tracking results keyed by (platform, order_id)
+
+        Parameters
+        ----------
+        backend : CacheBackend | None
+            The storage backend, an in-process `MemoryCacheBackend` by default
+        ttl : dict[Platform, float] | None
+            Seconds a found parcel is cached per platform, overrides `DEFAULT_TTL`
+        not_found_ttl : float
+            Seconds a "not found" result is cached
+        """
+
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.not_found_ttl = not_found_ttl
+
+        self.hits = metrics.counter("cache.hits")
+        self.misses = metrics.counter("cache.misses")
+        self.evictions = metrics.counter("cache.evictions")
+        self.expirations = metrics.counter("cache.expirations")
+
+    def get(self, platform: Platform, order_id: str) -> CacheEntry | None:
+        """
+        Get the cached result of the parcel
+
+        Parameters
+        ----------
+        platform : Platform
+            The platform of the parcel
+        order_id : str
+            The order_id of the parcel
+
+        Returns
+        -------
+        CacheEntry | None
+            The cached entry whose `value` is the `TrackingInfo` (or `None`
+            for "not found"), or `None` on cache miss
+        """
+
+        key = self._key(platform, order_id)
+        entry = self.backend.get(key)
+        if entry is not None and entry.expires_at <= time.time():
+            self.backend.delete(key)
+            self.expirations.inc()
+            entry = None
+
+        if entry is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return entry
+
+    def set(self, platform: Platform, order_id: str, value: TrackingInfo | None):
+        """
+        Cache the result of the parcel
+
+        Parameters
+        ----------
+        platform : Platform
+            The platform of the parcel
+        order_id : str
+            The order_id of the parcel
+        value : TrackingInfo | None
+            The tracking result, `None` if the parcel was not found
+        """
+
+        ttl = self.ttl[platform] if value is not None else self.not_found_ttl
+        if ttl <= 0:
+            return
+
+        entry = CacheEntry(value=value, expires_at=time.time() + ttl)
+        self.evictions.inc(self.backend.set(self._key(platform, order_id), entry))
+
+    def invalidate(self, platform: Platform, order_id: str):
+        self.backend.delete(self._key(platform, order_id))
+
+    def _key(self, platform: Platform, order_id: str) -> str:
+        return f"{platform.value}:{order_id}"
@@ -0,0 +1,369 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Iterable
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+DIGITS = "0123456789"
+
+# Size every segmented digit is scaled to before classification
+GLYPH_SIZE = (12, 16)
+
+# Digits narrower than this (in pixels) are treated as leftover noise
+MIN_DIGIT_WIDTH = 2
+
+
+class CaptchaRecognizer(ABC):
+    @abstractmethod
+    def recognize(self, image: Image.Image) -> str:
+        """
+        Recognize the digits in the captcha image
+
+        Implementations must be safe to call from several threads at once.
+
+        Parameters
+        ----------
+        image : Image.Image
+            The captcha image
+
+        Returns
+        -------
+        str
+            The recognized digits
+        """
+        pass
+
+
+class TesseractCLIRecognizer(CaptchaRecognizer):
+    CONFIG = f"-c tessedit_char_whitelist={DIGITS} --psm 8"
+
+    def __init__(self, preprocess: bool = True):
+        """
+        Recognize the captcha with the tesseract command, which forks a new
+        process for every image
+
+        Parameters
+        ----------
+        preprocess : bool
+            Whether to clean up the image with `preprocess` before the OCR
+        """
+
+        self.preprocess = preprocess
+
+    def recognize(self, image: Image.Image) -> str:
+        if self.preprocess:
+            image = to_image(preprocess(image))
+        return pytesseract.image_to_string(image, config=self.CONFIG).strip()
+
+
+class TesserocrRecognizer(CaptchaRecognizer):
+    def __init__(self, preprocess: bool = True):
+        """
+        Recognize the captcha with an in-process tesseract engine
+
+        The engine is loaded once per thread and kept warm between captchas.
+        Requires the optional `tesserocr` package, imported here rather than
+        with the module so the other recognizers work without it.
+
+        Parameters
+        ----------
+        preprocess : bool
+            Whether to clean up the image with `preprocess` before the OCR
+
+        Raises
+        ------
+        ImportError
+            If `tesserocr` is not installed
+        RuntimeError
+            If tesseract has no English language data
+        """
+
+        import tesserocr
+
+        # Fail early, rather than on the first captcha
+        _, languages = tesserocr.get_languages()
+        if "eng" not in languages:
+            raise RuntimeError("tesserocr found no English language data")
+
+        self.preprocess = preprocess
+        self._local = threading.local()
+
+    def recognize(self, image: Image.Image) -> str:
+        if self.preprocess:
+            image = to_image(preprocess(image))
+        api = self._get_api()
+        api.SetImage(image)
+        return api.GetUTF8Text().strip()
+
+    def _get_api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            from tesserocr import PSM, PyTessBaseAPI
+
+            api = PyTessBaseAPI(psm=PSM.SINGLE_WORD)
+            api.SetVariable("tessedit_char_whitelist", DIGITS)
+            self._local.api = api
+        return api
+
+
+class DigitClassifierRecognizer(CaptchaRecognizer):
+    def __init__(self, glyphs: np.ndarray, labels: np.ndarray, n_digits: int):
+        """
+        Nearest-neighbour digit classifier for the fixed-font 7-11 captcha
+
+        Use `train` to build one from labelled captcha images, and
+        `save`/`load` to keep the model on disk.
+
+        Parameters
+        ----------
+        glyphs : np.ndarray
+            The flattened training glyphs, shape (n_samples, glyph pixels)
+        labels : np.ndarray
+            The digit of every training glyph
+        n_digits : int
+            The number of digits in a captcha
+        """
+
+        self.glyphs = glyphs.astype(np.float32)
+        self.labels = labels
+        self.n_digits = n_digits
+        self._glyph_norms = (self.glyphs**2).sum(axis=1)
+
+    def recognize(self, image: Image.Image) -> str:
+        glyphs = extract_glyphs(image, self.n_digits)
+        if len(glyphs) == 0:
+            return ""
+
+        # Squared euclidean distance between every glyph and every sample
+        distances = (
+            (glyphs**2).sum(axis=1)[:, None]
+            - 2 * glyphs @ self.glyphs.T
+            + self._glyph_norms[None, :]
+        )
+        return "".join(str(label) for label in self.labels[distances.argmin(axis=1)])
+
+    @classmethod
+    def train(
+        cls, samples: Iterable[tuple[Image.Image, str]]
+    ) -> "DigitClassifierRecognizer":
+        """
+        Train the classifier from labelled captcha images
+
+        Parameters
+        ----------
+        samples : Iterable[tuple[Image.Image, str]]
+            The captcha images and their codes
+
+        Returns
+        -------
+        DigitClassifierRecognizer
+            The trained classifier
+        """
+
+        samples = list(samples)
+        n_digits = Counter(len(code) for _, code in samples).most_common(1)[0][0]
+
+        glyphs, labels = [], []
+        for image, code in samples:
+            digits = extract_glyphs(image, n_digits)
+            if len(code) != n_digits or len(digits) != n_digits:
+                continue
+            glyphs.extend(digits)
+            labels.extend(int(digit) for digit in code)
+
+        return cls(np.array(glyphs), np.array(labels), n_digits)
+
+    @classmethod
+    def load(cls, path: str) -> "DigitClassifierRecognizer":
+        model = np.load(path)
+        return cls(model["glyphs"], model["labels"], int(model["n_digits"]))
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path, glyphs=self.glyphs, labels=self.labels, n_digits=self.n_digits
+        )
+
+
+def binarize(image: Image.Image) -> np.ndarray:
+    """
+    Convert the captcha to a boolean array where `True` marks ink pixels
+
+    The threshold is picked with Otsu's method, and the ink is assumed to
+    be the minority class.
+    """
+
+    gray = np.asarray(image.convert("L"), dtype=np.uint8)
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+
+    weight_bg = np.cumsum(histogram)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(histogram * levels)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    threshold = np.argmax(weight_bg * weight_fg * (mean_bg - mean_fg) ** 2)
+
+    binary = gray <= threshold
+    return ~binary if binary.mean() > 0.5 else binary
+
+
+def remove_noise(binary: np.ndarray, min_neighbors: int = 2) -> np.ndarray:
+    """
+    Remove the speckles and thin lines drawn over the captcha
+
+    An ink pixel is kept only if at least `min_neighbors` of its 8
+    neighbours are ink too.
+    """
+
+    height, width = binary.shape
+    padded = np.pad(binary, 1).astype(np.uint8)
+    neighbors = sum(
+        padded[1 + dy : 1 + dy + height, 1 + dx : 1 + dx + width]
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+        if dy != 0 or dx != 0
+    )
+    return binary & (neighbors >= min_neighbors)
+
+
+def preprocess(image: Image.Image) -> np.ndarray:
+    """
+    Binarize the captcha and remove its noise
+
+    Parameters
+    ----------
+    image : Image.Image
+        The captcha image
+
+    Returns
+    -------
+    np.ndarray
+        A boolean array where `True` marks ink pixels
+    """
+
+    return remove_noise(binarize(image))
+
+
+def to_image(binary: np.ndarray) -> Image.Image:
+    """
+    Convert a boolean ink array back to a black on white image for the OCR
+    """
+
+    return Image.fromarray(np.where(binary, 0, 255).astype(np.uint8))
+
+
+def segment_digits(binary: np.ndarray, n_digits: int) -> list[np.ndarray]:
+    """
+    Split the binarized captcha into one array per digit
+
+    Digits are separated by empty columns, if that doesn't give `n_digits`
+    pieces the ink bounding box is split into equal widths instead.
+    """
+
+    columns = binary.any(axis=0)
+
+    # Runs of non-empty columns, without the ones too narrow to be a digit
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], columns.view(np.int8), [0]))))
+    runs = [
+        (start, end)
+        for start, end in zip(edges[::2], edges[1::2])
+        if end - start >= MIN_DIGIT_WIDTH
+    ]
+    if not runs:
+        return []
+
+    if len(runs) != n_digits:
+        left, right = runs[0][0], runs[-1][1]
+        bounds = np.linspace(left, right, n_digits + 1).astype(int)
+        runs = list(zip(bounds[:-1], bounds[1:]))
+
+    return [binary[:, start:end] for start, end in runs]
+
+
+def normalize_glyph(glyph: np.ndarray) -> np.ndarray:
+    """
+    Crop the digit to its ink and scale it to `GLYPH_SIZE`, flattened
+    """
+
+    rows = np.flatnonzero(glyph.any(axis=1))
+    if len(rows) > 0:
+        glyph = glyph[rows[0] : rows[-1] + 1]
+
+    image = Image.fromarray(glyph.astype(np.uint8) * 255).resize(
+        GLYPH_SIZE, Image.Resampling.BILINEAR
+    )
+    return np.asarray(image, dtype=np.float32).ravel() / 255
+
+
+def extract_glyphs(image: Image.Image, n_digits: int) -> np.ndarray:
+    digits = segment_digits(preprocess(image), n_digits)
+    return np.array([normalize_glyph(digit) for digit in digits], dtype=np.float32)
+
+
+def create_recognizer(
+    name: str = "auto", model_path: str | None = None
+) -> CaptchaRecognizer:
+    """
+    Create a captcha recognizer by name
+
+    Parameters
+    ----------
+    name : str
+        One of `tesseract`, `tesserocr`, `classifier`, or `auto` which
+        uses `tesserocr` if it is installed and `tesseract` otherwise
+    model_path : str | None
+        The path of the trained model of the `classifier` recognizer. No
+        model ships with the package, the corpus of `benchmarks.captcha` is
+        synthetic, so train one on recorded 7-11 captchas first
+
+    Returns
+    -------
+    CaptchaRecognizer
+        The recognizer
+
+    Raises
+    ------
+    ValueError
+        If the recognizer is unknown or the classifier model is missing
+    """
+
+    match name:
+        case "tesseract":
+            return TesseractCLIRecognizer()
+        case "tesserocr":
+            return TesserocrRecognizer()
+        case "classifier":
+            if model_path is None:
+                raise ValueError("The classifier recognizer needs a model path")
+            return DigitClassifierRecognizer.load(model_path)
+        case "auto":
+            try:
+                return TesserocrRecognizer()
+            except (ImportError, RuntimeError) as e:
+                logging.info(f"Using the tesseract command for captchas: {e}")
+                return TesseractCLIRecognizer()
+        case _:
+            raise ValueError(f"Invalid captcha recognizer: {name}")
+
+
+_recognizer: CaptchaRecognizer | None = None
+
+
+def get_recognizer() -> CaptchaRecognizer:
+    """
+    Get the recognizer used by the 7-11 captcha solver
+    """
+
+    global _recognizer
+    if _recognizer is None:
+        _recognizer = create_recognizer()
+    return _recognizer
+
+
+def set_recognizer(recognizer: CaptchaRecognizer):
+    global _recognizer
+    _recognizer = recognizer
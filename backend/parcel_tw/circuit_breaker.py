@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import aiohttp
+import requests
+
+from .base import CarrierUnavailableError
+from .metrics import metrics
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Value of the state gauge of each state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+@dataclass
+class CircuitBreakerConfig:
+    failure_threshold: int = 5  # Consecutive failed lookups which open the circuit
+    recovery_timeout: float = 30  # Seconds the circuit stays open before a probe
+    half_open_max_calls: int = 1  # Concurrent probe lookups while half open
+
+
+def is_carrier_failure(error: BaseException) -> bool:
+    """
+    Check if a lookup error, or the error it was raised from, shows that the
+    carrier is unhealthy: a connection error, a timeout or a 5xx response
+    """
+
+    while error is not None:
+        if isinstance(error, requests.HTTPError):
+            response = error.response
+            return response is None or response.status_code >= 500
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500
+        if isinstance(
+            error,
+            (
+                requests.RequestException,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                OSError,
+            ),
+        ):
+            return True
+        error = error.__cause__
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, config: CircuitBreakerConfig | None = None):
+        """
+        Thread-safe circuit breaker failing fast while a carrier is unhealthy
+
+        After `failure_threshold` consecutive failed lookups the circuit opens
+        and lookups are rejected without reaching the carrier. Once
+        `recovery_timeout` has passed, up to `half_open_max_calls` probe
+        lookups are let through: a successful probe closes the circuit, a
+        failed one opens it again.
+
+        Parameters
+        ----------
+        name : str
+            The name of the breaker, used in logs, errors and metrics
+        config : CircuitBreakerConfig | None
+            The thresholds of the breaker
+        """
+
+        self.name = name
+        self.config = config or CircuitBreakerConfig()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+        self.state_gauge = metrics.gauge(f"circuit.{name}.state")
+        self.opened = metrics.counter(f"circuit.{name}.opened")
+        self.rejected = metrics.counter(f"circuit.{name}.rejected")
+        self.failures = metrics.counter(f"circuit.{name}.failures")
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """
+        Guard a lookup, recording whether it failed
+
+        Only the failures of the carrier count, see `is_carrier_failure`.
+        The other errors, e.g. a captcha which couldn't be solved, a
+        cancellation or a rate limit rejection, are not recorded at all.
+
+        Raises
+        ------
+        CarrierUnavailableError
+            If the circuit is open
+        """
+
+        probe = self._before_call()
+        try:
+            yield
+        except CarrierUnavailableError:
+            self._after_call(probe, success=None)
+            raise
+        except Exception as e:
+            self._after_call(probe, success=False if is_carrier_failure(e) else None)
+            raise
+        except BaseException:
+            self._after_call(probe, success=None)
+            raise
+        self._after_call(probe, success=True)
+
+    def _before_call(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return False
+
+            retry_after = self._opened_at + self.config.recovery_timeout
+            retry_after -= time.monotonic()
+            if self._state == OPEN and retry_after <= 0:
+                self._set_state(HALF_OPEN)
+            if (
+                self._state == HALF_OPEN
+                and self._probes < self.config.half_open_max_calls
+            ):
+                self._probes += 1
+                return True
+
+        self.rejected.inc()
+        raise CarrierUnavailableError(
+            f"[{self.name}] Circuit open, the carrier is unavailable",
+            retry_after=max(retry_after, 1),
+        )
+
+    def _after_call(self, probe: bool, success: bool | None):
+        if success is False:
+            self.failures.inc()
+
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            if success is None:
+                return
+
+            if success:
+                self._failures = 0
+                if self._state == HALF_OPEN and probe:
+                    self._set_state(CLOSED)
+                    logging.info(f"[{self.name}] Circuit closed")
+                return
+
+            self._failures += 1
+            if (self._state == HALF_OPEN and probe) or (
+                self._state == CLOSED
+                and self._failures >= self.config.failure_threshold
+            ):
+                self._set_state(OPEN)
+                self._opened_at = time.monotonic()
+                self.opened.inc()
+                logging.warning(
+                    f"[{self.name}] Circuit opened after {self._failures} "
+                    "consecutive failures"
+                )
+
+    def _set_state(self, state: str):
+        self._state = state
+        self.state_gauge.set(STATE_VALUES[state])
@@ -0,0 +1,178 @@
+import asyncio
+import ssl
+from dataclasses import dataclass
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+
+@dataclass
+class ClientConfig:
+    pool_connections: int = 4  # Number of hosts kept in the connection pool
+    pool_maxsize: int = 16  # Number of connections kept per host
+    keepalive_timeout: float = 30  # Seconds an idle connection is kept alive
+    connect_timeout: float = 5
+    read_timeout: float = 20
+    token_pool_size: int = 0  # Pre-warmed tokens kept by the captcha carriers
+    token_lifetime: float = 120  # Seconds a pre-warmed token stays usable
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def __init__(self, ssl_context: ssl.SSLContext | None = None, **kwargs):
+        """
+        HTTP adapter which can be shared by many sessions
+
+        Parameters
+        ----------
+        ssl_context : ssl.SSLContext | None
+            A custom SSL context for the pooled connections
+        """
+
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+
+class PooledSession(requests.Session):
+    def __init__(self, adapter: HTTPAdapter, timeout: tuple[float, float]):
+        """
+        Session sending requests through a shared adapter with default timeouts
+
+        A 5xx response raises `requests.HTTPError`.
+
+        The session owns its cookies, while the connections belong to the
+        adapter, so don't `close()` it or the shared pool gets closed too.
+        """
+
+        super().__init__()
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = super().request(*args, **kwargs)
+        # A failure of the carrier, not a page which can't be parsed
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+
+async def raise_for_server_error(response: aiohttp.ClientResponse):
+    """
+    Raise `aiohttp.ClientResponseError` on a 5xx response of the carrier
+    """
+
+    if response.status >= 500:
+        response.raise_for_status()
+
+
+class CarrierClient:
+    def __init__(
+        self,
+        config: ClientConfig | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+    ):
+        """
+        Keep-alive connection pools to a carrier, for both `requests` and `aiohttp`
+
+        Every lookup gets its own session (and cookie jar) from the client,
+        while the TCP and TLS connections are reused across lookups.
+
+        Parameters
+        ----------
+        config : ClientConfig | None
+            The pool sizes, keep-alive and timeouts
+        ssl_context : ssl.SSLContext | None
+            A custom SSL context for the carrier
+        """
+
+        self.config = config or ClientConfig()
+        self.ssl_context = ssl_context
+        self.adapter = PooledHTTPAdapter(
+            ssl_context=ssl_context,
+            pool_connections=self.config.pool_connections,
+            pool_maxsize=self.config.pool_maxsize,
+        )
+        self._connector: aiohttp.TCPConnector | None = None
+        self._connector_loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.config.connect_timeout, self.config.read_timeout)
+
+    def new_session(self) -> requests.Session:
+        """
+        Create a `requests` session using the shared connection pool
+        """
+
+        return PooledSession(self.adapter, self.timeout)
+
+    def new_async_session(self, **kwargs) -> aiohttp.ClientSession:
+        """
+        Create an `aiohttp` session using the shared connection pool
+
+        A 5xx response raises `aiohttp.ClientResponseError`.
+
+        Parameters
+        ----------
+        **kwargs
+            Extra arguments of `aiohttp.ClientSession`, e.g. `cookie_jar`
+        """
+
+        kwargs.setdefault("raise_for_status", raise_for_server_error)
+        return aiohttp.ClientSession(
+            connector=self._get_connector(),
+            connector_owner=False,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.config.connect_timeout,
+                sock_read=self.config.read_timeout,
+            ),
+            **kwargs,
+        )
+
+    def close(self):
+        self.adapter.close()
+
+    async def aclose(self):
+        self.close()
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+    def _get_connector(self) -> aiohttp.TCPConnector:
+        # The connector is bound to the event loop it is created in
+        loop = asyncio.get_running_loop()
+        if (
+            self._connector is None
+            or self._connector.closed
+            or self._connector_loop is not loop
+        ):
+            if self._connector is not None and not self._connector.closed:
+                _close_connector(self._connector, self._connector_loop)
+            self._connector = aiohttp.TCPConnector(
+                limit=self.config.pool_connections * self.config.pool_maxsize,
+                limit_per_host=self.config.pool_maxsize,
+                keepalive_timeout=self.config.keepalive_timeout,
+                ssl=self.ssl_context if self.ssl_context is not None else True,
+            )
+            self._connector_loop = loop
+        return self._connector
+
+
+def _close_connector(connector: aiohttp.TCPConnector, loop: asyncio.AbstractEventLoop):
+    """
+    Close a connector from outside of the event loop it was created in
+
+    Only a loop still running, in another thread, can close its connector.
+    The connections of a loop which stopped are left to the garbage
+    collector.
+    """
+
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(connector.close(), loop)
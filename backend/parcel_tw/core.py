@@ -1,14 +1,36 @@
-from .base import Tracker, TrackingInfo
+import asyncio
+import logging
+import threading
+from collections.abc import AsyncIterator, Iterable
+
+from .base import CarrierUnavailableError, Tracker, TrackingError, TrackingInfo
+from .cache import TrackingCache
+from .circuit_breaker import CircuitBreaker, CircuitBreakerConfig
+from .client import ClientConfig
 from .enums import Platform
 from .family_mart import FamilyMartTracker
 from .okmart import OKMartTracker
+from .rate_limit import DEFAULT_RATE_LIMITS, RateLimit, TokenBucket
 from .seven_eleven import SevenElevenTracker
 from .shopee import ShopeeTracker
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+# Default number of concurrent lookups per platform in `async_track_many`.
+# The captcha carriers get a lower cap since each lookup costs several
+# round trips (and an OCR run for 7-11).
+DEFAULT_CONCURRENCY: dict[Platform, int] = {
+    Platform.SevenEleven: 4,
+    Platform.FamilyMart: 8,
+    Platform.OKMart: 4,
+    Platform.Shopee: 16,
+}
 
 
 class TrackerFactory:
     @staticmethod
-    def create_tracker(platform: Platform) -> Tracker:
+    def create_tracker(
+        platform: Platform, config: ClientConfig | None = None
+    ) -> Tracker:
         """
         Create a tracker based on the platform
 
@@ -16,6 +38,8 @@ class TrackerFactory:
         ----------
         platform : Platform
             The platform of the parcel
+        config : ClientConfig | None
+            The connection pool settings of the tracker
 
         Returns
         -------
@@ -30,17 +54,159 @@ class TrackerFactory:
 
         match platform:
             case Platform.SevenEleven:
-                return SevenElevenTracker()
+                return SevenElevenTracker(config)
             case Platform.FamilyMart:
-                return FamilyMartTracker()
+                return FamilyMartTracker(config)
             case Platform.OKMart:
-                return OKMartTracker()
+                return OKMartTracker(config)
             case Platform.Shopee:
-                return ShopeeTracker()
+                return ShopeeTracker(config)
             case _:
                 raise ValueError(f"Invalid platform: {platform}")
 
 
+class TrackerRegistry:
+    def __init__(
+        self,
+        config: ClientConfig | None = None,
+        rate_limits: dict[Platform, RateLimit | None] | None = None,
+        breaker_config: CircuitBreakerConfig | None = None,
+    ):
+        """
+        Long-lived tracker instances, one per platform
+
+        Each tracker keeps its keep-alive connection pool for the life of
+        the registry, so lookups don't pay for a new TCP and TLS handshake.
+        The registry also keeps the rate limiter and the circuit breaker of
+        every carrier.
+
+        Parameters
+        ----------
+        config : ClientConfig | None
+            The connection pool settings shared by every tracker
+        rate_limits : dict[Platform, RateLimit | None] | None
+            The rate limits of the carriers, overrides `DEFAULT_RATE_LIMITS`,
+            `None` or a rate of 0 disables the limit of a carrier
+        breaker_config : CircuitBreakerConfig | None
+            The thresholds of the circuit breaker of every carrier
+        """
+
+        self.config = config or ClientConfig()
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.breaker_config = breaker_config or CircuitBreakerConfig()
+        self._trackers: dict[Platform, Tracker] = {}
+        self._limiters: dict[Platform, TokenBucket | None] = {}
+        self._breakers: dict[Platform, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, platform: Platform) -> Tracker:
+        """
+        Get the tracker of the platform, creating it on first use
+
+        Parameters
+        ----------
+        platform : Platform
+            The platform of the parcel
+
+        Returns
+        -------
+        Tracker
+            The shared tracker object of the platform
+        """
+
+        with self._lock:
+            if platform not in self._trackers:
+                self._trackers[platform] = TrackerFactory.create_tracker(
+                    platform, self.config
+                )
+            return self._trackers[platform]
+
+    def limiter(self, platform: Platform) -> TokenBucket | None:
+        """
+        Get the rate limiter of the platform, `None` if it is not limited
+        """
+
+        with self._lock:
+            if platform not in self._limiters:
+                limit = self.rate_limits.get(platform)
+                self._limiters[platform] = (
+                    TokenBucket(platform.value, limit)
+                    if limit is not None and limit.rate > 0
+                    else None
+                )
+            return self._limiters[platform]
+
+    def breaker(self, platform: Platform) -> CircuitBreaker:
+        """
+        Get the circuit breaker of the platform
+        """
+
+        with self._lock:
+            if platform not in self._breakers:
+                self._breakers[platform] = CircuitBreaker(
+                    platform.value, self.breaker_config
+                )
+            return self._breakers[platform]
+
+    async def aclose(self):
+        """
+        Close the connection pools of every tracker
+        """
+
+        with self._lock:
+            trackers = list(self._trackers.values())
+            self._trackers.clear()
+        for tracker in trackers:
+            await tracker.aclose()
+
+
+# Trackers shared by every `track`/`async_track` call, see `set_registry`
+_registry = TrackerRegistry()
+
+# Result cache shared by every `track`/`async_track` call, see `set_cache`
+_cache: TrackingCache | None = TrackingCache()
+
+# Concurrent lookups of the same (platform, order_id) share one upstream fetch
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+
+
+def set_cache(cache: TrackingCache | None):
+    """
+    Replace the result cache used by `track` and `async_track`
+
+    Parameters
+    ----------
+    cache : TrackingCache | None
+        The new cache, or `None` to disable caching
+    """
+
+    global _cache
+    _cache = cache
+
+
+def get_cache() -> TrackingCache | None:
+    return _cache
+
+
+def set_registry(registry: TrackerRegistry):
+    """
+    Replace the tracker registry used by `track` and `async_track`
+
+    Parameters
+    ----------
+    registry : TrackerRegistry
+        The new registry
+    """
+
+    global _registry
+    _registry = registry
+
+
+def get_registry() -> TrackerRegistry:
+    return _registry
+
+
 def track(platform: Platform, order_id: str) -> TrackingInfo | None:
     """
     Track the parcel status by order_id
@@ -55,7 +221,171 @@ def track(platform: Platform, order_id: str) -> TrackingInfo | None:
     TrackingInfo | None
         A `TrackingInfo` object with the status details of the parcel,
         or `None` if no information is available.
+
+    Raises
+    ------
+    CarrierUnavailableError
+        If the carrier is rate limited or its circuit breaker is open
+    """
+
+    if _cache is not None:
+        entry = _cache.get(platform, order_id)
+        if entry is not None:
+            return entry.value
+
+    try:
+        return _flight.do((platform, order_id), _fetch, platform, order_id)
+    except CarrierUnavailableError:
+        raise
+    except TrackingError as e:
+        logging.error(e)
+        return None
+
+
+async def async_track(platform: Platform, order_id: str) -> TrackingInfo | None:
+    """
+    Track the parcel status by order_id asynchronously
+
+    Parameters
+    ----------
+    platform : Platform
+        The platform of the parcel
+    order_id : str
+        The order_id of the parcel
+
+    Returns
+    -------
+    TrackingInfo | None
+        A `TrackingInfo` object with the status details of the parcel,
+        or `None` if no information is available.
+
+    Raises
+    ------
+    CarrierUnavailableError
+        If the carrier is rate limited or its circuit breaker is open
+    """
+
+    try:
+        return await async_lookup(platform, order_id)
+    except CarrierUnavailableError:
+        raise
+    except TrackingError as e:
+        logging.error(e)
+        return None
+
+
+async def async_lookup(platform: Platform, order_id: str) -> TrackingInfo | None:
+    """
+    Track the parcel status by order_id asynchronously, raising when the
+    lookup fails instead of reporting the parcel as not found
+
+    Parameters
+    ----------
+    platform : Platform
+        The platform of the parcel
+    order_id : str
+        The order_id of the parcel
+
+    Returns
+    -------
+    TrackingInfo | None
+        A `TrackingInfo` object with the status details of the parcel,
+        or `None` if the carrier doesn't know the parcel.
+
+    Raises
+    ------
+    CarrierUnavailableError
+        If the carrier is rate limited or its circuit breaker is open
+    TrackingError
+        If the lookup failed, e.g. the captcha couldn't be solved
+    """
+
+    if _cache is not None:
+        entry = _cache.get(platform, order_id)
+        if entry is not None:
+            return entry.value
+
+    return await _async_flight.do(
+        (platform, order_id), _async_fetch, platform, order_id
+    )
+
+
+def _fetch(platform: Platform, order_id: str) -> TrackingInfo | None:
+    tracker = _registry.get(platform)
+    limiter = _registry.limiter(platform)
+    with _registry.breaker(platform).call():
+        if limiter is not None:
+            limiter.acquire()
+        result = tracker.track_status(order_id)
+    if _cache is not None:
+        _cache.set(platform, order_id, result)
+    return result
+
+
+async def _async_fetch(platform: Platform, order_id: str) -> TrackingInfo | None:
+    tracker = _registry.get(platform)
+    limiter = _registry.limiter(platform)
+    with _registry.breaker(platform).call():
+        if limiter is not None:
+            await limiter.async_acquire()
+        result = await tracker.async_track_status(order_id)
+    if _cache is not None:
+        _cache.set(platform, order_id, result)
+    return result
+
+
+async def async_track_many(
+    parcels: Iterable[tuple[Platform, str]],
+    concurrency: dict[Platform, int] | None = None,
+) -> AsyncIterator[tuple[Platform, str, TrackingInfo | None, TrackingError | None]]:
+    """
+    Track many parcels concurrently, yielding each result as soon as it resolves
+
+    Duplicated (platform, order_id) pairs are only tracked once. A parcel
+    which couldn't be tracked is yielded with the error, not as a parcel
+    which wasn't found: a `CarrierUnavailableError` if its carrier is rate
+    limited or circuit broken, a `TrackingError` if the lookup failed.
+
+    Parameters
+    ----------
+    parcels : Iterable[tuple[Platform, str]]
+        The (platform, order_id) pairs to track
+    concurrency : dict[Platform, int] | None
+        The maximum number of concurrent lookups per platform, overrides
+        `DEFAULT_CONCURRENCY`
+
+    Yields
+    ------
+    tuple[Platform, str, TrackingInfo | None, TrackingError | None]
+        The platform, the order_id, the tracking result of the parcel and
+        the error if it couldn't be tracked, in order of completion
     """
 
-    tracker = TrackerFactory.create_tracker(platform)
-    return tracker.track_status(order_id)
+    limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    semaphores = {
+        platform: asyncio.Semaphore(limit) for platform, limit in limits.items()
+    }
+
+    async def _track(platform: Platform, order_id: str):
+        async with semaphores[platform]:
+            try:
+                result = await async_lookup(platform, order_id)
+                return platform, order_id, result, None
+            except TrackingError as e:
+                if not isinstance(e, CarrierUnavailableError):
+                    logging.error(e)
+                return platform, order_id, None, e
+            except Exception as e:
+                logging.error(f"[{platform.value}] {e}")
+                return platform, order_id, None, TrackingError(str(e))
+
+    tasks = [
+        asyncio.create_task(_track(platform, order_id))
+        for platform, order_id in dict.fromkeys(parcels)
+    ]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in tasks:
+            task.cancel()
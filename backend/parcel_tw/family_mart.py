@@ -2,44 +2,62 @@ import json
 import logging
 import ssl
 
-import requests
-from requests.adapters import HTTPAdapter
-
-from .base import Tracker, TrackingInfo
+from .base import Tracker, TrackingError, TrackingInfo
+from .client import CarrierClient, ClientConfig
 from .enums import Platform
 
 
 # stackoveflow solution for requests.exceptions.SSLError
 # https://stackoverflow.com/questions/77303136
-class TLSAdapter(HTTPAdapter):
-    def init_poolmanager(self, *args, **kwargs):
-        ctx = ssl.create_default_context()
-        ctx.set_ciphers("DEFAULT@SECLEVEL=1")
-        ctx.options |= 0x4
-        kwargs["ssl_context"] = ctx
-        return super(TLSAdapter, self).init_poolmanager(*args, **kwargs)
+def create_ssl_context() -> ssl.SSLContext:
+    ctx = ssl.create_default_context()
+    ctx.set_ciphers("DEFAULT@SECLEVEL=1")
+    ctx.options |= 0x4
+    return ctx
 
 
 class FamilyMartTracker(Tracker):
     SEARCH_URL = "https://ecfme.fme.com.tw/FMEDCFPWebV2_II/list.aspx/GetOrderDetail"
+    HEADERS = {"Content-Type": "application/json; charset=UTF-8"}
 
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.mount("https://", TLSAdapter())  # used to avoid SSLError
-        self.tracking_info = None
+    def __init__(self, config: ClientConfig | None = None):
+        # The SSL context is used to avoid SSLError
+        self.client = CarrierClient(config, ssl_context=create_ssl_context())
 
     def track_status(self, order_id: str) -> TrackingInfo | None:
-        headers = {"Content-Type": "application/json; charset=UTF-8"}
-
-        payload = {"EC_ORDER_NO": order_id, "ORDER_NO": order_id, "RCV_USER_NAME": None}
-        logging.info("[FamilyMart] Sending post request to the search page...")
-        response = self.session.post(self.SEARCH_URL, json=payload, headers=headers)
-
-        logging.info("[FamilyMart] Parsing the response...")
-        raw_data = self._parse_response(response.text)
-        self.tracking_info = self._convert_to_tracking_info(raw_data)
-
-        return self.tracking_info
+        payload = self._build_payload(order_id)
+        try:
+            logging.info("[FamilyMart] Sending post request to the search page...")
+            response = self.client.new_session().post(
+                self.SEARCH_URL, json=payload, headers=self.HEADERS
+            )
+
+            logging.info("[FamilyMart] Parsing the response...")
+            raw_data = self._parse_response(response.text)
+        except Exception as e:
+            raise TrackingError(f"[FamilyMart] {e}") from e
+
+        return self._convert_to_tracking_info(raw_data)
+
+    async def async_track_status(self, order_id: str) -> TrackingInfo | None:
+        payload = self._build_payload(order_id)
+        try:
+            logging.info("[FamilyMart] Sending post request to the search page...")
+            async with self.client.new_async_session() as session:
+                async with session.post(
+                    self.SEARCH_URL, json=payload, headers=self.HEADERS
+                ) as response:
+                    text = await response.text()
+
+            logging.info("[FamilyMart] Parsing the response...")
+            raw_data = self._parse_response(text)
+        except Exception as e:
+            raise TrackingError(f"[FamilyMart] {e}") from e
+
+        return self._convert_to_tracking_info(raw_data)
+
+    def _build_payload(self, order_id: str) -> dict:
+        return {"EC_ORDER_NO": order_id, "ORDER_NO": order_id, "RCV_USER_NAME": None}
 
     def _parse_response(self, response):
         s = response.replace("\\", "")
@@ -0,0 +1,129 @@
+from collections.abc import Hashable
+from html.parser import HTMLParser
+
+# Elements which never have an end tag nor any content
+VOID_ELEMENTS = frozenset(
+    {
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    }
+)
+
+# Elements whose content is not part of the text of their ancestors
+RAW_TEXT_ELEMENTS = frozenset({"script", "style", "template"})
+
+
+class ElementTextExtractor(HTMLParser):
+    def __init__(self):
+        """
+        Extract the text of selected elements in a single pass over the html
+
+        Unlike `BeautifulSoup`, no tree is built: subclasses pick the
+        elements they need in `select`, and only the text of those elements
+        is kept. The text of an element is the same as `Tag.get_text()`.
+        """
+
+        super().__init__(convert_charrefs=True)
+        self.texts: dict[Hashable, list[str]] = {}
+        self._stack: list[tuple[str, list[list[str]], list[Hashable]]] = []
+        self._open: list[list[str]] = []
+        self._open_keys: dict[Hashable, int] = {}
+
+    def select(self, tag: str, attrs: dict[str, str]) -> list[Hashable]:
+        """
+        Decide which elements to keep the text of
+
+        Parameters
+        ----------
+        tag : str
+            The name of the element
+        attrs : dict[str, str]
+            The attributes of the element
+
+        Returns
+        -------
+        list[Hashable]
+            The keys to keep the text of the element under, or an empty list
+            to skip it. Keys must be unique within the document.
+        """
+        return []
+
+    def extract(self, html: str) -> dict[Hashable, str]:
+        """
+        Feed the html and get the text of the selected elements
+
+        Returns
+        -------
+        dict[Hashable, str]
+            The text of every selected element by its key, in document order
+        """
+
+        self.feed(html)
+        self.close()
+        return {key: "".join(parts) for key, parts in self.texts.items()}
+
+    def inside(self, key: Hashable) -> bool:
+        """
+        Whether the element selected under `key` is still open
+        """
+
+        return self._open_keys.get(key, 0) > 0
+
+    def handle_starttag(self, tag, attrs):
+        keys = self.select(tag, {name: value or "" for name, value in attrs})
+        captures = []
+        for key in keys:
+            parts = self.texts[key] = []
+            captures.append(parts)
+            self._open_keys[key] = self._open_keys.get(key, 0) + 1
+
+        if tag in VOID_ELEMENTS:
+            for key in keys:
+                self._open_keys[key] -= 1
+            return
+
+        self._stack.append((tag, captures, keys))
+        self._open.extend(captures)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Close the most recent element with the same name, and everything
+        # still open inside it, an unmatched end tag is ignored
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                break
+        else:
+            return
+
+        for _, captures, keys in self._stack[index:]:
+            for key in keys:
+                self._open_keys[key] -= 1
+            if captures:
+                del self._open[len(self._open) - len(captures) :]
+        del self._stack[index:]
+
+    def handle_data(self, data):
+        if self._stack and self._stack[-1][0] in RAW_TEXT_ELEMENTS:
+            # Only the script (or style) element itself gets its content
+            for parts in self._stack[-1][1]:
+                parts.append(data)
+            return
+
+        for parts in self._open:
+            parts.append(data)
@@ -0,0 +1,170 @@
+import bisect
+import threading
+from collections.abc import Sequence
+
+
+class Counter:
+    def __init__(self):
+        """
+        A thread-safe monotonically increasing counter
+        """
+
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Gauge:
+    def __init__(self):
+        """
+        A thread-safe value which can go up and down
+        """
+
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        """
+        A thread-safe histogram with cumulative buckets
+
+        Parameters
+        ----------
+        buckets : Sequence[float]
+            The upper bounds of the buckets, in increasing order
+        """
+
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    @property
+    def value(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": cumulative, "sum": total, "buckets": buckets}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Registry of the named metrics of `parcel_tw`
+        """
+
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        """
+        Get the counter with the given name, creating it if needed
+
+        Parameters
+        ----------
+        name : str
+            The name of the counter, e.g. `cache.hits`
+
+        Returns
+        -------
+        Counter
+            The counter object
+        """
+
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter()
+            return self._metrics[name]
+
+    def gauge(self, name: str) -> Gauge:
+        """
+        Get the gauge with the given name, creating it if needed
+
+        Parameters
+        ----------
+        name : str
+            The name of the gauge
+
+        Returns
+        -------
+        Gauge
+            The gauge object
+        """
+
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Gauge()
+            return self._metrics[name]
+
+    def histogram(self, name: str, buckets: Sequence[float]) -> Histogram:
+        """
+        Get the histogram with the given name, creating it if needed
+
+        Parameters
+        ----------
+        name : str
+            The name of the histogram
+        buckets : Sequence[float]
+            The upper bounds of the buckets, used only on creation
+
+        Returns
+        -------
+        Histogram
+            The histogram object
+        """
+
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(buckets)
+            return self._metrics[name]
+
+    def snapshot(self) -> dict:
+        """
+        Get the current value of every metric
+
+        Returns
+        -------
+        dict
+            A mapping from metric name to its value
+        """
+
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.value for name, metric in sorted(metrics.items())}
+
+
+metrics = MetricsRegistry()
@@ -2,47 +2,85 @@ import logging
 import re
 from typing import Final
 
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
 
-from .base import Tracker, TrackingInfo
+from .base import Tracker, TrackingError, TrackingInfo
+from .client import CarrierClient, ClientConfig
 from .enums import Platform
+from .html_extract import ElementTextExtractor
+from .token_pool import Token, TokenPool
 
 VALIDATE_URL: Final = "https://ecservice.okmart.com.tw/Tracking/ValidateNumber.ashx"
 RESULT_URL: Final = "https://ecservice.okmart.com.tw/Tracking/Result"
 
 
 class OKMartTracker(Tracker):
-    def __init__(self) -> None:
-        self.session = requests.Session()
-        self.tracking_info = None
+    def __init__(self, config: ClientConfig | None = None) -> None:
+        self.client = CarrierClient(config)
+        if self.client.config.token_pool_size > 0:
+            self.token_pool = TokenPool(
+                "ok_mart",
+                self._create_token,
+                self.client.config.token_pool_size,
+                self.client.config.token_lifetime,
+            )
+            self.token_pool.start()
 
     def track_status(self, order_id: str) -> TrackingInfo | None:
         try:
-            data = OKMartRequestHandler().get_data(order_id)
+            data = OKMartRequestHandler(session=self.client.new_session()).get_data(
+                order_id, self._acquire_validate_code()
+            )
         except Exception as e:
-            logging.error(f"[OKMart] {e}")
+            raise TrackingError(f"[OKMart] {e}") from e
+
+        return OKMartTrackingInfoAdapter.convert(data)
+
+    async def async_track_status(self, order_id: str) -> TrackingInfo | None:
+        try:
+            data = await OKMartAsyncRequestHandler(self.client).get_data(
+                order_id, self._acquire_validate_code()
+            )
+        except Exception as e:
+            raise TrackingError(f"[OKMart] {e}") from e
+
+        return OKMartTrackingInfoAdapter.convert(data)
+
+    def _acquire_validate_code(self) -> str | None:
+        if self.token_pool is None:
             return None
+        token = self.token_pool.acquire()
+        return token.fields["validate_code"] if token is not None else None
 
-        self.tracking_info = OKMartTrackingInfoAdapter.convert(data)
+    def _create_token(self) -> Token:
+        """
+        Fetch a validate code ahead of a lookup
+        """
 
-        return self.tracking_info
+        validate_code = OKMartRequestHandler(
+            session=self.client.new_session()
+        )._get_validate_code()
+        if validate_code is None:
+            raise RuntimeError("Failed to get validate code")
+        return Token(cookies={}, fields={"validate_code": validate_code})
 
 
 class OKMartRequestHandler:
-    def __init__(self):
+    def __init__(self, session: requests.Session | None = None):
         """
         Request handler for OKMart website
 
         Parameters
         ----------
-        max_retry : int
-            The maximum number of retries when the captcha is incorrect
+        session : requests.Session | None
+            The session object for sending requests, a new one by default
         """
 
-        self.session = requests.Session()
+        self.session = session or requests.Session()
 
-    def get_data(self, order_id: str) -> dict:
+    def get_data(self, order_id: str, validate_code: str | None = None) -> dict:
         """
         Get the tracking information froms OKMart website
 
@@ -50,6 +88,8 @@ class OKMartRequestHandler:
         ----------
         order_id : str
             The order_id of the parcel
+        validate_code : str | None
+            A pre-fetched validate code, a new one is fetched by default
 
         Returns
         -------
@@ -57,7 +97,8 @@ class OKMartRequestHandler:
             The tracking information of the parcel in `dict`, or `None` if failed
         """
 
-        validate_code = self._get_validate_code()
+        if validate_code is None:
+            validate_code = self._get_validate_code()
 
         if validate_code is None:
             raise RuntimeError("Failed to get validate code")
@@ -71,26 +112,115 @@ class OKMartRequestHandler:
         logging.info("[OKMart] Getting validate code...")
         response = self.session.get(VALIDATE_URL)
 
-        cookie = response.headers["Set-Cookie"]
-        matchobj = re.search(r"ValidateNumber=code=(.....); path=/", cookie)
-        if matchobj:
-            return matchobj.group(1)
+        return _extract_validate_code(response.headers["Set-Cookie"])
 
     def _get_search_result(
         self, order_id: str, validate_code: str
     ) -> requests.Response:
         logging.info("[OKMart] Getting search result...")
-        headers = {
-            "Cookie": f"ValidateNumber=code={validate_code}&odno={order_id}&cutknm=&cutktl="
-        }
-        params = {"inputOdNo": order_id, "inputCode1": validate_code}
+        headers = _build_search_headers(order_id, validate_code)
+        params = _build_search_params(order_id, validate_code)
 
         response = self.session.get(RESULT_URL, params=params, headers=headers)
         return response
 
 
+class OKMartAsyncRequestHandler:
+    def __init__(self, client: CarrierClient):
+        """
+        Asynchronous request handler for OKMart website
+
+        Parameters
+        ----------
+        client : CarrierClient
+            The connection pool of the OKMart website
+        """
+
+        self.client = client
+
+    async def get_data(self, order_id: str, validate_code: str | None = None) -> dict:
+        """
+        Get the tracking information froms OKMart website asynchronously
+
+        Parameters
+        ----------
+        order_id : str
+            The order_id of the parcel
+        validate_code : str | None
+            A pre-fetched validate code, a new one is fetched by default
+
+        Returns
+        -------
+        dict | None
+            The tracking information of the parcel in `dict`, or `None` if failed
+        """
+
+        # The validate cookie is sent by hand, so the cookie jar must not
+        # rewrite the `Cookie` header (same as `requests` does)
+        async with self.client.new_async_session(
+            cookie_jar=aiohttp.DummyCookieJar()
+        ) as session:
+            if validate_code is None:
+                validate_code = await self._get_validate_code(session)
+
+            if validate_code is None:
+                raise RuntimeError("Failed to get validate code")
+
+            html = await self._get_search_result(session, order_id, validate_code)
+
+        return OKMartResponseParser(html).parse()
+
+    async def _get_validate_code(self, session: aiohttp.ClientSession) -> str | None:
+        logging.info("[OKMart] Getting validate code...")
+        async with session.get(VALIDATE_URL) as response:
+            cookie = ", ".join(response.headers.getall("Set-Cookie", []))
+        return _extract_validate_code(cookie)
+
+    async def _get_search_result(
+        self, session: aiohttp.ClientSession, order_id: str, validate_code: str
+    ) -> str:
+        logging.info("[OKMart] Getting search result...")
+        headers = _build_search_headers(order_id, validate_code)
+        params = _build_search_params(order_id, validate_code)
+
+        async with session.get(RESULT_URL, params=params, headers=headers) as response:
+            return await response.text()
+
+
+def _extract_validate_code(cookie: str) -> str | None:
+    matchobj = re.search(r"ValidateNumber=code=(.....); path=/", cookie)
+    if matchobj:
+        return matchobj.group(1)
+    return None
+
+
+def _build_search_headers(order_id: str, validate_code: str) -> dict:
+    return {
+        "Cookie": f"ValidateNumber=code={validate_code}&odno={order_id}&cutknm=&cutktl="
+    }
+
+
+def _build_search_params(order_id: str, validate_code: str) -> dict:
+    return {"inputOdNo": order_id, "inputCode1": validate_code}
+
+
+# Classes of the elements holding the tracking information
+FIELD_CLASSES: Final = (
+    "triNo",  # 寄件編號
+    "odNo",  # 訂單編號
+    "type",  # 類別
+    "status",  # 目前貨況
+    "stNo",  # 取件門市店號
+    "stNm",  # 取件門市名稱
+    "takeFrom",  # 貨到門市日期
+    "takeTo",  # 取貨截止
+    "takeAt",  # 取貨日期
+    "taker",  # 取件人
+)
+
+
 class OKMartResponseParser:
-    def __init__(self, html: str) -> None:
+    def __init__(self, html: str, fast: bool = True) -> None:
         """
         Parser for OKMart tracking response
 
@@ -98,9 +228,14 @@ class OKMartResponseParser:
         ----------
         html : str
             The html content of the response
+        fast : bool
+            Whether to extract the known fields in a single pass instead of
+            building a `BeautifulSoup` tree, both give the same result
         """
 
-        self.soup = BeautifulSoup(html, "html.parser")
+        self.html = html
+        self.fast = fast
+        self.soup = None if fast else BeautifulSoup(html, "html.parser")
         self.result = {}
 
     def parse(self) -> dict:
@@ -113,6 +248,9 @@ class OKMartResponseParser:
             The extracted information
         """
 
+        if self.fast:
+            return self._parse_fast()
+
         self.result["triNo"] = self._find_by_class_name("triNo")  # 寄件編號
         self.result["odNo"] = self._find_by_class_name("odNo")  # 訂單編號
         self.result["type"] = self._find_by_class_name("type")  # 類別
@@ -128,6 +266,17 @@ class OKMartResponseParser:
 
         return self.result
 
+    def _parse_fast(self) -> dict:
+        texts = _OKMartExtractor().extract(self.html)
+
+        for class_name in FIELD_CLASSES:
+            text = texts.get(class_name)
+            self.result[class_name] = text.strip() if text is not None else None
+            if class_name == "stNm":
+                self.result["stNm2"] = texts.get("stNm2")
+
+        return self.result
+
     def _find_by_class_name(self, class_name: str) -> str | None:
         tag = self.soup.find(class_=class_name)
         if tag:
@@ -136,6 +285,23 @@ class OKMartResponseParser:
             return None
 
 
+class _OKMartExtractor(ElementTextExtractor):
+    """
+    Pick the first element of every field class, and the second `stNm`
+    """
+
+    def select(self, tag: str, attrs: dict[str, str]) -> list:
+        keys = []
+        for class_name in dict.fromkeys(attrs.get("class", "").split()):
+            if class_name not in FIELD_CLASSES:
+                continue
+            if class_name not in self.texts:
+                keys.append(class_name)
+            elif class_name == "stNm" and "stNm2" not in self.texts:
+                keys.append("stNm2")
+        return keys
+
+
 class OKMartTrackingInfoAdapter:
     @staticmethod
     def convert(raw_data: dict) -> TrackingInfo | None:
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+
+from .base import CarrierUnavailableError
+from .enums import Platform
+from .metrics import metrics
+
+
+@dataclass
+class RateLimit:
+    rate: float  # Requests per second, sustained
+    burst: int  # Requests which can be sent at once after an idle period
+    max_wait: float = 10  # Seconds a lookup may wait for its turn
+
+
+# Lookups per second sent to each carrier. A 7-11 or OKMart lookup is
+# several requests (search page, captcha, search), so they get the lowest rate.
+DEFAULT_RATE_LIMITS: dict[Platform, RateLimit] = {
+    Platform.SevenEleven: RateLimit(rate=2, burst=4),
+    Platform.FamilyMart: RateLimit(rate=5, burst=10),
+    Platform.OKMart: RateLimit(rate=2, burst=4),
+    Platform.Shopee: RateLimit(rate=10, burst=20),
+}
+
+
+class TokenBucket:
+    def __init__(self, name: str, limit: RateLimit):
+        """
+        Thread-safe token bucket limiting the rate of lookups to a carrier
+
+        A lookup reserves a token and sleeps until it is due, so waiting
+        lookups are spaced out evenly. A lookup which would wait longer than
+        `limit.max_wait` is rejected instead of holding a worker.
+
+        Parameters
+        ----------
+        name : str
+            The name of the bucket, used in errors and metrics
+        limit : RateLimit
+            The rate, burst and maximum wait of the bucket
+        """
+
+        self.name = name
+        self.limit = limit
+        self._tokens = float(limit.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.available = metrics.gauge(f"rate_limit.{name}.tokens")
+        self.available.set(self._tokens)
+        self.wait_seconds = metrics.histogram(
+            f"rate_limit.{name}.wait_seconds", (0, 0.1, 0.5, 1, 2.5, 5, 10)
+        )
+        self.rejected = metrics.counter(f"rate_limit.{name}.rejected")
+
+    def reserve(self) -> float:
+        """
+        Take a token, possibly one which is only available in the future
+
+        Returns
+        -------
+        float
+            The seconds to wait before sending the lookup
+
+        Raises
+        ------
+        CarrierUnavailableError
+            If the wait would be longer than `limit.max_wait`
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.limit.burst,
+                self._tokens + (now - self._updated) * self.limit.rate,
+            )
+            self._updated = now
+
+            wait = max(0.0, (1 - self._tokens) / self.limit.rate)
+            if wait > self.limit.max_wait:
+                self.rejected.inc()
+                raise CarrierUnavailableError(
+                    f"[{self.name}] Rate limit exceeded", retry_after=wait
+                )
+            self._tokens -= 1
+            self.available.set(self._tokens)
+
+        self.wait_seconds.observe(wait)
+        return wait
+
+    def acquire(self):
+        """
+        Wait for a token, blocking the thread
+        """
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def async_acquire(self):
+        """
+        Wait for a token without blocking the event loop
+        """
+
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
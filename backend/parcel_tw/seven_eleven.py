@@ -1,55 +1,132 @@
+import asyncio
 import io
 import logging
 import re
+import time
 from typing import Final
 
-import pytesseract
+import aiohttp
 import requests
 from bs4 import BeautifulSoup, Tag
 from PIL import Image
 
-from .base import Tracker, TrackingInfo
+from .base import Tracker, TrackingError, TrackingInfo
+from .captcha import get_recognizer
+from .client import CarrierClient, ClientConfig
 from .enums import Platform
+from .html_extract import ElementTextExtractor
+from .metrics import metrics
+from .token_pool import Token, TokenPool
 
 BASE_URL: Final = "https://eservice.7-11.com.tw/e-tracking/"
 SEARCH_URL: Final = BASE_URL + "search.aspx"
+CAPTCHA_LENGTH: Final = 4
+
+# Captcha solve telemetry, the first-try success rate is the "1" bucket of
+# the attempts histogram divided by its count
+CAPTCHA_ATTEMPTS = metrics.histogram(
+    "seven_eleven.captcha.attempts_per_lookup", buckets=[1, 2, 3, 4, 5]
+)
+CAPTCHA_INCORRECT = metrics.counter("seven_eleven.captcha.incorrect")
+CAPTCHA_REJECTED = metrics.counter("seven_eleven.captcha.rejected")
+CAPTCHA_EXHAUSTED = metrics.counter("seven_eleven.captcha.exhausted")
 
 
 class SevenElevenTracker(Tracker):
-    def __init__(self):
-        self.tracking_info = None
+    def __init__(self, config: ClientConfig | None = None):
+        self.client = CarrierClient(config)
+        if self.client.config.token_pool_size > 0:
+            self.token_pool = TokenPool(
+                "seven_eleven",
+                self._create_token,
+                self.client.config.token_pool_size,
+                self.client.config.token_lifetime,
+            )
+            self.token_pool.start()
 
     def track_status(self, order_id: str) -> TrackingInfo | None:
         if not self._validate_order_id(order_id):
             return None
 
         try:
-            data = SevenElevenRequestHandler().get_data(order_id)
+            data = SevenElevenRequestHandler(
+                session=self.client.new_session(), token=self._acquire_token()
+            ).get_data(order_id)
         except Exception as e:
-            logging.error(f"[7-11] {e}")
+            raise TrackingError(f"[7-11] {e}") from e
+
+        if data is None:
+            raise TrackingError("[7-11] Failed to solve the captcha")
+
+        return SevenElevenTrackingInfoAdapter.convert(data)
+
+    async def async_track_status(self, order_id: str) -> TrackingInfo | None:
+        if not self._validate_order_id(order_id):
             return None
 
-        self.tracking_info = SevenElevenTrackingInfoAdapter.convert(data)
+        try:
+            data = await SevenElevenAsyncRequestHandler(
+                self.client, token=self._acquire_token()
+            ).get_data(order_id)
+        except Exception as e:
+            raise TrackingError(f"[7-11] {e}") from e
+
+        if data is None:
+            raise TrackingError("[7-11] Failed to solve the captcha")
 
-        return self.tracking_info
+        return SevenElevenTrackingInfoAdapter.convert(data)
 
     def _validate_order_id(self, order_id: str) -> bool:
         return len(order_id) == 8 or len(order_id) == 11 or len(order_id) == 12
 
+    def _acquire_token(self) -> Token | None:
+        return self.token_pool.acquire() if self.token_pool is not None else None
+
+    def _create_token(self) -> Token:
+        """
+        Open a search session and solve its captcha ahead of a lookup
+        """
+
+        session = self.client.new_session()
+        response = session.get(SEARCH_URL)
+        if response.status_code != 200:
+            raise Exception("Failed to get search page")
+
+        validate_code = SevenElevenCaptchaSolver(
+            session, response.text
+        ).get_validate_code()
+        return Token(
+            cookies=session.cookies.get_dict(),
+            fields={**_parse_view_state(response.text), "tbChkCode": validate_code},
+        )
+
 
 class SevenElevenRequestHandler:
-    def __init__(self, max_retry: int = 5):
+    def __init__(
+        self,
+        max_retry: int = 5,
+        session: requests.Session | None = None,
+        token: Token | None = None,
+    ):
         """
         Request handler for 7-11 e-tracking website
 
         Parameters
         ----------
         max_retry : int
-            The maximum number of retries when the captcha is incorrect
+            The maximum number of retries when the captcha is incorrect. The
+            recognizers solve about half of the captchas on the first try,
+            so fewer retries would exhaust far more lookups
+        session : requests.Session | None
+            The session object for sending requests, a new one by default
+        token : Token | None
+            A pre-warmed search session with a solved captcha, used for the
+            first attempt
         """
 
-        self.session = requests.Session()
+        self.session = session or requests.Session()
         self.max_retry = max_retry
+        self.token = token
 
     def get_data(self, order_id) -> dict | None:
         """
@@ -70,17 +147,24 @@ class SevenElevenRequestHandler:
         while retry_counter < self.max_retry:
             try:
                 logging.info(f"[7-11] Requesting tracking info for order {order_id}...")
-                response = self._post_search(order_id)
+                if self.token is not None:
+                    response = self._post_search_with_token(order_id, self.token)
+                    self.token = None
+                else:
+                    response = self._post_search(order_id)
                 result = SevenElevenResponseParser(response.text).parse()
                 if result["msg"] == "驗證碼錯誤!!":
                     retry_counter += 1
                     raise ValueError("Incorrect captcha")
+                CAPTCHA_ATTEMPTS.observe(retry_counter + 1)
                 return result
             except ValueError:
+                CAPTCHA_INCORRECT.inc()
                 logging.warning(
                     f"[7-11] Captcha is incorrect, retrying... ({retry_counter}/{self.max_retry})"
                 )
 
+        CAPTCHA_EXHAUSTED.inc()
         return None
 
     def _post_search(self, order_id: str) -> requests.Response:
@@ -108,36 +192,164 @@ class SevenElevenRequestHandler:
             raise Exception("Failed to post search request")
         return response
 
+    def _post_search_with_token(self, order_id: str, token: Token) -> requests.Response:
+        self.session.cookies.update(token.cookies)
+        payload = _build_search_payload(token.fields, order_id)
+        response = self.session.post(SEARCH_URL, data=payload)
+        if response.status_code != 200:
+            raise Exception("Failed to post search request")
+        return response
+
     def _construct_payload(self, response: requests.Response, order_id) -> dict:
-        soup = BeautifulSoup(response.text, "html.parser")
-        view_state = self._find_value_by_id(soup, "__VIEWSTATE")
-        view_state_generator = self._find_value_by_id(soup, "__VIEWSTATEGENERATOR")
         validate_code = SevenElevenCaptchaSolver(
             self.session, response.text
         ).get_validate_code()
-        payload = {
-            "__EVENTTARGET": "submit",
-            "__EVENTARGUMENT": "",
-            "__VIEWSTATE": view_state,
-            "__VIEWSTATEGENERATOR": view_state_generator,
-            "txtProductNum": order_id,
-            "tbChkCode": validate_code,
-            "txtIMGName": "",
-            "txtPage": 1,
-        }
-        return payload
-
-    def _find_value_by_id(self, soup: BeautifulSoup, id: str) -> str | None:
-        tag = soup.find("input", id=id)
-        if isinstance(tag, Tag):
-            value = tag.get("value")
-            if isinstance(value, str):
-                return value
+        fields = {**_parse_view_state(response.text), "tbChkCode": validate_code}
+        return _build_search_payload(fields, order_id)
+
+
+class SevenElevenAsyncRequestHandler:
+    def __init__(
+        self, client: CarrierClient, max_retry: int = 5, token: Token | None = None
+    ):
+        """
+        Asynchronous request handler for 7-11 e-tracking website
+
+        Parameters
+        ----------
+        client : CarrierClient
+            The connection pool of the 7-11 e-tracking website
+        max_retry : int
+            The maximum number of retries when the captcha is incorrect. The
+            recognizers solve about half of the captchas on the first try,
+            so fewer retries would exhaust far more lookups
+        token : Token | None
+            A pre-warmed search session with a solved captcha, used for the
+            first attempt
+        """
+
+        self.client = client
+        self.max_retry = max_retry
+        self.token = token
+
+    async def get_data(self, order_id: str) -> dict | None:
+        """
+        Get the tracking information froms 7-11 e-tracking website
+
+        Parameters
+        ----------
+        order_id : str
+            The order_id of the parcel
+
+        Returns
+        -------
+        dict | None
+            The tracking information of the parcel in `dict`, or `None` if failed
+        """
+
+        cookies = self.token.cookies if self.token is not None else None
+        async with self.client.new_async_session(cookies=cookies) as session:
+            retry_counter = 0
+            while retry_counter < self.max_retry:
+                try:
+                    logging.info(
+                        f"[7-11] Requesting tracking info for order {order_id}..."
+                    )
+                    if self.token is not None:
+                        html = await self._post_form(
+                            session, _build_search_payload(self.token.fields, order_id)
+                        )
+                        self.token = None
+                    else:
+                        html = await self._post_search(session, order_id)
+                    result = SevenElevenResponseParser(html).parse()
+                    if result["msg"] == "驗證碼錯誤!!":
+                        retry_counter += 1
+                        raise ValueError("Incorrect captcha")
+                    CAPTCHA_ATTEMPTS.observe(retry_counter + 1)
+                    return result
+                except ValueError:
+                    CAPTCHA_INCORRECT.inc()
+                    logging.warning(
+                        f"[7-11] Captcha is incorrect, retrying... ({retry_counter}/{self.max_retry})"
+                    )
+
+        CAPTCHA_EXHAUSTED.inc()
         return None
 
+    async def _post_search(self, session: aiohttp.ClientSession, order_id: str) -> str:
+        """
+        Post the search request to the 7-11 e-tracking website
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The session object for sending requests
+        order_id : str
+            The order_id of the parcel
+
+        Returns
+        -------
+        str
+            The html content of the search result
+        """
+
+        async with session.get(SEARCH_URL) as response:
+            if response.status != 200:
+                raise Exception("Failed to get search page")
+            html = await response.text()
+
+        validate_code = await SevenElevenAsyncCaptchaSolver(
+            session, html
+        ).get_validate_code()
+        fields = {**_parse_view_state(html), "tbChkCode": validate_code}
+        return await self._post_form(session, _build_search_payload(fields, order_id))
+
+    async def _post_form(self, session: aiohttp.ClientSession, payload: dict) -> str:
+        async with session.post(SEARCH_URL, data=payload) as response:
+            if response.status != 200:
+                raise Exception("Failed to post search request")
+            return await response.text()
+
+
+def _parse_view_state(html: str) -> dict:
+    soup = BeautifulSoup(html, "html.parser")
+    return {
+        "__VIEWSTATE": _find_value_by_id(soup, "__VIEWSTATE"),
+        "__VIEWSTATEGENERATOR": _find_value_by_id(soup, "__VIEWSTATEGENERATOR"),
+    }
+
+
+def _build_search_payload(fields: dict, order_id: str) -> dict:
+    """
+    Build the search form from the view state and the solved captcha
+    (`tbChkCode`) of the search page
+    """
+
+    payload = {
+        "__EVENTTARGET": "submit",
+        "__EVENTARGUMENT": "",
+        "__VIEWSTATE": fields["__VIEWSTATE"],
+        "__VIEWSTATEGENERATOR": fields["__VIEWSTATEGENERATOR"],
+        "txtProductNum": order_id,
+        "tbChkCode": fields["tbChkCode"],
+        "txtIMGName": "",
+        "txtPage": "1",
+    }
+    return payload
+
+
+def _find_value_by_id(soup: BeautifulSoup, id: str) -> str | None:
+    tag = soup.find("input", id=id)
+    if isinstance(tag, Tag):
+        value = tag.get("value")
+        if isinstance(value, str):
+            return value
+    return None
+
 
 class SevenElevenCaptchaSolver:
-    def __init__(self, session: requests.Session, html: str):
+    def __init__(self, session: requests.Session, html: str, max_images: int = 3):
         """
         Captcha solver for 7-11 e-tracking website
 
@@ -147,10 +359,15 @@ class SevenElevenCaptchaSolver:
             The session object for sending requests
         html : str
             The html content of the search page
+        max_images : int
+            The maximum number of captcha images to fetch while the
+            recognized code is malformed, which is cheaper than posting a
+            code that is surely wrong
         """
 
         self.session = session
         self.html = html
+        self.max_images = max_images
 
     def get_validate_code(self) -> str:
         """
@@ -162,30 +379,112 @@ class SevenElevenCaptchaSolver:
             The validate code
         """
 
-        validate_image = self._get_validate_image()
-        tesseract_config = "-c tessedit_char_whitelist=0123456789 --psm 8"
-        validate_code = pytesseract.image_to_string(
-            validate_image, config=tesseract_config
-        ).strip()
+        validate_image_url = _get_validate_image_url(self.html)
+        for _ in range(self.max_images):
+            validate_code = self.recognize(self._get_validate_image(validate_image_url))
+            if _is_valid_code(validate_code):
+                break
+            CAPTCHA_REJECTED.inc()
+            validate_image_url = _refresh_validate_image_url(validate_image_url)
         return validate_code
 
-    def _get_validate_image(self) -> Image.Image:
-        validate_image_url = self._get_validate_image_url()
+    @staticmethod
+    def recognize(validate_image: Image.Image) -> str:
+        """
+        Recognize the digits in the captcha image with the configured
+        recognizer, see `parcel_tw.captcha.set_recognizer`
+
+        Parameters
+        ----------
+        validate_image : Image.Image
+            The captcha image
+
+        Returns
+        -------
+        str
+            The validate code
+        """
+
+        return get_recognizer().recognize(validate_image)
+
+    def _get_validate_image(self, validate_image_url: str) -> Image.Image:
         response = self.session.get(validate_image_url)
         if response.status_code != 200:
             raise Exception("Failed to get validate image")
         return Image.open(io.BytesIO(response.content))
 
-    def _get_validate_image_url(self) -> str:
-        url_suffix = re.search(r'src="(ValidateImage\.aspx\?ts=[0-9]+)"', self.html)
-        if url_suffix is not None:
-            return BASE_URL + url_suffix.group(1)
-        else:
-            raise Exception("Failed to get validate image url")
+
+class SevenElevenAsyncCaptchaSolver:
+    def __init__(self, session: aiohttp.ClientSession, html: str, max_images: int = 3):
+        """
+        Asynchronous captcha solver for 7-11 e-tracking website
+
+        Paramaters
+        ----------
+        session : aiohttp.ClientSession
+            The session object for sending requests
+        html : str
+            The html content of the search page
+        max_images : int
+            The maximum number of captcha images to fetch while the
+            recognized code is malformed
+        """
+
+        self.session = session
+        self.html = html
+        self.max_images = max_images
+
+    async def get_validate_code(self) -> str:
+        """
+        Get the validate code from the captcha image
+
+        The OCR runs in a worker thread so it doesn't block the event loop.
+
+        Returns
+        -------
+        str
+            The validate code
+        """
+
+        validate_image_url = _get_validate_image_url(self.html)
+        for _ in range(self.max_images):
+            validate_image = await self._get_validate_image(validate_image_url)
+            validate_code = await asyncio.to_thread(
+                SevenElevenCaptchaSolver.recognize, validate_image
+            )
+            if _is_valid_code(validate_code):
+                break
+            CAPTCHA_REJECTED.inc()
+            validate_image_url = _refresh_validate_image_url(validate_image_url)
+        return validate_code
+
+    async def _get_validate_image(self, validate_image_url: str) -> Image.Image:
+        async with self.session.get(validate_image_url) as response:
+            if response.status != 200:
+                raise Exception("Failed to get validate image")
+            content = await response.read()
+        return Image.open(io.BytesIO(content))
+
+
+def _is_valid_code(validate_code: str) -> bool:
+    return len(validate_code) == CAPTCHA_LENGTH and validate_code.isdigit()
+
+
+def _refresh_validate_image_url(validate_image_url: str) -> str:
+    # A new timestamp makes the server draw (and remember) a new captcha
+    return re.sub(r"ts=[0-9]+", f"ts={int(time.time() * 1000)}", validate_image_url)
+
+
+def _get_validate_image_url(html: str) -> str:
+    url_suffix = re.search(r'src="(ValidateImage\.aspx\?ts=[0-9]+)"', html)
+    if url_suffix is not None:
+        return BASE_URL + url_suffix.group(1)
+    else:
+        raise Exception("Failed to get validate image url")
 
 
 class SevenElevenResponseParser:
-    def __init__(self, html: str):
+    def __init__(self, html: str, fast: bool = True):
         """
         Parser for 7-11 e-tracking response
 
@@ -193,9 +492,14 @@ class SevenElevenResponseParser:
         ----------
         html : str
             The html content of the response
+        fast : bool
+            Whether to extract the known fields in a single pass instead of
+            building a `BeautifulSoup` tree, both give the same result
         """
 
-        self.soup = BeautifulSoup(html, "html.parser")
+        self.html = html
+        self.fast = fast
+        self.soup = None if fast else BeautifulSoup(html, "html.parser")
         self.result = {
             "msg": None,
             "m_news": None,
@@ -212,6 +516,9 @@ class SevenElevenResponseParser:
             The extracted information
         """
 
+        if self.fast:
+            return self._parse_fast()
+
         # Check if there is any alert message in the script tag
         script_tags = self.soup.find_all("script")
         for tag in script_tags:
@@ -233,6 +540,37 @@ class SevenElevenResponseParser:
 
         return self.result
 
+    def _parse_fast(self) -> dict:
+        texts = _SevenElevenExtractor().extract(self.html)
+
+        for key, text in texts.items():
+            if isinstance(key, tuple) and key[0] == "script" and "alert(" in text:
+                self.result["msg"] = self._extract_alert_message(text)
+                return self.result
+
+        if "lbMsg" in texts:
+            self.result["msg"] = texts["lbMsg"]
+            return self.result
+
+        info = {}
+        shipping = []
+        for key, text in texts.items():
+            if not isinstance(key, tuple):
+                continue
+            if key[0] == "span":
+                info[key[2]] = text
+            elif key[0] == "p":
+                shipping.append(text)
+        if "servicetype" in texts:
+            info["servicetype"] = texts["servicetype"]
+
+        self.result["m_news"] = texts.get("m_news", "")
+        self.result["result"]["info"] = info
+        self.result["result"]["shipping"] = shipping
+        self.result["msg"] = "success"
+
+        return self.result
+
     def _extract_alert_message(self, text: str) -> str:
         return text.split("alert('")[1].split("');")[0]
 
@@ -266,6 +604,39 @@ class SevenElevenResponseParser:
         return res
 
 
+class _SevenElevenExtractor(ElementTextExtractor):
+    """
+    Pick the elements `SevenElevenResponseParser` reads, in document order
+    """
+
+    def select(self, tag: str, attrs: dict[str, str]) -> list:
+        keys = []
+        classes = attrs.get("class", "").split()
+        match tag:
+            case "script":
+                keys.append(("script", len(self.texts)))
+            case "span":
+                if attrs.get("id") == "lbMsg" and "lbMsg" not in self.texts:
+                    keys.append("lbMsg")
+                if self.inside("info"):
+                    keys.append(("span", len(self.texts), attrs.get("id")))
+            case "h4":
+                if (
+                    attrs.get("id") == "servicetype"
+                    and self.inside("info")
+                    and "servicetype" not in self.texts
+                ):
+                    keys.append("servicetype")
+            case "p":
+                if self.inside("shipping"):
+                    keys.append(("p", len(self.texts)))
+            case "div":
+                for name in ("m_news", "info", "shipping"):
+                    if name in classes and name not in self.texts:
+                        keys.append(name)
+        return keys
+
+
 class SevenElevenTrackingInfoAdapter:
     @staticmethod
     def convert(raw_data: dict | None) -> TrackingInfo | None:
@@ -5,33 +5,43 @@ from typing import Final
 
 import requests
 
-from .base import Tracker, TrackingInfo
+from .base import Tracker, TrackingError, TrackingInfo
+from .client import CarrierClient, ClientConfig
 from .enums import Platform
 
 SEARCH_URL: Final = "https://spx.tw/api/v2/fleet_order/tracking/search"
 SALT: Final = b"MGViZmZmZTYzZDJhNDgxY2Y1N2ZlN2Q1ZWJkYzlmZDY="  # Shopee API hashing salt
+HEADERS: Final = {"cookie": "fms_language=tw"}
 
 
 class ShopeeTracker(Tracker):
-    def __init__(self):
-        self.tracking_info = None
+    def __init__(self, config: ClientConfig | None = None):
+        self.client = CarrierClient(config)
 
     def track_status(self, order_id: str) -> TrackingInfo | None:
         try:
-            data = ShopeeRequestHandler().get_data(order_id)
+            data = ShopeeRequestHandler(session=self.client.new_session()).get_data(
+                order_id
+            )
         except Exception as e:
-            logging.error(f"[Shopee] {e}")
-            return None
+            raise TrackingError(f"[Shopee] {e}") from e
 
         logging.info("[Shopee] Parsing the response...")
-        self.tracking_info = ShopeeTrackingInfoAdapter.convert(data)
+        return ShopeeTrackingInfoAdapter.convert(data)
+
+    async def async_track_status(self, order_id: str) -> TrackingInfo | None:
+        try:
+            data = await ShopeeAsyncRequestHandler(self.client).get_data(order_id)
+        except Exception as e:
+            raise TrackingError(f"[Shopee] {e}") from e
 
-        return self.tracking_info
+        logging.info("[Shopee] Parsing the response...")
+        return ShopeeTrackingInfoAdapter.convert(data)
 
 
 class ShopeeRequestHandler:
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, session: requests.Session | None = None):
+        self.session = session or requests.Session()
 
     def get_data(self, order_id: str) -> dict:
         """
@@ -48,18 +58,10 @@ class ShopeeRequestHandler:
             The tracking information of the parcel in `dict`, or `None` if failed
         """
 
-        timestamp = int(time.time())
-        headers = {
-            "cookie": "fms_language=tw",
-        }
-        params = {
-            "sls_tracking_number": order_id
-            + "|"
-            + str(timestamp)
-            + sha256(order_id.encode() + str(timestamp).encode() + SALT).hexdigest()
-        }
         logging.info(f"[Shopee] Requesting tracking info for order {order_id}...")
-        response = self.session.get(SEARCH_URL, params=params, headers=headers)
+        response = self.session.get(
+            SEARCH_URL, params=_build_params(order_id), headers=HEADERS
+        )
         if response.status_code != 200:
             raise Exception(
                 f"Failed to get tracking info from Shopee API: {response.text}"
@@ -68,6 +70,48 @@ class ShopeeRequestHandler:
         return response.json()
 
 
+class ShopeeAsyncRequestHandler:
+    def __init__(self, client: CarrierClient):
+        self.client = client
+
+    async def get_data(self, order_id: str) -> dict:
+        """
+        Get tracking info from Shopee API asynchronously
+
+        Parameters:
+        -----------
+        order_id: str
+            Shopee order ID
+
+        Returns:
+        --------
+        dict
+            The tracking information of the parcel in `dict`, or `None` if failed
+        """
+
+        logging.info(f"[Shopee] Requesting tracking info for order {order_id}...")
+        async with self.client.new_async_session() as session:
+            async with session.get(
+                SEARCH_URL, params=_build_params(order_id), headers=HEADERS
+            ) as response:
+                if response.status != 200:
+                    raise Exception(
+                        f"Failed to get tracking info from Shopee API: {await response.text()}"
+                    )
+
+                return await response.json(content_type=None)
+
+
+def _build_params(order_id: str) -> dict:
+    timestamp = int(time.time())
+    return {
+        "sls_tracking_number": order_id
+        + "|"
+        + str(timestamp)
+        + sha256(order_id.encode() + str(timestamp).encode() + SALT).hexdigest()
+    }
+
+
 class ShopeeTrackingInfoAdapter:
     @staticmethod
     def convert(raw_data: dict) -> TrackingInfo | None:
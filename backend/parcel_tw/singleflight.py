@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+from .metrics import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self, name: str = "singleflight"):
+        """
+        Coalesce concurrent calls with the same key into a single call
+
+        The first caller of a key runs the function, every other thread
+        calling with the same key while it is in flight waits for it and
+        gets the same result, or the same exception.
+
+        Parameters
+        ----------
+        name : str
+            The metric name prefix of the coalesced call counter
+        """
+
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.coalesced = metrics.counter(f"{name}.coalesced")
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        """
+        Call `fn(*args)` unless a call with the same key is already in flight
+
+        Parameters
+        ----------
+        key : Hashable
+            The key identifying identical calls
+        fn : Callable
+            The function to call
+
+        Returns
+        -------
+        Any
+            The return value of the call
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self.coalesced.inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    def __init__(self, name: str = "singleflight"):
+        """
+        Coalesce concurrent coroutine calls with the same key into a single call
+
+        The call runs in its own task, so a cancelled caller doesn't cancel
+        the fetch shared with the other waiters.
+
+        Parameters
+        ----------
+        name : str
+            The metric name prefix of the coalesced call counter
+        """
+
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self.coalesced = metrics.counter(f"{name}.coalesced")
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        Await `fn(*args)` unless a call with the same key is already in flight
+
+        Parameters
+        ----------
+        key : Hashable
+            The key identifying identical calls
+        fn : Callable[..., Awaitable]
+            The coroutine function to call
+
+        Returns
+        -------
+        Any
+            The return value of the call
+        """
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced.inc()
+
+        return await asyncio.shield(task)
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from .metrics import metrics
+
+
+@dataclass
+class Token:
+    cookies: dict[str, str]  # Cookies of the session the token was issued to
+    fields: dict[str, str]  # Carrier specific values, e.g. a solved captcha
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class TokenPool:
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Token],
+        size: int,
+        lifetime: float,
+        max_backoff: float = 60,
+    ):
+        """
+        Background-filled pool of ready-to-use, single-use lookup tokens
+
+        A daemon thread keeps `size` fresh tokens in the pool, so a lookup
+        can skip the round trips needed to get one. Tokens older than
+        `lifetime` are dropped and replaced.
+
+        Parameters
+        ----------
+        name : str
+            The name of the pool, used in logs and metrics
+        factory : Callable[[], Token]
+            Creates a new token, may raise on failure
+        size : int
+            The number of ready tokens to keep
+        lifetime : float
+            Seconds a token stays usable after it is created
+        max_backoff : float
+            The maximum seconds to wait before retrying a failed `factory`
+        """
+
+        self.name = name
+        self.factory = factory
+        self.size = size
+        self.lifetime = lifetime
+        self.max_backoff = max_backoff
+
+        self._tokens: deque[Token] = deque()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._running = False
+
+        self.ready = metrics.gauge(f"token_pool.{name}.ready")
+        self.hits = metrics.counter(f"token_pool.{name}.hits")
+        self.misses = metrics.counter(f"token_pool.{name}.misses")
+        self.expired = metrics.counter(f"token_pool.{name}.expired")
+        self.errors = metrics.counter(f"token_pool.{name}.errors")
+
+    def start(self):
+        """
+        Start filling the pool in the background
+        """
+
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._fill, name=f"token-pool-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._tokens.clear()
+            self.ready.set(0)
+            self._condition.notify_all()
+
+    def acquire(self) -> Token | None:
+        """
+        Take a fresh token out of the pool without waiting
+
+        Returns
+        -------
+        Token | None
+            A token, or `None` if the pool is empty
+        """
+
+        with self._condition:
+            self._drop_expired()
+            token = self._tokens.popleft() if self._tokens else None
+            self.ready.set(len(self._tokens))
+            self._condition.notify_all()
+
+        if token is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return token
+
+    def _fill(self):
+        backoff = 1.0
+        while True:
+            with self._condition:
+                self._drop_expired()
+                self.ready.set(len(self._tokens))
+                while self._running and len(self._tokens) >= self.size:
+                    # Wake up when a token is taken or the oldest one expires
+                    oldest = self._tokens[0].created_at
+                    self._condition.wait(oldest + self.lifetime - time.monotonic())
+                    self._drop_expired()
+                if not self._running:
+                    return
+
+            try:
+                token = self.factory()
+            except Exception as e:
+                self.errors.inc()
+                logging.warning(f"[{self.name}] Failed to create a token: {e}")
+                with self._condition:
+                    self._condition.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1.0
+            with self._condition:
+                self._tokens.append(token)
+                self.ready.set(len(self._tokens))
+
+    def _drop_expired(self):
+        deadline = time.monotonic() - self.lifetime
+        while self._tokens and self._tokens[0].created_at <= deadline:
+            self._tokens.popleft()
+            self.expired.inc()
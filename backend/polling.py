@@ -0,0 +1,167 @@
+import random
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+
+from parcel_tw import Platform, TrackingInfo
+
+# Taiwan has no daylight saving time
+TAIWAN_TIMEZONE = timezone(timedelta(hours=8))
+
+# Status messages after which a parcel never changes again
+PICKED_UP_STATUSES = {
+    Platform.SevenEleven: ("已完成包裹成功取件",),
+    Platform.FamilyMart: ("已完成取件",),
+    Platform.OKMart: ("已取貨",),
+    Platform.Shopee: (),
+}
+SHOPEE_PICKED_UP_CODE = "SP_Collection_Collected"
+
+
+@dataclass
+class PollPolicy:
+    base_interval: float = 600  # Seconds between checks of a parcel on the move
+    backoff: float = 1.5  # Interval growth per check without a change
+    max_interval: float = 6 * 3600
+    delivered_interval: float = 3 * 3600  # Waiting at the store for pickup
+    not_found_interval: float = 1800  # Not (yet) known by the carrier
+    failed_interval: float = 300  # The lookup failed, e.g. a network error
+    max_idle: float = 14 * 86400  # Stop polling after this long without change
+    jitter: float = 0.1  # Random fraction added to spread the checks out
+    quiet_hours: tuple[int, int] = (1, 6)  # Taiwan hours the carriers are idle
+
+
+@dataclass
+class PollState:
+    status: str | None
+    update_time: datetime | str | None
+    last_changed_at: datetime | None
+    unchanged_checks: int
+    is_delivered: bool
+    next_check_at: datetime | None
+
+
+def is_picked_up(platform: Platform, result: TrackingInfo) -> bool:
+    if platform == Platform.Shopee:
+        tracking_list = result.raw_data.get("tracking_list") or [{}]
+        return tracking_list[0].get("status") == SHOPEE_PICKED_UP_CODE
+    return any(status in result.status for status in PICKED_UP_STATUSES[platform])
+
+
+def next_poll_state(
+    platform: Platform,
+    previous: PollState,
+    result: TrackingInfo | None,
+    now: datetime,
+    policy: PollPolicy,
+    failed: bool = False,
+) -> PollState:
+    """
+    Decide when a parcel should be checked again after a check
+
+    A parcel which keeps its status is checked less and less often, while
+    one that just changed goes back to `base_interval`. Delivered parcels
+    are checked slowly, and picked up or long idle parcels are not checked
+    again (`next_check_at` is `None`). A failed check tells nothing about
+    the parcel, it is retried after `failed_interval` and doesn't count as
+    an unchanged check.
+
+    Parameters
+    ----------
+    platform : Platform
+        The platform of the parcel
+    previous : PollState
+        The stored state of the parcel
+    result : TrackingInfo | None
+        The result of the check, `None` if the parcel wasn't found
+    now : datetime
+        The time of the check, naive UTC
+    policy : PollPolicy
+        The polling intervals
+    failed : bool
+        Whether the lookup failed, e.g. a network error or an unreadable
+        response, the `result` is ignored
+
+    Returns
+    -------
+    PollState
+        The new state of the parcel
+    """
+
+    if failed:
+        return deferred_poll_state(previous, policy.failed_interval, now, policy)
+
+    changed = result is not None and result.status != previous.status
+    if changed:
+        state = PollState(
+            status=result.status,
+            update_time=result.time,
+            last_changed_at=now,
+            unchanged_checks=0,
+            is_delivered=result.is_delivered,
+            next_check_at=None,
+        )
+    else:
+        state = PollState(
+            status=previous.status,
+            update_time=previous.update_time,
+            last_changed_at=previous.last_changed_at or now,
+            unchanged_checks=previous.unchanged_checks + 1,
+            is_delivered=previous.is_delivered,
+            next_check_at=None,
+        )
+
+    if result is not None and is_picked_up(platform, result):
+        return state
+    if (now - state.last_changed_at).total_seconds() > policy.max_idle:
+        return state
+
+    if result is None:
+        interval = policy.not_found_interval
+    elif result.is_delivered:
+        interval = policy.delivered_interval
+    else:
+        interval = min(
+            policy.base_interval * policy.backoff**state.unchanged_checks,
+            policy.max_interval,
+        )
+    interval *= 1 + random.uniform(0, policy.jitter)
+
+    state.next_check_at = skip_quiet_hours(now + timedelta(seconds=interval), policy)
+    return state
+
+
+def deferred_poll_state(
+    previous: PollState, delay: float, now: datetime, policy: PollPolicy
+) -> PollState:
+    """
+    Check a parcel again after `delay` seconds, leaving the rest of its state
+    as it was
+
+    Used when the parcel couldn't be checked at all, e.g. when its carrier
+    is rate limited, so the missed check doesn't count as an unchanged one.
+    """
+
+    delay *= 1 + random.uniform(0, policy.jitter)
+    next_check_at = skip_quiet_hours(now + timedelta(seconds=delay), policy)
+    return replace(previous, next_check_at=next_check_at)
+
+
+def skip_quiet_hours(at: datetime, policy: PollPolicy) -> datetime:
+    """
+    Move a check planned in the quiet hours to the end of them
+    """
+
+    start, end = policy.quiet_hours
+    local = at.replace(tzinfo=timezone.utc).astimezone(TAIWAN_TIMEZONE)
+    if start <= local.hour < end:
+        local = local.replace(hour=end, minute=0, second=0, microsecond=0)
+        at = local.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def utcnow() -> datetime:
+    """
+    The current time as naive UTC, the time zone of the database session
+    """
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
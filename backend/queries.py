@@ -0,0 +1,177 @@
+"""
+SQL statements of the backend
+
+They are kept in one place so `benchmarks/explain_queries.py` checks the
+query plans of the exact statements the API runs. Every lookup filters on a
+left prefix of one of the indexes in `db/init.sql`, subscriber lookups are
+split by email and by discord_id instead of using `OR`.
+"""
+
+from typing import Final
+
+FIND_SUBSCRIPTION_BY_EMAIL: Final = """
+SELECT sub_id FROM Subscriptions
+WHERE platform_id = %s AND order_id = %s AND email = %s
+LIMIT 1
+"""
+
+FIND_SUBSCRIPTION_BY_DISCORD_ID: Final = """
+SELECT sub_id FROM Subscriptions
+WHERE platform_id = %s AND order_id = %s AND discord_id = %s
+LIMIT 1
+"""
+
+# A known parcel keeps its status (so its subscribers still get notified of
+# the change), its polling is only resumed if it had been stopped
+INSERT_PARCEL: Final = """
+INSERT INTO Parcels (platform_id, order_id, status, update_time, next_check_at, is_delivered)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE next_check_at = COALESCE(next_check_at, VALUES(next_check_at))
+"""
+
+INSERT_SUBSCRIPTION: Final = """
+INSERT INTO Subscriptions (order_id, email, discord_id, platform_id)
+VALUES (%s, %s, %s, %s)
+"""
+
+DELETE_SUBSCRIPTION_BY_EMAIL: Final = """
+DELETE FROM Subscriptions
+WHERE platform_id = %s AND order_id = %s AND email = %s
+"""
+
+DELETE_SUBSCRIPTION_BY_DISCORD_ID: Final = """
+DELETE FROM Subscriptions
+WHERE platform_id = %s AND order_id = %s AND discord_id = %s
+"""
+
+# A page of a subscriber's parcels with their latest status, in the order of
+# the subscriber index. The page starts after the (platform_id, order_id)
+# cursor, so no rows are skipped with OFFSET. The OR is a single range of the
+# index, unlike a row constructor comparison.
+LIST_SUBSCRIPTIONS_BY_EMAIL: Final = """
+SELECT S.platform_id, S.order_id, P.status, P.update_time
+FROM Subscriptions S
+JOIN Parcels P ON P.platform_id = S.platform_id AND P.order_id = S.order_id
+WHERE S.email = %s
+AND (S.platform_id > %s OR (S.platform_id = %s AND S.order_id > %s))
+ORDER BY S.platform_id, S.order_id
+LIMIT %s
+"""
+
+LIST_SUBSCRIPTIONS_BY_DISCORD_ID: Final = """
+SELECT S.platform_id, S.order_id, P.status, P.update_time
+FROM Subscriptions S
+JOIN Parcels P ON P.platform_id = S.platform_id AND P.order_id = S.order_id
+WHERE S.discord_id = %s
+AND (S.platform_id > %s OR (S.platform_id = %s AND S.order_id > %s))
+ORDER BY S.platform_id, S.order_id
+LIMIT %s
+"""
+
+# Stop polling a parcel once nobody is subscribed to it
+STOP_UNSUBSCRIBED_PARCEL: Final = """
+UPDATE Parcels SET next_check_at = NULL
+WHERE platform_id = %s AND order_id = %s
+AND NOT EXISTS (
+    SELECT 1 FROM Subscriptions S
+    WHERE S.platform_id = %s AND S.order_id = %s
+)
+"""
+
+# Lock the chunk of subscribed parcels due for a check the earliest, rows
+# locked by another replica are skipped. The next_check_at index is the poll
+# queue.
+LOCK_DUE_PARCELS: Final = """
+SELECT id, next_check_at FROM Parcels
+WHERE next_check_at <= %s
+AND EXISTS (
+    SELECT 1 FROM Subscriptions E
+    WHERE E.platform_id = Parcels.platform_id AND E.order_id = Parcels.order_id
+)
+ORDER BY next_check_at
+LIMIT %s
+FOR UPDATE OF Parcels SKIP LOCKED
+"""
+
+# Lease the locked parcels by moving their next check to the lease expiry, so
+# no other replica picks them up unless this one dies. Format `ids` with one
+# placeholder per parcel id.
+LEASE_PARCELS: Final = """
+UPDATE Parcels SET next_check_at = %s, leased_by = %s WHERE id IN ({ids})
+"""
+
+LOAD_LEASED_PARCELS: Final = """
+SELECT
+    P.platform_id, P.order_id, P.status, P.update_time, P.last_changed_at,
+    P.unchanged_checks, P.is_delivered, P.next_check_at, S.email, S.discord_id
+FROM Parcels P
+JOIN Subscriptions S ON S.platform_id = P.platform_id AND S.order_id = P.order_id
+WHERE P.id IN ({ids})
+ORDER BY P.platform_id, P.order_id
+"""
+
+# Lock the given parcels which are still leased by this replica, so their lease
+# can't expire and be taken over before their poll results are stored. Format
+# `keys` with one `(%s, %s)` per parcel.
+LOCK_LEASED_PARCELS: Final = """
+SELECT platform_id, order_id FROM Parcels
+WHERE leased_by = %s AND (platform_id, order_id) IN ({keys})
+FOR UPDATE
+"""
+
+# Upsert on the (platform_id, order_id) key, which the drivers batch into a
+# single multi-row statement with `executemany` (unlike an `UPDATE`)
+SAVE_POLL_RESULTS: Final = """
+INSERT INTO Parcels (
+    platform_id, order_id, status, update_time, next_check_at, last_changed_at,
+    unchanged_checks, is_delivered
+)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    status = VALUES(status),
+    update_time = VALUES(update_time),
+    next_check_at = VALUES(next_check_at),
+    last_changed_at = VALUES(last_changed_at),
+    unchanged_checks = VALUES(unchanged_checks),
+    is_delivered = VALUES(is_delivered),
+    leased_by = NULL
+"""
+
+# The latest status of the watched parcels of the stream hub, read from the
+# covering status index. Format `keys` with one `(%s, %s)` per parcel.
+LOAD_PARCEL_STATUSES: Final = """
+SELECT platform_id, order_id, status, update_time FROM Parcels
+WHERE (platform_id, order_id) IN ({keys})
+"""
+
+INSERT_NOTIFICATION: Final = """
+INSERT INTO NotificationOutbox (channel, recipient, payload)
+VALUES (%s, %s, %s)
+"""
+
+# Lock and read the notifications due for a delivery attempt, the earliest
+# first, rows locked by another replica are skipped
+LOCK_DUE_NOTIFICATIONS: Final = """
+SELECT id, channel, recipient, payload, attempts, created_at FROM NotificationOutbox
+WHERE next_attempt_at <= %s
+ORDER BY next_attempt_at
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+# Lease the locked notifications until `next_attempt_at`, like `LEASE_PARCELS`
+LEASE_NOTIFICATIONS: Final = """
+UPDATE NotificationOutbox SET next_attempt_at = %s, leased_by = %s
+WHERE id IN ({ids})
+"""
+
+DELETE_NOTIFICATIONS: Final = """
+DELETE FROM NotificationOutbox WHERE id IN ({ids})
+"""
+
+# A NULL next_attempt_at gives the delivery up
+RETRY_NOTIFICATION: Final = """
+UPDATE NotificationOutbox
+SET attempts = %s, next_attempt_at = %s, leased_by = NULL, last_error = %s
+WHERE id = %s
+"""
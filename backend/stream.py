@@ -0,0 +1,197 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+
+import queries
+from database import Database, DatabaseError
+from parcel_tw import TrackingError
+from parcel_tw.metrics import metrics
+
+# (platform_id, order_id)
+ParcelKey = tuple[int, str]
+
+# Sent to the watchers of a parcel which doesn't exist
+NOT_FOUND: dict = {}
+
+# Sent to the watchers of a parcel whose status couldn't be loaded, they are
+# expected to watch it again later
+UNAVAILABLE: dict = {"unavailable": True}
+
+
+class StreamHub:
+    def __init__(
+        self,
+        db: Database,
+        snapshot: Callable[[ParcelKey], Awaitable[dict | None]],
+        refresh_interval: float = 2,
+        batch_size: int = 500,
+        max_watchers: int = 10000,
+    ):
+        """
+        Share the status of the watched parcels between their stream watchers
+
+        All the watchers of a parcel share one upstream: the first watcher
+        gets a snapshot of the parcel, and the hub reloads the status of
+        every watched parcel from the database every `refresh_interval`, in
+        batches of `batch_size`. The parcels are only tracked by the poller,
+        which publishes its changes to the hub right away, so the watchers
+        add no carrier load. The database refresh picks up the changes found
+        by the other replicas.
+
+        A watcher gets the latest status only, a slow watcher skips the
+        statuses it didn't read in time.
+
+        Parameters
+        ----------
+        db : Database
+            The database holding the parcels
+        snapshot : Callable[[ParcelKey], Awaitable[dict | None]]
+            The status of a parcel which isn't in the database, `None` if
+            the parcel doesn't exist
+        refresh_interval : float
+            Seconds between two reloads of the watched parcels
+        batch_size : int
+            The max number of parcels loaded by one query
+        max_watchers : int
+            The max number of watchers, across all the parcels
+        """
+
+        self.db = db
+        self.snapshot = snapshot
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.max_watchers = max_watchers
+
+        self._watchers: dict[ParcelKey, set[asyncio.Queue]] = {}
+        self._latest: dict[ParcelKey, dict] = {}
+        self._task: asyncio.Task | None = None
+        self._snapshots: set[asyncio.Task] = set()
+        self._loading: set[ParcelKey] = set()
+        self._count = 0
+
+        self.watcher_gauge = metrics.gauge("stream.watchers")
+        self.parcel_gauge = metrics.gauge("stream.parcels")
+        self.published = metrics.counter("stream.published")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._task, *self._snapshots]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *[t for t in [self._task, *self._snapshots] if t is not None],
+            return_exceptions=True,
+        )
+        self._task = None
+
+    def is_full(self) -> bool:
+        return self._count >= self.max_watchers
+
+    @asynccontextmanager
+    async def watch(self, key: ParcelKey):
+        """
+        Watch a parcel, yielding the queue of its statuses
+
+        The queue holds the latest status, or `NOT_FOUND` if the parcel
+        doesn't exist. It starts with the current status, as soon as it is
+        known, or `UNAVAILABLE` if it couldn't be loaded. The next watcher
+        of the parcel then tries to load it again.
+        """
+
+        queue = asyncio.Queue(maxsize=1)
+        watchers = self._watchers.setdefault(key, set())
+        watchers.add(queue)
+        self._count += 1
+        self.watcher_gauge.set(self._count)
+        self.parcel_gauge.set(len(self._watchers))
+
+        if key in self._latest:
+            queue.put_nowait(self._latest[key])
+        elif key not in self._loading:
+            self._loading.add(key)
+            task = asyncio.create_task(self._load_snapshot(key))
+            self._snapshots.add(task)
+            task.add_done_callback(self._snapshots.discard)
+
+        try:
+            yield queue
+        finally:
+            watchers.discard(queue)
+            if not watchers:
+                del self._watchers[key]
+                self._latest.pop(key, None)
+            self._count -= 1
+            self.watcher_gauge.set(self._count)
+            self.parcel_gauge.set(len(self._watchers))
+
+    def publish(self, key: ParcelKey, status: dict):
+        """
+        Send the status of a parcel to its watchers, if it changed
+        """
+
+        watchers = self._watchers.get(key)
+        if not watchers:
+            return
+        latest = self._latest.get(key)
+        if latest is not None and latest.get("status") == status.get("status"):
+            return
+
+        self._latest[key] = status
+        self.published.inc()
+        self._send(watchers, status)
+
+    def _send(self, watchers: set[asyncio.Queue], status: dict):
+        for queue in watchers:
+            # Replace the status the watcher hasn't read yet
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+
+    async def load(self, keys: list[ParcelKey]) -> dict[ParcelKey, dict]:
+        """
+        Load the status of the parcels in the database, by key
+        """
+
+        placeholders = ", ".join(["(%s, %s)"] * len(keys))
+        rows = await self.db.fetchall(
+            queries.LOAD_PARCEL_STATUSES.format(keys=placeholders),
+            [value for key in keys for value in key],
+        )
+        return {
+            (platform_id, order_id): {
+                "order_id": order_id,
+                "status": status,
+                "time": str(update_time) if update_time is not None else None,
+            }
+            for platform_id, order_id, status, update_time in rows
+        }
+
+    async def _load_snapshot(self, key: ParcelKey):
+        try:
+            statuses = await self.load([key])
+            status = statuses.get(key)
+            if status is None:
+                status = await self.snapshot(key)
+        except (DatabaseError, TrackingError) as e:
+            print(f"Failed to load the status of {key}: {str(e)}")
+            # Not kept as the latest status, so the next watcher retries
+            self._send(self._watchers.get(key, set()), UNAVAILABLE)
+            return
+        finally:
+            self._loading.discard(key)
+        self.publish(key, NOT_FOUND if status is None else status)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            keys = list(self._watchers)
+            for i in range(0, len(keys), self.batch_size):
+                try:
+                    statuses = await self.load(keys[i : i + self.batch_size])
+                except DatabaseError as e:
+                    print(f"Failed to refresh the watched parcels: {str(e)}")
+                    break
+                for key, status in statuses.items():
+                    self.publish(key, status)
@@ -0,0 +1,147 @@
+"""
+Shared fixtures of the backend tests, run from `backend/`:
+
+    python -m pytest tests
+"""
+
+import json
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+import queries
+from parcel_tw import Platform, core
+from parcel_tw.core import TrackerRegistry
+from polling import utcnow
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    """
+    Replace `time.monotonic` and `time.sleep` with a clock moved by the test
+    """
+
+    fake = FakeClock()
+    monkeypatch.setattr(time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(time, "sleep", fake.sleep)
+    return fake
+
+
+class FakeOutbox:
+    """
+    In-memory `NotificationOutbox` behind the `Database` methods the
+    dispatcher uses
+    """
+
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.fail_next: Exception | None = None
+
+    def add(self, id: int, channel: str, recipient: str, payload):
+        if not isinstance(payload, str):
+            payload = json.dumps(payload, ensure_ascii=False)
+        self.rows[id] = {
+            "channel": channel,
+            "recipient": recipient,
+            "payload": payload,
+            "created_at": utcnow(),
+            "attempts": 0,
+            "next_attempt_at": utcnow(),
+            "last_error": None,
+        }
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+
+    async def fetchall(self, sql, params):
+        assert sql == queries.LOCK_DUE_NOTIFICATIONS
+        if self.fail_next is not None:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        now, limit = params
+        due = [
+            (id, row)
+            for id, row in self.rows.items()
+            if row["next_attempt_at"] is not None and row["next_attempt_at"] <= now
+        ]
+        return [
+            (
+                id,
+                row["channel"],
+                row["recipient"],
+                row["payload"],
+                row["attempts"],
+                row["created_at"],
+            )
+            for id, row in due[:limit]
+        ]
+
+    async def execute(self, sql, params):
+        if sql.startswith("\nUPDATE NotificationOutbox"):
+            until, _, *ids = params
+            for id in ids:
+                self.rows[id]["next_attempt_at"] = until
+        else:
+            for id in params:
+                del self.rows[id]
+
+    async def executemany(self, sql, seq_params):
+        assert sql == queries.RETRY_NOTIFICATION
+        for attempts, next_attempt_at, last_error, id in seq_params:
+            self.rows[id].update(
+                attempts=attempts,
+                next_attempt_at=next_attempt_at,
+                last_error=last_error,
+            )
+
+
+class StubTracker:
+    """
+    Tracker answering every lookup with `result`, or raising `error`
+    """
+
+    def __init__(self):
+        self.result = None
+        self.error: Exception | None = None
+        self.lookups = 0
+
+    async def async_track_status(self, order_id):
+        self.lookups += 1
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def tracker(monkeypatch) -> StubTracker:
+    """
+    Replace the 7-11 tracker, in a fresh registry without a tracking cache
+    """
+
+    stub = StubTracker()
+    registry = TrackerRegistry()
+    registry._trackers[Platform.SevenEleven] = stub
+    monkeypatch.setattr(core, "_registry", registry)
+    monkeypatch.setattr(core, "_cache", None)
+    return stub
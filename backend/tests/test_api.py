@@ -0,0 +1,276 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import queries
+from parcel_tw import CarrierUnavailableError, Platform, TrackingError, TrackingInfo
+from polling import PollPolicy, utcnow
+
+client = TestClient(api.app)
+
+
+class RecordingDatabase:
+    """
+    Database without any rows, recording the statements it runs
+    """
+
+    def __init__(self):
+        self.executed: list[tuple[str, tuple]] = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+
+    async def fetchone(self, sql, params=()):
+        return None
+
+    async def fetchall(self, sql, params=()):
+        return []
+
+    async def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+        return 1
+
+    async def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.executed.append((sql, params))
+        return 1
+
+
+@pytest.fixture
+def db(monkeypatch) -> RecordingDatabase:
+    fake = RecordingDatabase()
+    monkeypatch.setattr(api, "db", fake)
+    return fake
+
+
+class FakeParcels(RecordingDatabase):
+    """
+    `Parcels` table of subscribed 7-11 parcels behind the statements of the
+    poller
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows: dict[str, dict] = {}
+
+    def add(self, order_id: str, subscribers: list[tuple]):
+        self.rows[order_id] = {
+            "id": len(self.rows) + 1,
+            "status": "已出貨",
+            "update_time": "2024-01-01 09:00:00",
+            "last_changed_at": utcnow(),
+            "unchanged_checks": 0,
+            "is_delivered": False,
+            "next_check_at": utcnow() - timedelta(minutes=1),
+            "leased_by": None,
+            "subscribers": subscribers,
+        }
+
+    def by_ids(self, ids) -> list[tuple[str, dict]]:
+        return [(o, row) for o, row in self.rows.items() if row["id"] in ids]
+
+    async def fetchall(self, sql, params=()):
+        if sql == queries.LOCK_DUE_PARCELS:
+            due_by, limit = params
+            due = sorted(
+                (row["next_check_at"], row["id"])
+                for row in self.rows.values()
+                if row["next_check_at"] is not None and row["next_check_at"] <= due_by
+            )
+            return [(id, next_check_at) for next_check_at, id in due[:limit]]
+        if sql.startswith(queries.LOCK_LEASED_PARCELS.split("{")[0]):
+            node, *keys = params
+            order_ids = keys[1::2]
+            return [
+                (1, order_id)
+                for order_id in order_ids
+                if self.rows[order_id]["leased_by"] == node
+            ]
+        assert sql.startswith(queries.LOAD_LEASED_PARCELS.split("{")[0])
+        return [
+            (
+                1,
+                order_id,
+                *(row[column] for column in PARCEL_STATE),
+                email,
+                discord_id,
+            )
+            for order_id, row in self.by_ids(params)
+            for email, discord_id in row["subscribers"]
+        ]
+
+    async def execute(self, sql, params=()):
+        assert sql.startswith(queries.LEASE_PARCELS.split("{")[0])
+        until, node, *ids = params
+        for _, row in self.by_ids(ids):
+            row.update(next_check_at=until, leased_by=node)
+        return len(ids)
+
+    async def executemany(self, sql, seq_params):
+        seq_params = list(seq_params)
+        if sql == queries.SAVE_POLL_RESULTS:
+            for _, order_id, *state in seq_params:
+                self.rows[order_id].update(zip(SAVED_STATE, state), leased_by=None)
+        return await super().executemany(sql, seq_params)
+
+
+# The columns of the parcel state, in the order of `LOAD_LEASED_PARCELS`
+# and `SAVE_POLL_RESULTS`
+PARCEL_STATE = [
+    "status",
+    "update_time",
+    "last_changed_at",
+    "unchanged_checks",
+    "is_delivered",
+    "next_check_at",
+]
+SAVED_STATE = [
+    "status",
+    "update_time",
+    "next_check_at",
+    "last_changed_at",
+    "unchanged_checks",
+    "is_delivered",
+]
+
+
+@pytest.fixture
+def parcels(monkeypatch) -> FakeParcels:
+    fake = FakeParcels()
+    monkeypatch.setattr(api, "db", fake)
+    # No jitter, and quiet hours out of the way
+    monkeypatch.setattr(api, "POLL_POLICY", PollPolicy(jitter=0, quiet_hours=(0, 0)))
+    return fake
+
+
+def run_poller():
+    # A run which never ends fails instead of hanging the tests
+    asyncio.run(asyncio.wait_for(api.check_subscriptions(), 5))
+
+
+def tracking_info(order_id: str) -> TrackingInfo:
+    return TrackingInfo(
+        order_id=order_id,
+        platform="seven_eleven",
+        status="包裹配達取件門市",
+        time="2024-01-01 12:00:00",
+        is_delivered=False,
+        raw_data={},
+    )
+
+
+def test_tracked_parcel(tracker):
+    tracker.result = tracking_info("F123")
+    response = client.get("/api/track/seven_eleven/F123")
+    assert response.status_code == 200
+    assert response.json()["status"] == "包裹配達取件門市"
+
+
+def test_parcel_not_found(tracker):
+    response = client.get("/api/track/seven_eleven/F123")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Parcel not found"}
+
+
+def test_failed_lookup_is_not_reported_as_not_found(tracker):
+    tracker.error = TrackingError("[7-11] Failed to solve the captcha")
+    response = client.get("/api/track/seven_eleven/F123")
+    assert response.status_code == 502
+
+
+def test_unavailable_carrier(tracker):
+    tracker.error = CarrierUnavailableError("[7-11] Circuit open", retry_after=30)
+    response = client.get("/api/track/seven_eleven/F123")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "31"
+
+
+def test_subscription_to_a_parcel_which_failed_to_track(tracker, db):
+    tracker.error = TrackingError("[7-11] Failed to solve the captcha")
+    response = client.post(
+        "/api/subscriptions",
+        json={"platform": "seven_eleven", "order_id": "F123", "discord_id": "42"},
+    )
+    assert response.status_code == 502
+    assert db.executed == []
+
+
+def test_parcels_deferred_by_a_check_wait_for_the_next_one(tracker, parcels):
+    # Due again right away, but only checked by the next run
+    tracker.error = CarrierUnavailableError("[7-11] Rate limited", retry_after=0)
+    parcels.add("F123", [(None, "42")])
+
+    run_poller()
+    assert tracker.lookups == 1
+    assert parcels.rows["F123"]["next_check_at"] <= utcnow()
+
+    run_poller()
+    assert tracker.lookups == 2
+
+
+def test_changed_parcel_is_saved_and_notified(tracker, parcels, monkeypatch):
+    monkeypatch.setattr(api, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+    tracker.result = tracking_info("F123")
+    parcels.add("F123", [(None, "42")])
+
+    run_poller()
+    row = parcels.rows["F123"]
+    assert row["status"] == "包裹配達取件門市"
+    assert row["leased_by"] is None
+    notifications = [
+        p for sql, p in parcels.executed if sql == queries.INSERT_NOTIFICATION
+    ]
+    assert [(channel, recipient) for channel, recipient, _ in notifications] == [
+        ("discord", "42")
+    ]
+
+
+def test_results_of_a_lease_taken_over_are_dropped(tracker, parcels, monkeypatch):
+    monkeypatch.setattr(api, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+    published = []
+    monkeypatch.setattr(api.hub, "publish", lambda key, status: published.append(key))
+    parcels.add("F123", [(None, "42")])
+
+    async def slow_lookup(order_id):
+        # The lease expired before the carrier answered, and another replica
+        # leased the parcel again
+        parcels.rows[order_id].update(leased_by="other-replica")
+        return tracking_info(order_id)
+
+    tracker.async_track_status = slow_lookup
+
+    run_poller()
+    row = parcels.rows["F123"]
+    assert row["status"] == "已出貨"
+    assert row["leased_by"] == "other-replica"
+    assert all(sql != queries.INSERT_NOTIFICATION for sql, _ in parcels.executed)
+    assert published == []
+
+
+def test_subscriber_is_notified_on_every_configured_channel(monkeypatch):
+    monkeypatch.setattr(api, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+    monkeypatch.setattr(api, "mailer", object())
+    subscribers = [("a@example.com", "42"), ("b@example.com", None), (None, "43")]
+    changes = [(Platform.SevenEleven, "F123", tracking_info("F123"), subscribers)]
+
+    notifications = api.change_notifications(changes)
+    assert [(channel, recipient) for channel, recipient, _ in notifications] == [
+        ("discord", "42"),
+        ("email", "a@example.com"),
+        ("email", "b@example.com"),
+        ("discord", "43"),
+    ]
+
+
+def test_unconfigured_channels_are_not_notified(monkeypatch):
+    monkeypatch.setattr(api, "DISCORD_WEBHOOK_URL", None)
+    monkeypatch.setattr(api, "mailer", None)
+    subscribers = [("a@example.com", "42")]
+    changes = [(Platform.SevenEleven, "F123", tracking_info("F123"), subscribers)]
+
+    assert api.change_notifications(changes) == []
@@ -0,0 +1,22 @@
+import sys
+
+import pytest
+
+from parcel_tw.captcha import TesseractCLIRecognizer, create_recognizer
+
+
+def test_auto_falls_back_to_the_tesseract_command(monkeypatch):
+    # An entry of None makes the import raise ImportError
+    monkeypatch.setitem(sys.modules, "tesserocr", None)
+    assert isinstance(create_recognizer("auto"), TesseractCLIRecognizer)
+
+
+def test_tesserocr_is_required_when_asked_for(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tesserocr", None)
+    with pytest.raises(ImportError):
+        create_recognizer("tesserocr")
+
+
+def test_classifier_needs_a_trained_model():
+    with pytest.raises(ValueError):
+        create_recognizer("classifier")
@@ -0,0 +1,196 @@
+import asyncio
+
+import aiohttp
+import pytest
+import requests
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from parcel_tw.base import CarrierUnavailableError, TrackingError
+from parcel_tw.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakerConfig,
+    is_carrier_failure,
+)
+
+CONFIG = CircuitBreakerConfig(
+    failure_threshold=3, recovery_timeout=30, half_open_max_calls=1
+)
+
+
+def wrapped(error: BaseException) -> TrackingError:
+    """
+    The error as raised by a tracker, from the error of its lookup
+    """
+
+    tracking_error = TrackingError(f"[test] {error}")
+    tracking_error.__cause__ = error
+    return tracking_error
+
+
+def fail(breaker: CircuitBreaker, error: BaseException | None = None):
+    error = error or wrapped(ConnectionResetError("carrier down"))
+    with pytest.raises(type(error)):
+        with breaker.call():
+            raise error
+
+
+def succeed(breaker: CircuitBreaker):
+    with breaker.call():
+        pass
+
+
+def open_breaker(name: str) -> CircuitBreaker:
+    breaker = CircuitBreaker(name, CONFIG)
+    for _ in range(CONFIG.failure_threshold):
+        fail(breaker)
+    return breaker
+
+
+def test_opens_after_the_failure_threshold(clock):
+    breaker = CircuitBreaker("test_threshold", CONFIG)
+
+    for _ in range(CONFIG.failure_threshold - 1):
+        fail(breaker)
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.opened.value == 1
+
+
+def test_a_success_resets_the_consecutive_failures(clock):
+    breaker = CircuitBreaker("test_reset", CONFIG)
+
+    for _ in range(CONFIG.failure_threshold - 1):
+        fail(breaker)
+    succeed(breaker)
+    for _ in range(CONFIG.failure_threshold - 1):
+        fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_open_circuit_rejects_with_the_time_left(clock):
+    breaker = open_breaker("test_reject")
+    clock.advance(10)
+
+    with pytest.raises(CarrierUnavailableError) as error:
+        with breaker.call():
+            pytest.fail("the lookup must not run")
+    assert error.value.retry_after == pytest.approx(20)
+    assert breaker.rejected.value == 1
+
+
+def test_half_open_lets_a_limited_number_of_probes_through(clock):
+    breaker = open_breaker("test_probe_limit")
+    clock.advance(CONFIG.recovery_timeout)
+
+    with breaker.call():
+        assert breaker.state == HALF_OPEN
+        # A second lookup while the probe is in flight is rejected
+        with pytest.raises(CarrierUnavailableError):
+            with breaker.call():
+                pass
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = open_breaker("test_probe_success")
+    clock.advance(CONFIG.recovery_timeout)
+
+    succeed(breaker)
+    assert breaker.state == CLOSED
+    succeed(breaker)
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    breaker = open_breaker("test_probe_failure")
+    clock.advance(CONFIG.recovery_timeout)
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.opened.value == 2
+
+    # The recovery timeout starts over
+    clock.advance(CONFIG.recovery_timeout - 1)
+    with pytest.raises(CarrierUnavailableError):
+        succeed(breaker)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [CarrierUnavailableError("rate limited", retry_after=1), asyncio.CancelledError()],
+)
+def test_rejections_and_cancellations_are_not_failures(clock, error):
+    breaker = CircuitBreaker(f"test_ignored_{type(error).__name__}", CONFIG)
+
+    for _ in range(CONFIG.failure_threshold * 2):
+        fail(breaker, error)
+    assert breaker.state == CLOSED
+    assert breaker.failures.value == 0
+
+
+@pytest.mark.parametrize(
+    "error",
+    [CarrierUnavailableError("rate limited", retry_after=1), asyncio.CancelledError()],
+)
+def test_ignored_probe_frees_its_slot_without_closing(clock, error):
+    breaker = open_breaker(f"test_ignored_probe_{type(error).__name__}")
+    clock.advance(CONFIG.recovery_timeout)
+
+    fail(breaker, error)
+    assert breaker.state == HALF_OPEN
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def response_error(status: int) -> aiohttp.ClientResponseError:
+    url = URL("https://carrier.example/search")
+    request_info = aiohttp.RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url)
+    return aiohttp.ClientResponseError(request_info, (), status=status)
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        wrapped(ConnectionResetError()),
+        wrapped(asyncio.TimeoutError()),
+        wrapped(requests.ConnectTimeout()),
+        wrapped(aiohttp.ServerDisconnectedError()),
+        wrapped(response_error(503)),
+        wrapped(http_error(502)),
+    ],
+)
+def test_transport_errors_and_server_errors_are_carrier_failures(error):
+    assert is_carrier_failure(error)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        TrackingError("[7-11] Failed to solve the captcha"),
+        wrapped(ValueError("Incorrect captcha")),
+        wrapped(KeyError("status")),
+        wrapped(response_error(404)),
+        wrapped(http_error(403)),
+    ],
+)
+def test_local_errors_and_client_errors_are_not_carrier_failures(error):
+    assert not is_carrier_failure(error)
+
+
+def test_unsolved_captchas_dont_open_the_circuit(clock):
+    breaker = CircuitBreaker("test_captcha", CONFIG)
+
+    for _ in range(CONFIG.failure_threshold * 2):
+        fail(breaker, TrackingError("[7-11] Failed to solve the captcha"))
+    assert breaker.state == CLOSED
+    assert breaker.failures.value == 0
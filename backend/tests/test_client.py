@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+import requests
+
+from parcel_tw.client import CarrierClient
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hung_up = threading.Event()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def finish(self):
+        super().finish()
+        self.hung_up.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_connector_of_a_loop_in_another_thread_is_closed_on_that_loop():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    client = CarrierClient()
+
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+
+    async def get() -> bytes:
+        async with client.new_async_session() as session:
+            async with session.get(url) as response:
+                return await response.read()
+
+    try:
+        assert asyncio.run_coroutine_threadsafe(get(), other_loop).result(5) == b"ok"
+        first = client._connector
+        assert not KeepAliveHandler.hung_up.is_set()
+
+        assert asyncio.run(get()) == b"ok"
+        assert client._connector is not first
+        assert KeepAliveHandler.hung_up.wait(1)
+        assert first.closed
+        asyncio.run(client.aclose())
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        thread.join(1)
+        other_loop.close()
+        server.shutdown()
+        server.server_close()
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """
+    Answers with the status in the path, e.g. `/503`
+    """
+
+    def do_GET(self):
+        self.send_response(int(self.path.strip("/")))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def status_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_errors_of_the_carrier_raise(status_server):
+    client = CarrierClient()
+
+    assert client.new_session().get(f"{status_server}/404").status_code == 404
+    with pytest.raises(requests.HTTPError):
+        client.new_session().get(f"{status_server}/503")
+
+    async def get(status: int) -> int:
+        async with client.new_async_session() as session:
+            async with session.get(f"{status_server}/{status}") as response:
+                return response.status
+
+    async def run():
+        assert await get(404) == 404
+        with pytest.raises(aiohttp.ClientResponseError):
+            await get(503)
+        await client.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+import asyncio
+import socket
+
+from database import AiomysqlConnection, Connection, Database, DatabaseConfig
+
+
+class FakeConnection(Connection):
+    def __init__(self):
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, config):
+        return cls()
+
+    async def execute(self, sql, params=()):
+        return 0
+
+    async def executemany(self, sql, seq_params):
+        return 0
+
+    async def fetchall(self, sql, params=()):
+        return [(1,)]
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        self.closed = True
+
+
+class StreamConnection:
+    """
+    Closes its stream like an `aiomysql` connection
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+
+    def close(self):
+        self._writer.transport.close()
+
+
+def test_idle_connections_of_a_previous_event_loop_are_closed():
+    db = Database(DatabaseConfig())
+    db.driver = FakeConnection
+
+    async def checkout() -> Connection:
+        async with db.transaction() as conn:
+            return conn
+
+    first = asyncio.run(checkout())
+    assert not first.closed
+
+    second = asyncio.run(checkout())
+    assert second is not first
+    assert first.closed
+    assert db._idle == [second]
+
+
+def test_aiomysql_connection_of_a_closed_event_loop_is_hung_up():
+    server = socket.create_server(("127.0.0.1", 0))
+
+    async def connect() -> AiomysqlConnection:
+        _, writer = await asyncio.open_connection(*server.getsockname())
+        return AiomysqlConnection(StreamConnection(writer))
+
+    conn = asyncio.run(connect())
+    peer, _ = server.accept()
+    peer.settimeout(1)
+
+    asyncio.run(conn.close())
+    assert peer.recv(1) == b""
+    peer.close()
+    server.close()
+
+
+def test_connection_released_after_the_pool_moved_frees_its_own_slot():
+    db = Database(DatabaseConfig(pool_size=2))
+    db.driver = FakeConnection
+
+    async def run():
+        async with db.transaction() as conn:
+            # Another event loop takes the pool over meanwhile
+            db._slots_loop = None
+            slots = await db._get_slots()
+
+        # The new semaphore wasn't acquired, so it isn't released either
+        assert slots._value == 2
+        assert conn.closed
+        assert db._idle == []
+
+    asyncio.run(run())
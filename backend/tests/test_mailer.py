@@ -0,0 +1,155 @@
+import asyncio
+import smtplib
+import socket
+from email import message_from_bytes, policy
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from conftest import FakeOutbox
+from mailer import Mailer, SMTPConfig
+from outbox import EMAIL, DeliveryError, OutboxDispatcher, _smtp_error
+
+
+class RecordingHandler:
+    """
+    SMTP stand-in recording the connections and messages, which refuses
+    the recipients starting with `refused`
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.messages: list[tuple[list[str], str]] = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        message = message_from_bytes(envelope.content, policy=policy.default)
+        self.messages.append((envelope.rcpt_tos, message.get_content()))
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp_server():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        yield handler, port
+    finally:
+        controller.stop()
+
+
+def change(order_id: str, status: str = "包裹配達取件門市") -> dict:
+    return {
+        "platform": "seven_eleven",
+        "order_id": order_id,
+        "status": status,
+        "time": "2024/05/01 11:00",
+    }
+
+
+def test_digest_merges_the_changes_of_a_recipient():
+    mailer = Mailer(SMTPConfig(host="localhost", sender="tracker@example.com"))
+    message = mailer.build_digest("a@example.com", [change("1"), change("2", "已出貨")])
+
+    assert message["To"] == "a@example.com"
+    assert message["From"] == "tracker@example.com"
+    assert message["Subject"] == "2 個包裹狀態更新"
+    assert message.get_content().splitlines() == [
+        "[7-11] 1: 包裹配達取件門市 (2024/05/01 11:00)",
+        "[7-11] 2: 已出貨 (2024/05/01 11:00)",
+    ]
+
+
+def test_messages_are_sent_over_one_connection(smtp_server):
+    handler, port = smtp_server
+    mailer = Mailer(SMTPConfig(host="127.0.0.1", port=port, starttls=False))
+    messages = [mailer.build_digest(f"{n}@example.com", [change(n)]) for n in "abc"]
+
+    assert mailer.send(messages) == [None, None, None]
+    assert handler.connections == 1
+    assert [rcpt for rcpt, _ in handler.messages] == [
+        ["a@example.com"],
+        ["b@example.com"],
+        ["c@example.com"],
+    ]
+
+
+def test_refused_recipient_doesnt_stop_the_others(smtp_server):
+    handler, port = smtp_server
+    mailer = Mailer(SMTPConfig(host="127.0.0.1", port=port, starttls=False))
+    recipients = ["a@example.com", "refused@example.com", "b@example.com"]
+    messages = [mailer.build_digest(r, [change("1")]) for r in recipients]
+
+    errors = mailer.send(messages)
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], smtplib.SMTPRecipientsRefused)
+    assert _smtp_error(errors[1]).permanent
+    assert handler.connections == 1
+
+
+def test_unreachable_server_fails_every_message():
+    mailer = Mailer(SMTPConfig(host="127.0.0.1", port=1, starttls=False, timeout=1))
+    messages = [mailer.build_digest("a@example.com", [change("1")])] * 2
+
+    errors = mailer.send(messages)
+    assert len(errors) == 2 and all(isinstance(e, OSError) for e in errors)
+    assert not _smtp_error(errors[0]).permanent
+
+
+@pytest.mark.parametrize(
+    "error, permanent",
+    [
+        (smtplib.SMTPDataError(554, b"Rejected"), True),
+        (smtplib.SMTPDataError(451, b"Try again later"), False),
+        (smtplib.SMTPSenderRefused(550, b"Bad sender", "tracker@example.com"), True),
+        (smtplib.SMTPAuthenticationError(535, b"Bad credentials"), False),
+        (smtplib.SMTPServerDisconnected("Connection lost"), False),
+    ],
+)
+def test_smtp_errors_are_permanent_only_for_rejected_messages(error, permanent):
+    delivery_error = _smtp_error(error)
+
+    assert isinstance(delivery_error, DeliveryError)
+    assert delivery_error.permanent == permanent
+
+
+def test_dispatcher_sends_one_digest_per_recipient_per_batch(smtp_server):
+    handler, port = smtp_server
+    db = FakeOutbox()
+    db.add(1, EMAIL, "a@example.com", change("1"))
+    db.add(2, EMAIL, "b@example.com", change("2"))
+    db.add(3, EMAIL, "a@example.com", change("3"))
+    db.add(4, EMAIL, "refused@example.com", change("4"))
+    mailer = Mailer(SMTPConfig(host="127.0.0.1", port=port, starttls=False))
+    dispatcher = OutboxDispatcher(db, None, "test", mailer=mailer)
+
+    assert asyncio.run(dispatcher.dispatch()) == 4
+
+    assert handler.connections == 1
+    digests = {rcpt[0]: body.splitlines() for rcpt, body in handler.messages}
+    assert digests == {
+        "a@example.com": [
+            "[7-11] 1: 包裹配達取件門市 (2024/05/01 11:00)",
+            "[7-11] 3: 包裹配達取件門市 (2024/05/01 11:00)",
+        ],
+        "b@example.com": ["[7-11] 2: 包裹配達取件門市 (2024/05/01 11:00)"],
+    }
+    # The delivered notifications are deleted, the refused one is given up
+    assert list(db.rows) == [4]
+    assert db.rows[4]["next_attempt_at"] is None
+    assert db.rows[4]["attempts"] == 1
@@ -0,0 +1,74 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from conftest import FakeOutbox
+from outbox import DISCORD, OutboxDispatcher, RetryPolicy
+
+
+def test_malformed_payload_is_dead_lettered():
+    db = FakeOutbox()
+    db.add(1, DISCORD, "42", "{not json")
+    db.add(2, "pigeon", "42", {"status": "到店"})
+    dispatcher = OutboxDispatcher(db, None, "test")
+
+    assert asyncio.run(dispatcher.dispatch()) == 2
+    assert db.rows[1]["next_attempt_at"] is None
+    assert db.rows[1]["last_error"] == "Malformed payload"
+    assert db.rows[2]["next_attempt_at"] is None
+    assert db.rows[2]["last_error"] == "Unknown channel: pigeon"
+
+
+def test_dispatch_loop_survives_unexpected_errors():
+    db = FakeOutbox()
+    db.fail_next = RuntimeError("unexpected")
+    db.add(1, DISCORD, "42", "[]")
+    dispatcher = OutboxDispatcher(
+        db, None, "test", poll_interval=0.01, policy=RetryPolicy(max_attempts=1)
+    )
+
+    async def run():
+        dispatcher.start()
+        await asyncio.sleep(0.2)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    # The failed iteration was retried, and the next one got to the row
+    assert db.fail_next is None
+    assert db.rows[1]["next_attempt_at"] is None
+
+
+def test_chunk_too_large_for_the_webhook_is_split():
+    db = FakeOutbox()
+    for id in range(1, 11):
+        db.add(id, DISCORD, "42", {"status": "到店"})
+    requests = []
+
+    async def webhook(request):
+        notifications = await request.json()
+        requests.append(len(notifications))
+        if len(notifications) > 3:
+            return web.json_response({"message": "too many"}, status=413)
+        return web.json_response({"message": "success"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/webhook", webhook)
+        server = TestServer(app)
+        await server.start_server()
+        dispatcher = OutboxDispatcher(
+            db, str(server.make_url("/webhook")), "test", post_size=10
+        )
+        dispatcher.start()
+        try:
+            await dispatcher.dispatch()
+        finally:
+            await dispatcher.stop()
+            await server.close()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert db.rows == {}
+    assert sum(n for n in requests if n <= 3) == 10
+    assert dispatcher.post_size == 3
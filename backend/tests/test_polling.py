@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from parcel_tw import Platform, TrackingInfo
+from polling import (
+    PollPolicy,
+    PollState,
+    deferred_poll_state,
+    next_poll_state,
+    skip_quiet_hours,
+)
+
+# No jitter, and quiet hours out of the way unless a test sets them
+POLICY = PollPolicy(jitter=0, quiet_hours=(0, 0))
+
+# 12:00 in Taiwan
+NOW = datetime(2024, 5, 1, 4, 0)
+
+
+def tracking(status: str, is_delivered: bool = False) -> TrackingInfo:
+    return TrackingInfo(
+        order_id="12345678",
+        platform=Platform.SevenEleven.value,
+        status=status,
+        time="2024/05/01 11:00",
+        is_delivered=is_delivered,
+        raw_data={},
+    )
+
+
+def polled(unchanged_checks: int = 0, last_changed_at: datetime = NOW) -> PollState:
+    return PollState(
+        status="已出貨",
+        update_time="2024/05/01 09:00",
+        last_changed_at=last_changed_at,
+        unchanged_checks=unchanged_checks,
+        is_delivered=False,
+        next_check_at=NOW,
+    )
+
+
+def interval(state: PollState) -> float:
+    return (state.next_check_at - NOW).total_seconds()
+
+
+def check(previous: PollState, result: TrackingInfo | None, **kwargs) -> PollState:
+    return next_poll_state(
+        Platform.SevenEleven, previous, result, NOW, POLICY, **kwargs
+    )
+
+
+def test_interval_backs_off_while_the_status_is_unchanged():
+    intervals = []
+    state = polled()
+    for _ in range(4):
+        state = check(state, tracking("已出貨"))
+        intervals.append(interval(state))
+
+    assert state.unchanged_checks == 4
+    assert intervals == [
+        pytest.approx(POLICY.base_interval * POLICY.backoff**n) for n in range(1, 5)
+    ]
+
+
+def test_interval_is_capped():
+    state = check(polled(unchanged_checks=50), tracking("已出貨"))
+
+    assert interval(state) == POLICY.max_interval
+
+
+def test_change_resets_the_backoff():
+    state = check(polled(unchanged_checks=7), tracking("包裹配達取件門市"))
+
+    assert state.status == "包裹配達取件門市"
+    assert state.update_time == "2024/05/01 11:00"
+    assert state.last_changed_at == NOW
+    assert state.unchanged_checks == 0
+    assert interval(state) == POLICY.base_interval
+
+
+def test_delivered_parcel_is_checked_slowly():
+    state = check(polled(), tracking("包裹配達取件門市", is_delivered=True))
+
+    assert state.is_delivered
+    assert interval(state) == POLICY.delivered_interval
+
+
+def test_picked_up_parcel_is_not_checked_again():
+    state = check(polled(), tracking("已完成包裹成功取件", is_delivered=True))
+
+    assert state.next_check_at is None
+
+
+def test_long_idle_parcel_is_not_checked_again():
+    idle_since = NOW - timedelta(seconds=POLICY.max_idle + 1)
+    state = check(polled(last_changed_at=idle_since), tracking("已出貨"))
+
+    assert state.next_check_at is None
+
+
+def test_not_found_parcel_is_checked_after_the_not_found_interval():
+    state = check(polled(unchanged_checks=2), None)
+
+    assert state.unchanged_checks == 3
+    assert interval(state) == POLICY.not_found_interval
+
+
+def test_failed_check_keeps_the_state_and_retries_soon():
+    previous = polled(unchanged_checks=5)
+    state = check(previous, None, failed=True)
+
+    assert state.unchanged_checks == 5
+    assert state.status == previous.status
+    assert state.last_changed_at == previous.last_changed_at
+    assert interval(state) == POLICY.failed_interval
+
+
+def test_failed_check_never_stops_polling():
+    idle_since = NOW - timedelta(seconds=POLICY.max_idle + 1)
+    state = check(polled(last_changed_at=idle_since), None, failed=True)
+
+    assert state.next_check_at is not None
+
+
+def test_deferred_check_keeps_the_state():
+    previous = polled(unchanged_checks=3)
+    state = deferred_poll_state(previous, 42, NOW, POLICY)
+
+    assert state.unchanged_checks == 3
+    assert interval(state) == 42
+    assert previous.next_check_at == NOW
+
+
+@pytest.mark.parametrize(
+    "at, expected",
+    [
+        # 02:30 in Taiwan, moved to 06:00
+        (datetime(2024, 5, 1, 18, 30), datetime(2024, 5, 1, 22, 0)),
+        # 01:00 in Taiwan, the start of the quiet hours
+        (datetime(2024, 5, 1, 17, 0), datetime(2024, 5, 1, 22, 0)),
+        # 06:00 and 00:59 in Taiwan are not quiet
+        (datetime(2024, 5, 1, 22, 0), datetime(2024, 5, 1, 22, 0)),
+        (datetime(2024, 5, 1, 16, 59), datetime(2024, 5, 1, 16, 59)),
+    ],
+)
+def test_checks_in_the_quiet_hours_are_moved_to_their_end(at, expected):
+    assert skip_quiet_hours(at, PollPolicy(quiet_hours=(1, 6))) == expected
+
+
+def test_next_check_skips_the_quiet_hours():
+    policy = PollPolicy(jitter=0, quiet_hours=(1, 6))
+    # 00:55 in Taiwan, the next check would be at 01:05
+    now = datetime(2024, 5, 1, 16, 55)
+    state = next_poll_state(
+        Platform.SevenEleven, polled(), tracking("包裹配達取件門市"), now, policy
+    )
+
+    assert state.next_check_at == datetime(2024, 5, 1, 22, 0)
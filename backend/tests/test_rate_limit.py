@@ -0,0 +1,56 @@
+import pytest
+
+from parcel_tw.base import CarrierUnavailableError
+from parcel_tw.rate_limit import RateLimit, TokenBucket
+
+
+def test_burst_is_sent_without_waiting(clock):
+    bucket = TokenBucket("test_burst", RateLimit(rate=2, burst=3))
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+
+
+def test_lookups_past_the_burst_are_spaced_out(clock):
+    bucket = TokenBucket("test_spacing", RateLimit(rate=2, burst=1))
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_tokens_refill_over_time_up_to_the_burst(clock):
+    bucket = TokenBucket("test_refill", RateLimit(rate=2, burst=2))
+    bucket.reserve()
+    bucket.reserve()
+
+    clock.advance(0.5)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    # An idle bucket holds no more than the burst
+    clock.advance(60)
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_lookup_waiting_longer_than_max_wait_is_rejected(clock):
+    bucket = TokenBucket("test_max_wait", RateLimit(rate=1, burst=1, max_wait=2))
+    for _ in range(3):
+        bucket.reserve()
+
+    with pytest.raises(CarrierUnavailableError) as error:
+        bucket.reserve()
+    assert error.value.retry_after == pytest.approx(3)
+    assert bucket.rejected.value == 1
+
+    # The rejected lookup took no token
+    clock.advance(1)
+    assert bucket.reserve() == pytest.approx(2)
+
+
+def test_acquire_sleeps_until_the_token_is_due(clock):
+    bucket = TokenBucket("test_acquire", RateLimit(rate=4, burst=1))
+
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.25)]
@@ -0,0 +1,152 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+import api
+from database import DatabaseError
+from parcel_tw import TrackingError
+from stream import NOT_FOUND, UNAVAILABLE, StreamHub
+
+KEY = (4, "SP123")
+
+
+class FakeParcels:
+    def __init__(self):
+        self.rows: dict[tuple, tuple] = {}
+        self.error: Exception | None = None
+
+    async def fetchall(self, sql, params):
+        if self.error is not None:
+            raise self.error
+        keys = zip(params[::2], params[1::2])
+        return [(*key, *self.rows[key]) for key in keys if key in self.rows]
+
+
+class FakeSnapshot:
+    def __init__(self, result: dict | None = None):
+        self.result = result
+        self.error: Exception | None = None
+        self.calls = 0
+
+    async def __call__(self, key):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def next_status(queue: asyncio.Queue) -> dict:
+    return await asyncio.wait_for(queue.get(), 1)
+
+
+def test_watchers_share_one_snapshot():
+    snapshot = FakeSnapshot({"order_id": "SP123", "status": "已出貨", "time": None})
+    hub = StreamHub(FakeParcels(), snapshot)
+
+    async def run():
+        async with hub.watch(KEY) as first, hub.watch(KEY) as second:
+            assert (await next_status(first))["status"] == "已出貨"
+            assert (await next_status(second))["status"] == "已出貨"
+            async with hub.watch(KEY) as third:
+                assert (await next_status(third))["status"] == "已出貨"
+
+    asyncio.run(run())
+    assert snapshot.calls == 1
+
+
+def test_parcel_in_the_database_is_not_tracked():
+    db = FakeParcels()
+    db.rows[KEY] = ("已出貨", None)
+    snapshot = FakeSnapshot()
+    hub = StreamHub(db, snapshot)
+
+    async def run():
+        async with hub.watch(KEY) as queue:
+            return await next_status(queue)
+
+    assert asyncio.run(run()) == {"order_id": "SP123", "status": "已出貨", "time": None}
+    assert snapshot.calls == 0
+
+
+def test_missing_parcel_is_not_found():
+    hub = StreamHub(FakeParcels(), FakeSnapshot(None))
+
+    async def run():
+        async with hub.watch(KEY) as queue:
+            return await next_status(queue)
+
+    assert asyncio.run(run()) is NOT_FOUND
+
+
+def test_only_changed_statuses_are_published():
+    hub = StreamHub(FakeParcels(), FakeSnapshot({"status": "已出貨"}))
+
+    async def run():
+        async with hub.watch(KEY) as queue:
+            await next_status(queue)
+            hub.publish(KEY, {"status": "已出貨", "time": "later"})
+            assert queue.empty()
+            hub.publish(KEY, {"status": "已到店"})
+            assert (await next_status(queue))["status"] == "已到店"
+
+    asyncio.run(run())
+
+
+def test_failed_snapshot_is_reported_and_retried_by_the_next_watcher():
+    db = FakeParcels()
+    db.error = DatabaseError("gone away")
+    snapshot = FakeSnapshot({"status": "已出貨"})
+    hub = StreamHub(db, snapshot)
+
+    async def run():
+        async with AsyncExitStack() as stack:
+            first = await stack.enter_async_context(hub.watch(KEY))
+            second = await stack.enter_async_context(hub.watch(KEY))
+            assert await next_status(first) is UNAVAILABLE
+            assert await next_status(second) is UNAVAILABLE
+
+            # A watcher joining after the failure loads the parcel again
+            db.error = None
+            async with hub.watch(KEY) as third:
+                assert (await next_status(third))["status"] == "已出貨"
+
+    asyncio.run(run())
+
+
+def test_failed_lookup_is_reported(tracker):
+    tracker.error = TrackingError("[7-11] Failed to solve the captcha")
+    hub = StreamHub(FakeParcels(), api.track_snapshot)
+
+    async def run():
+        async with hub.watch((1, "F123")) as queue:
+            return await next_status(queue)
+
+    assert asyncio.run(run()) is UNAVAILABLE
+
+
+def test_parcel_unknown_to_the_carrier_is_not_found(tracker):
+    hub = StreamHub(FakeParcels(), api.track_snapshot)
+
+    async def run():
+        async with hub.watch((1, "F123")) as queue:
+            return await next_status(queue)
+
+    assert asyncio.run(run()) is NOT_FOUND
+
+
+def test_refresh_publishes_the_changes_from_the_database():
+    db = FakeParcels()
+    db.rows[KEY] = ("已出貨", None)
+    hub = StreamHub(db, FakeSnapshot(), refresh_interval=0.01)
+
+    async def run():
+        hub.start()
+        try:
+            async with hub.watch(KEY) as queue:
+                assert (await next_status(queue))["status"] == "已出貨"
+                db.rows[KEY] = ("已到店", None)
+                assert (await next_status(queue))["status"] == "已到店"
+        finally:
+            await hub.stop()
+
+    asyncio.run(run())
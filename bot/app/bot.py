@@ -1,25 +1,43 @@
-import threading
+import asyncio
+import os
+import weakref
+from collections import OrderedDict
 
-from discord import File
+import discord
 from discord.ext import commands
 
 from .parcel import Parcel
-from .utils import create_embed, get_file_path
-from .webhook import message_queue, run_webhook_server
+from .utils import create_embed, create_thumbnail_file
+from .webhook import create_webhook_server, message_queue
+
+# Number of DMs sent at once. discord.py waits out the rate limit bucket of
+# every DM channel, and the global limit of 50 requests per second, itself.
+DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", 10))
+
+# Number of fetched users kept in memory, with their DM channel
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+# Seconds to send the queued notifications on shutdown
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 10))
 
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.user_cache: OrderedDict[int, discord.User] = OrderedDict()
+        self.notification_tasks: set[asyncio.Task] = set()
 
-    async def on_ready(self):
+        # The DMs of a user are sent in order, one at a time
+        self.user_locks = weakref.WeakValueDictionary()
 
-        # Start the FastAPI webhook server
-        server = threading.Thread(target=run_webhook_server)
-        server.start()
+        self.webhook_server = create_webhook_server()
+        self.webhook_task: asyncio.Task | None = None
+        self.handler_task: asyncio.Task | None = None
 
-        # Start the webhook handler task
-        self.loop.create_task(self.webhook_handler())
+    async def setup_hook(self):
+        """
+        Set the bot up once, before it connects to Discord
+        """
 
         # Load all cogs
         await self.add_cog(Parcel(self))
@@ -27,20 +45,76 @@ class Bot(commands.Bot):
         # Sync application(slash) commands
         await self.tree.sync()
 
+        # Start the FastAPI webhook server and its handler on the bot's loop
+        self.webhook_task = asyncio.create_task(self.webhook_server.serve())
+        self.handler_task = asyncio.create_task(self.webhook_handler())
+
+    async def on_ready(self):
+        # Called again on every reconnect
         print(f'Logged in as {self.user} ({self.user.id})')
 
+    async def close(self):
+        # Stop accepting notifications and send the queued ones first
+        if self.webhook_task is not None:
+            self.webhook_server.should_exit = True
+            await asyncio.wait([self.webhook_task])
+        if self.handler_task is not None:
+            try:
+                await asyncio.wait_for(message_queue.join(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"Dropped {message_queue.qsize()} queued notifications")
+            self.handler_task.cancel()
+        await super().close()
+
     async def webhook_handler(self):
         """
         Handle the webhook requests
+
+        Every notification is sent in its own task, at most `DM_CONCURRENCY`
+        at once. The others wait in the bounded `message_queue`.
         """
 
+        await self.wait_until_ready()
+
+        slots = asyncio.Semaphore(DM_CONCURRENCY)
         while True:
+            await slots.acquire()
             data = await message_queue.get()
+            task = asyncio.create_task(self.send_notification(data, slots))
+            self.notification_tasks.add(task)
+            task.add_done_callback(self.notification_tasks.discard)
+
+    async def send_notification(self, data: dict, slots: asyncio.Semaphore):
+        """
+        Send a parcel status update to the subscriber by DM, then release
+        the slot taken by `webhook_handler`
+        """
+
+        user_id = data["user_id"]
+        lock = self.user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                user = await self.get_or_fetch_user(int(user_id))
+                embed = create_embed("包裹狀態更新", data)
+                file = create_thumbnail_file(data["platform"])
+                await user.send(embed=embed, file=file)
+        except (discord.HTTPException, OSError, ValueError) as e:
+            print(f"Failed to notify {user_id}: {e}")
+        finally:
+            slots.release()
+            message_queue.task_done()
+
+    async def get_or_fetch_user(self, user_id: int) -> discord.User:
+        """
+        Get the user from the cache, or fetch it from the Discord API
+        """
 
-            # Fetch the user
-            user = await self.fetch_user(data["user_id"])
-            embed = create_embed("包裹狀態更新", data)
-            file = File(get_file_path(data["platform"]), filename=f"{data['platform']}.png")
-            await user.send(embed=embed, file=file)
+        user = self.user_cache.get(user_id) or self.get_user(user_id)
+        if user is None:
+            user = await self.fetch_user(user_id)
 
-            message_queue.task_done()
\ No newline at end of file
+        self.user_cache[user_id] = user
+        self.user_cache.move_to_end(user_id)
+        if len(self.user_cache) > USER_CACHE_SIZE:
+            self.user_cache.popitem(last=False)
+        return user
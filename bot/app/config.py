@@ -30,12 +30,13 @@ PLATFORM_TO_ENUM = {
     "shopee": Platform.SHOPEE,
 }
 
+PLATFORM_NAMES = {
+    "seven_eleven": "7-11",
+    "family_mart": "全家",
+    "ok_mart": "OK",
+    "shopee": "蝦皮"
+}
+
 PLATFORM_CHOICES = [
-    Choice(name=name, value=value)
-    for value, name in {
-        "seven_eleven": "7-11",
-        "family_mart": "全家",
-        "ok_mart": "OK",
-        "shopee": "蝦皮"
-    }.items()
+    Choice(name=name, value=value) for value, name in PLATFORM_NAMES.items()
 ]
@@ -1,66 +1,313 @@
+import asyncio
+import json
 import os
+import re
+import time
+from collections.abc import AsyncIterator
 
 import aiohttp
-from discord import File, app_commands
+from discord import app_commands
 from discord.ext import commands
 
 from .config import PLATFORM_CHOICES, PLATFORM_TO_ENUM
-from .utils import create_embed, get_file_path
+from .utils import TTLCache, create_embed, create_thumbnail_file
+from .views import TrackingPages
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 TRACKING_URL = f"{BACKEND_URL}/api/track"
+BATCH_TRACKING_URL = f"{BACKEND_URL}/api/track/batch"
 SUBSCRIPTION_URL = f"{BACKEND_URL}/api/subscriptions"
 
+# Keep-alive connections to the backend, shared by every command
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", 20))
+BACKEND_KEEPALIVE_TIMEOUT = float(os.getenv("BACKEND_KEEPALIVE_TIMEOUT", 30))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", 5))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", 30))
+
+# Seconds a /track result is reused for the same order in the same guild
+TRACK_CACHE_TTL = float(os.getenv("TRACK_CACHE_TTL", 30))
+TRACK_CACHE_SIZE = int(os.getenv("TRACK_CACHE_SIZE", 1000))
+
+# Max parcels of a /track, and min seconds between two edits of its message
+MAX_TRACK_ORDERS = int(os.getenv("MAX_TRACK_ORDERS", 20))
+TRACK_EDIT_INTERVAL = float(os.getenv("TRACK_EDIT_INTERVAL", 1))
+
+# Max subscriptions listed by /mine, read MINE_PAGE_SIZE at a time
+MINE_MAX_SUBSCRIPTIONS = int(os.getenv("MINE_MAX_SUBSCRIPTIONS", 500))
+MINE_PAGE_SIZE = 100
+
 
 class Parcel(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.session: aiohttp.ClientSession | None = None
+        self.track_cache = TTLCache(TRACK_CACHE_TTL, TRACK_CACHE_SIZE)
+
+    async def cog_load(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=BACKEND_POOL_SIZE,
+                keepalive_timeout=BACKEND_KEEPALIVE_TIMEOUT,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=BACKEND_TIMEOUT, sock_connect=BACKEND_CONNECT_TIMEOUT
+            ),
+        )
+
+    async def cog_unload(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def fetch_tracking(
+        self, guild_id: int | None, platform: str, order_id: str
+    ) -> dict | None:
+        """
+        Fetch the parcel status from the backend, or from the cache if it
+        was tracked in the same guild within `TRACK_CACHE_TTL` seconds
+
+        Returns
+        -------
+        dict | None
+            The parcel status, or `None` if the parcel was not found
+
+        Raises
+        ------
+        aiohttp.ClientError
+            If the backend failed
+        """
+
+        key = (guild_id, platform, order_id)
+        cached = self.track_cache.get(key)
+        if cached is not None:
+            return cached["data"]
+
+        url = f"{TRACKING_URL}/{platform}/{order_id}"
+        async with self.session.get(url) as response:
+            # The backend answers 502 or 503 when the lookup failed, which is
+            # raised and never cached, a 404 is a parcel the carrier doesn't
+            # know
+            if response.status == 404 and await self._is_not_found(response):
+                data = None
+            else:
+                response.raise_for_status()
+                data = await response.json()
+
+        # Wrapped so a not found parcel is cached too
+        self.track_cache.set(key, {"data": data})
+        return data
+
+    @staticmethod
+    async def _is_not_found(response: aiohttp.ClientResponse) -> bool:
+        try:
+            body = await response.json()
+        except (aiohttp.ContentTypeError, ValueError):
+            return False
+        return isinstance(body, dict) and body.get("detail") == "Parcel not found"
 
     @commands.command("parcel")
     async def parcel(self, ctx):
         await ctx.send("Parcel command works!")
 
     @commands.hybrid_command("track", description="追蹤包裹")
-    @app_commands.describe(platform="物流平台", order_id="取貨編號")
+    @app_commands.describe(
+        platform="物流平台", order_id="取貨編號，多筆以空白分隔，可用 平台:編號"
+    )
     @app_commands.choices(platform=PLATFORM_CHOICES)
     async def track(
-        self, ctx, platform: str | None = None, order_id: str | None = None
+        self, ctx, platform: str | None = None, *, order_id: str | None = None
     ):
         """
-        Track the parcel status
+        Track the parcel status, of one or several parcels
 
         Example:
 
         `/track seven_eleven 123456789`
+        `/track seven_eleven 123456789 987654321 shopee:TW123456789`
         """
 
-        # Check if platform and order_id are provided
-        if not platform or not order_id:
+        # Check if order_id is provided
+        if not order_id:
             await ctx.send("參數輸入有錯誤喔！")
             return
 
-        # Check if platform is valid
-        platform = platform.lower()
-        if platform not in PLATFORM_TO_ENUM:
+        parcels = parse_orders(platform, order_id)
+        if parcels is None:
             await ctx.send("查不到這個物流平台!")
             return
+        if not parcels:
+            await ctx.send("參數輸入有錯誤喔！")
+            return
+        if len(parcels) > MAX_TRACK_ORDERS:
+            await ctx.send(f"一次最多查詢 {MAX_TRACK_ORDERS} 個包裹！")
+            return
+        if len(parcels) > 1:
+            await self.track_many(ctx, parcels)
+            return
 
-        # Convert platform to enum value
-        platform = PLATFORM_TO_ENUM[platform].value
+        platform, order_id = parcels[0]
 
         # Fetch the parcel status
-        url = f"{TRACKING_URL}/{platform}/{order_id}"
-        async with aiohttp.request("GET", url) as response:
-            if response.status != 200:
-                await ctx.send("找不到這個包裹！")
-                return
+        guild_id = ctx.guild.id if ctx.guild else None
+        try:
+            data = await self.fetch_tracking(guild_id, platform, order_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            await ctx.send("查詢失敗，請稍後再試！")
+            return
+
+        if data is None:
+            await ctx.send("找不到這個包裹！")
+            return
+
+        # Send the parcel status to the user
+        user_id = ctx.author.id
+        embed = create_embed("包裹狀態", data)
+        file = create_thumbnail_file(platform)
 
-            # Send the parcel status to the user
-            user_id = ctx.author.id
-            embed = create_embed("包裹狀態", await response.json())
-            file = File(get_file_path(platform), filename=f"{platform}.png")
+        await ctx.send(f"<@{user_id}>", embed=embed, file=file)
 
-            await ctx.send(f"<@{user_id}>", embed=embed, file=file)
+    async def track_many(self, ctx, parcels: list[tuple[str, str]]):
+        """
+        Track several parcels at once in a single paginated message
+
+        The message is sent right away and edited as the statuses arrive,
+        at most once every `TRACK_EDIT_INTERVAL` seconds.
+        """
+
+        guild_id = ctx.guild.id if ctx.guild else None
+        results = [{"platform": p, "order_id": o} for p, o in parcels]
+        pending = {}
+        for result in results:
+            key = (guild_id, result["platform"], result["order_id"])
+            cached = self.track_cache.get(key)
+            if cached is None:
+                pending[(result["platform"], result["order_id"])] = result
+            elif cached["data"] is None:
+                result["error"] = "找不到這個包裹！"
+            else:
+                result.update(cached["data"], order_id=result["order_id"])
+
+        # The platform image is uploaded once, only if there is one platform
+        platforms = {p for p, _ in parcels}
+        thumbnail = platforms.pop() if len(platforms) == 1 else None
+
+        pages = TrackingPages(ctx.author.id, results, thumbnail=thumbnail)
+        kwargs = {"view": pages} if pages.pages > 1 else {}
+        if thumbnail:
+            kwargs["file"] = create_thumbnail_file(thumbnail)
+        message = await ctx.send(
+            f"<@{ctx.author.id}>", embed=pages.create_embed(), **kwargs
+        )
+        pages.message = message
+
+        async def edit():
+            await message.edit(embed=pages.create_embed())
+
+        last_edit = time.monotonic()
+        try:
+            async for item in self.stream_tracking(list(pending)):
+                result = pending.pop((item["platform"], item["order_id"]), None)
+                if result is None:
+                    continue
+                if item.get("unavailable"):
+                    # The carrier is only unavailable for now, so not cached
+                    result["error"] = "查詢失敗，請稍後再試！"
+                else:
+                    if "error" in item:
+                        result["error"] = "找不到這個包裹！"
+                        data = None
+                    else:
+                        result.update(item)
+                        data = item
+                    self.track_cache.set(
+                        (guild_id, item["platform"], item["order_id"]), {"data": data}
+                    )
+
+                if time.monotonic() - last_edit >= TRACK_EDIT_INTERVAL:
+                    await edit()
+                    last_edit = time.monotonic()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            for result in pending.values():
+                result["error"] = "查詢失敗，請稍後再試！"
+
+        await edit()
+
+    async def stream_tracking(
+        self, parcels: list[tuple[str, str]]
+    ) -> AsyncIterator[dict]:
+        """
+        Track parcels with the batch endpoint of the backend, yielding each
+        result as soon as the backend sends it
+
+        Raises
+        ------
+        aiohttp.ClientError
+            If the backend failed
+        """
+
+        if not parcels:
+            return
+
+        payload = {"parcels": [{"platform": p, "order_id": o} for p, o in parcels]}
+        # The lookups resolve one by one, only the wait for each is bounded
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=BACKEND_CONNECT_TIMEOUT, sock_read=BACKEND_TIMEOUT
+        )
+        async with self.session.post(
+            BATCH_TRACKING_URL, json=payload, timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    @commands.hybrid_command("mine", description="我訂閱的包裹")
+    async def mine(self, ctx):
+        """
+        List the parcels the user is subscribed to, with their latest status
+        """
+
+        try:
+            subscriptions = await self.fetch_subscriptions(str(ctx.author.id))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            await ctx.send("查詢失敗，請稍後再試！")
+            return
+
+        if not subscriptions:
+            await ctx.send("目前沒有訂閱任何包裹！")
+            return
+
+        pages = TrackingPages(
+            ctx.author.id, subscriptions, title=f"我訂閱的包裹 ({len(subscriptions)})"
+        )
+        kwargs = {"view": pages} if pages.pages > 1 else {}
+        pages.message = await ctx.send(
+            f"<@{ctx.author.id}>", embed=pages.create_embed(), **kwargs
+        )
+
+    async def fetch_subscriptions(self, discord_id: str) -> list[dict]:
+        """
+        Fetch the subscriptions of a discord user, page by page
+
+        Raises
+        ------
+        aiohttp.ClientError
+            If the backend failed
+        """
+
+        subscriptions = []
+        params = {"discord_id": discord_id, "limit": MINE_PAGE_SIZE}
+        while len(subscriptions) < MINE_MAX_SUBSCRIPTIONS:
+            async with self.session.get(SUBSCRIPTION_URL, params=params) as response:
+                response.raise_for_status()
+                page = await response.json()
+
+            subscriptions += page["subscriptions"]
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+
+        return subscriptions[:MINE_MAX_SUBSCRIPTIONS]
 
     @commands.hybrid_command("subscribe", description="訂閱包裹狀態")
     @app_commands.describe(platform="物流平台", order_id="取貨編號")
@@ -89,13 +336,20 @@ class Parcel(commands.Cog):
             "order_id": order_id
         }
 
-        async with aiohttp.request("POST", SUBSCRIPTION_URL, json=payload) as response:
-            if response.status == 200:
-                await ctx.send("訂閱成功！")
-            elif response.status == 409:
-                await ctx.send("已訂閱過此包裹！")
-            else:
-                await ctx.send("訂閱失敗，請稍後再試！")
+        try:
+            async with self.session.post(SUBSCRIPTION_URL, json=payload) as response:
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = None
+
+        if status == 200:
+            await ctx.send("訂閱成功！")
+        elif status == 409:
+            await ctx.send("已訂閱過此包裹！")
+        elif status == 404:
+            await ctx.send("找不到這個包裹！")
+        else:
+            await ctx.send("訂閱失敗，請稍後再試！")
 
     @commands.hybrid_command("unsubscribe", description="取消訂閱包裹狀態")
     @app_commands.describe(platform="物流平台", order_id="取貨編號")
@@ -124,13 +378,48 @@ class Parcel(commands.Cog):
             "order_id": order_id
         }
 
-        async with aiohttp.request(
-            "DELETE", SUBSCRIPTION_URL, json=payload
-        ) as response:
-            if response.status == 200:
-                await ctx.send("取消訂閱成功！")
-            elif response.status == 404:
-                await ctx.send("找不到訂閱的包裹！")
-            else:
-                await ctx.send("取消訂閱失敗，請稍後再試！")
-                await ctx.send("取消訂閱失敗，請稍後再試！")
+        try:
+            async with self.session.delete(SUBSCRIPTION_URL, json=payload) as response:
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = None
+
+        if status == 200:
+            await ctx.send("取消訂閱成功！")
+        elif status == 404:
+            await ctx.send("找不到訂閱的包裹！")
+        else:
+            await ctx.send("取消訂閱失敗，請稍後再試！")
+
+
+def parse_orders(platform: str | None, order_ids: str) -> list[tuple[str, str]] | None:
+    """
+    Parse the order ids of a /track into (platform, order_id) pairs
+
+    Parameters
+    ----------
+    platform : str | None
+        The platform of the order ids without one
+    order_ids : str
+        Order ids separated by spaces or commas, each may be prefixed with
+        its own platform, e.g. `shopee:TW123456789`
+
+    Returns
+    -------
+    list[tuple[str, str]] | None
+        The unique (platform, order_id) pairs in order, or `None` if a
+        platform is missing or invalid
+    """
+
+    parcels = []
+    for token in re.split(r"[\s,]+", order_ids.strip()):
+        if not token:
+            continue
+        name, separator, order_id = token.partition(":")
+        if not separator:
+            name, order_id = platform or "", token
+        name = name.lower()
+        if name not in PLATFORM_TO_ENUM or not order_id:
+            return None
+        parcels.append((PLATFORM_TO_ENUM[name].value, order_id))
+    return list(dict.fromkeys(parcels))
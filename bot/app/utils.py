@@ -1,6 +1,12 @@
+import io
 import os
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from functools import cache
+from typing import Any
 
-from discord import Embed
+from discord import Embed, File
 
 
 def create_embed(title: str, response: dict) -> Embed:
@@ -23,3 +29,61 @@ def get_file_path(platform: str) -> str:
     """
 
     return f"{os.path.dirname(os.path.abspath(__file__))}/static/imgs/{platform}.png"
+
+
+@cache
+def load_thumbnail(platform: str) -> bytes:
+    """
+    Read the platform image once and keep its bytes in memory
+    """
+
+    with open(get_file_path(platform), "rb") as f:
+        return f.read()
+
+
+def create_thumbnail_file(platform: str) -> File:
+    """
+    Create the attachment of the platform image for a message
+
+    A `File` is consumed when the message is sent, so every message needs
+    its own.
+    """
+
+    return File(io.BytesIO(load_thumbnail(platform)), filename=f"{platform}.png")
+
+
+class TTLCache:
+    def __init__(self, ttl: float, max_size: int = 1000):
+        """
+        In-memory LRU cache whose entries expire after `ttl` seconds
+
+        Parameters
+        ----------
+        ttl : float
+            Seconds an entry is kept
+        max_size : int
+            The max number of entries, the least recently used go first
+        """
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
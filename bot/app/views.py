@@ -0,0 +1,106 @@
+import discord
+from discord import Embed
+
+from .config import PLATFORM_NAMES
+
+# Number of parcels shown on a page of a multi-order /track
+PAGE_SIZE = 5
+
+
+class TrackingPages(discord.ui.View):
+    def __init__(
+        self,
+        author_id: int,
+        results: list[dict],
+        title: str = "包裹狀態",
+        thumbnail: str | None = None,
+        timeout: float = 600,
+    ):
+        """
+        Paginated embed of the status of several parcels
+
+        The results are updated in place as the statuses arrive, a result
+        without a `status` or an `error` is still being tracked.
+
+        Parameters
+        ----------
+        author_id : int
+            The user who may turn the pages
+        results : list[dict]
+            The tracked parcels, each with a `platform` and an `order_id`
+        title : str
+            The title of the embed, followed by the progress while tracking
+        thumbnail : str | None
+            The platform of the attached image shown on every page
+        timeout : float
+            Seconds after the last interaction the buttons stop working
+
+        Set `message` to the message the view is sent with, so its buttons
+        are disabled once they stop working.
+        """
+
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.results = results
+        self.title = title
+        self.thumbnail = thumbnail
+        self.page = 0
+        self.pages = (len(results) + PAGE_SIZE - 1) // PAGE_SIZE
+        self.message: discord.Message | None = None
+        self.update_buttons()
+
+    def create_embed(self) -> Embed:
+        title = self.title
+        done = sum("status" in r or "error" in r for r in self.results)
+        if done < len(self.results):
+            title += f" ({done}/{len(self.results)})"
+        embed = Embed(title=title)
+        if self.thumbnail:
+            embed.set_thumbnail(url=f"attachment://{self.thumbnail}.png")
+
+        start = self.page * PAGE_SIZE
+        for result in self.results[start : start + PAGE_SIZE]:
+            name = f"{PLATFORM_NAMES[result['platform']]} {result['order_id']}"
+            if "error" in result:
+                value = result["error"]
+            elif "status" in result:
+                value = result["status"]
+                if result.get("time") is not None:
+                    value += f"\n{result['time']}"
+            else:
+                value = "查詢中…"
+            embed.add_field(name=name, value=value, inline=False)
+
+        if self.pages > 1:
+            embed.set_footer(text=f"第 {self.page + 1}/{self.pages} 頁")
+        return embed
+
+    def update_buttons(self):
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page >= self.pages - 1
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            # The message was deleted, or the bot can't see it anymore
+            pass
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.author_id
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button):
+        self.page = max(self.page - 1, 0)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button):
+        self.page = min(self.page + 1, self.pages - 1)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
@@ -1,24 +1,52 @@
 import asyncio
+import os
+from contextlib import contextmanager
 
 import uvicorn
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
 PAYLOAD_SCHEMA = ["user_id", "platform", "order_id", "status", "time"]
 
+# Notifications waiting for a DM. When the queue is full the webhook responds
+# with a 429, and the backend retries after WEBHOOK_RETRY_AFTER seconds.
+WEBHOOK_QUEUE_SIZE = max(int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000)), 1)
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", 5))
+
 webhook = FastAPI()
-message_queue = asyncio.Queue()
+message_queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
 
 @webhook.post("/webhook")
 async def webhook_handler(request: Request):
     """
     Put the webhook data into the message queue
+
+    The data is a single notification, or an array of notifications which
+    are queued in order. Invalid notifications of an array are skipped. An
+    array is queued entirely or not at all, so a retried request doesn't
+    send the queued part twice.
     """
 
     data = await request.json()
+    notifications = data if isinstance(data, list) else [data]
+
+    valid = [item for item in notifications if is_valid_payload(item)]
+    if len(valid) > WEBHOOK_QUEUE_SIZE:
+        return JSONResponse(
+            status_code=413, content={"message": "too many notifications"}
+        )
+    if len(valid) > WEBHOOK_QUEUE_SIZE - message_queue.qsize():
+        return JSONResponse(
+            status_code=429,
+            content={"message": "queue full"},
+            headers={"Retry-After": str(WEBHOOK_RETRY_AFTER)},
+        )
 
-    if is_valid_payload(data):
-        await message_queue.put(data)
-        return {"message": "success"}
+    for item in valid:
+        message_queue.put_nowait(item)
+
+    if valid or not notifications:
+        return {"message": "success", "accepted": len(valid)}
     else:
         return {"message": "invalid payload"}
 
@@ -37,11 +65,29 @@ def is_valid_payload(data: dict) -> bool:
         True if the data is valid, False otherwise
     """
 
+    if not isinstance(data, dict):
+        return False
+
     for key in PAYLOAD_SCHEMA:
         if key not in data:
             return False
 
     return True
 
-def run_webhook_server():
-    uvicorn.run(webhook, host="0.0.0.0", port=3000)
\ No newline at end of file
+class WebhookServer(uvicorn.Server):
+    """
+    Uvicorn server run as a task on the bot's event loop
+
+    The signals are left to discord.py, which stops the server in
+    `Bot.close`.
+    """
+
+    @contextmanager
+    def capture_signals(self):
+        yield
+
+    def install_signal_handlers(self):
+        pass
+
+def create_webhook_server() -> WebhookServer:
+    return WebhookServer(uvicorn.Config(webhook, host="0.0.0.0", port=3000))
@@ -5,7 +5,18 @@ CREATE TABLE IF NOT EXISTS Parcels (
         platform_id INT NOT NULL,
         status VARCHAR(255) NOT NULL,
         update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE KEY (order_id)
+        -- Polling schedule, a NULL next_check_at stops polling the parcel
+        next_check_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        last_changed_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        unchanged_checks INT NOT NULL DEFAULT 0,
+        is_delivered BOOLEAN NOT NULL DEFAULT FALSE,
+        -- The backend replica polling the parcel, until next_check_at
+        leased_by VARCHAR(64) NULL,
+        UNIQUE KEY uq_parcels_parcel (platform_id, order_id),
+        -- Covers the Parcels side of the subscription poller join
+        INDEX idx_parcels_status (platform_id, order_id, status, update_time),
+        -- The poll queue, parcels due first
+        INDEX idx_parcels_next_check (next_check_at, platform_id, order_id)
 );
 CREATE TABLE IF NOT EXISTS Subscriptions (
         sub_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -18,11 +29,30 @@ CREATE TABLE IF NOT EXISTS Subscriptions (
                 email IS NOT NULL
                 OR discord_id IS NOT NULL
         ),
-        FOREIGN KEY (order_id) REFERENCES Parcels (order_id),
-        UNIQUE (email, discord_id, order_id, platform_id)
+        CONSTRAINT fk_subscriptions_parcel FOREIGN KEY (platform_id, order_id) REFERENCES Parcels (platform_id, order_id),
+        -- Also covers the Subscriptions side of the subscription poller join
+        UNIQUE KEY uq_subscriptions_subscriber (platform_id, order_id, email, discord_id),
+        INDEX idx_subscriptions_email (email, platform_id, order_id),
+        INDEX idx_subscriptions_discord_id (discord_id, platform_id, order_id)
 );
 CREATE TABLE IF NOT EXISTS Platforms (
         platform_id INT AUTO_INCREMENT PRIMARY KEY,
         name VARCHAR(255) UNIQUE NOT NULL
 );
-CREATE INDEX idx_order_id ON Parcels (order_id);
\ No newline at end of file
+-- Notifications of status changes, written in the transaction storing the
+-- change and deleted once delivered
+CREATE TABLE IF NOT EXISTS NotificationOutbox (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        -- Only discord for now, the recipient is its user id
+        channel VARCHAR(16) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        payload JSON NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attempts INT NOT NULL DEFAULT 0,
+        -- NULL once the delivery is given up
+        next_attempt_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        -- The backend replica delivering the notification, until next_attempt_at
+        leased_by VARCHAR(64) NULL,
+        last_error VARCHAR(255) NULL,
+        INDEX idx_outbox_next_attempt (next_attempt_at)
+);
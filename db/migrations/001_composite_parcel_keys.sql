@@ -0,0 +1,71 @@
+-- Key parcels by (platform_id, order_id) instead of order_id alone, and add
+-- the indexes used by the subscription lookups and the poller join.
+-- Brings a database created by the previous init.sql up to the current one:
+--   mysql -u root -p parcel_tracker_db < db/migrations/001_composite_parcel_keys.sql
+USE parcel_tracker_db;
+
+-- The previous init.sql didn't name its keys, so the names MySQL generated
+-- for them are looked up by their columns instead of assumed.
+
+-- The old foreign key on order_id alone
+SET @drop_keys = NULL;
+SELECT CONCAT('ALTER TABLE Subscriptions DROP FOREIGN KEY `', CONSTRAINT_NAME, '`')
+INTO @drop_keys
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = 'Subscriptions'
+        AND REFERENCED_TABLE_NAME = 'Parcels'
+GROUP BY CONSTRAINT_NAME
+HAVING GROUP_CONCAT(COLUMN_NAME ORDER BY ORDINAL_POSITION) = 'order_id';
+SET @drop_keys = IFNULL(@drop_keys, 'DO 0');
+PREPARE drop_keys FROM @drop_keys;
+EXECUTE drop_keys;
+DEALLOCATE PREPARE drop_keys;
+
+-- The index created for the old foreign key, and the old unique key
+SELECT CONCAT(
+        'ALTER TABLE Subscriptions ',
+        GROUP_CONCAT(CONCAT('DROP INDEX `', INDEX_NAME, '`') SEPARATOR ', ')
+)
+INTO @drop_keys
+FROM (
+        SELECT INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS key_columns
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Subscriptions'
+        GROUP BY INDEX_NAME
+) AS subscription_keys
+WHERE key_columns IN ('order_id', 'email,discord_id,order_id,platform_id');
+SET @drop_keys = IFNULL(@drop_keys, 'DO 0');
+PREPARE drop_keys FROM @drop_keys;
+EXECUTE drop_keys;
+DEALLOCATE PREPARE drop_keys;
+
+-- The unique key on order_id alone, and the redundant idx_order_id
+SELECT CONCAT(
+        'ALTER TABLE Parcels ',
+        GROUP_CONCAT(CONCAT('DROP INDEX `', INDEX_NAME, '`') SEPARATOR ', ')
+)
+INTO @drop_keys
+FROM (
+        SELECT INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS key_columns
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Parcels'
+        GROUP BY INDEX_NAME
+) AS parcel_keys
+WHERE key_columns = 'order_id';
+SET @drop_keys = IFNULL(@drop_keys, 'DO 0');
+PREPARE drop_keys FROM @drop_keys;
+EXECUTE drop_keys;
+DEALLOCATE PREPARE drop_keys;
+
+ALTER TABLE Parcels
+        ADD UNIQUE KEY uq_parcels_parcel (platform_id, order_id),
+        ADD INDEX idx_parcels_status (platform_id, order_id, status, update_time);
+
+ALTER TABLE Subscriptions
+        ADD UNIQUE KEY uq_subscriptions_subscriber (platform_id, order_id, email, discord_id),
+        ADD INDEX idx_subscriptions_email (email, platform_id, order_id),
+        ADD INDEX idx_subscriptions_discord_id (discord_id, platform_id, order_id),
+        ADD CONSTRAINT fk_subscriptions_parcel FOREIGN KEY (platform_id, order_id) REFERENCES Parcels (platform_id, order_id);
+
+ANALYZE TABLE Parcels, Subscriptions;
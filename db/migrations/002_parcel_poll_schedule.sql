@@ -0,0 +1,12 @@
+-- Per-parcel polling schedule, replacing the fixed 10 minute sweep.
+-- Every existing parcel is due right away and gets its interval on its
+-- first check:
+--   mysql -u root -p parcel_tracker_db < db/migrations/002_parcel_poll_schedule.sql
+USE parcel_tracker_db;
+
+ALTER TABLE Parcels
+        ADD COLUMN next_check_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        ADD COLUMN last_changed_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        ADD COLUMN unchanged_checks INT NOT NULL DEFAULT 0,
+        ADD COLUMN is_delivered BOOLEAN NOT NULL DEFAULT FALSE,
+        ADD INDEX idx_parcels_next_check (next_check_at, platform_id, order_id);
@@ -0,0 +1,6 @@
+-- Replicas lease chunks of due parcels, leased_by records the holder:
+--   mysql -u root -p parcel_tracker_db < db/migrations/003_parcel_poll_leases.sql
+USE parcel_tracker_db;
+
+ALTER TABLE Parcels
+        ADD COLUMN leased_by VARCHAR(64) NULL AFTER is_delivered;
@@ -0,0 +1,17 @@
+-- Status change notifications go through an outbox table instead of being
+-- posted to the bot from the poller:
+--   mysql -u root -p parcel_tracker_db < db/migrations/004_notification_outbox.sql
+USE parcel_tracker_db;
+
+CREATE TABLE IF NOT EXISTS NotificationOutbox (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        channel VARCHAR(16) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        payload JSON NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+        leased_by VARCHAR(64) NULL,
+        last_error VARCHAR(255) NULL,
+        INDEX idx_outbox_next_attempt (next_attempt_at)
+);